@@ -0,0 +1,120 @@
+'''
+    HLS master playlist parser, old regex parser vs `mcat_providers.utils.hls`.
+
+    $ python benchmarks/hls_parser.py
+    $ python benchmarks/hls_parser.py --variants 5000 --runs 20
+
+    Builds a large synthetic master playlist (variants, audio/subtitle renditions, i-frame playlists,
+    comments) and reports the best time and the peak allocations of each parser.
+'''
+import re
+import sys
+import time
+import argparse
+import tracemalloc
+from typing import Callable, List, Tuple
+
+from mcat_providers.utils.hls import parse_master
+
+# The parser `BaseProvider.parse_m3u8` used before, minus the `Stream` construction
+_URL_PATTERN = re.compile(r"^(https:\/\/.+)$")
+_TARGET_PATTERNS = {
+    "bandwith": re.compile(r"BANDWIDTH=(\d+)"),
+    "quality": re.compile(r"RESOLUTION=(\d+x\d+)"),
+    "codecs": re.compile(r"CODECS=(?:\"|\')([^\"\']+)"),
+    "uri": re.compile(r"URI=(?:\"|\')([^\'\"]+)")
+}
+
+def legacy_parse(m3u8_url: str, m3u8_data: str) -> List:
+    def get_provider_data():
+        return {"provider": "Legacy", "headers": None, "url": "", "ext": ".m3u8", "quality": ""}
+
+    parsed_data = get_provider_data()
+    parsed = []
+    expect_url = False
+    for item in m3u8_data.strip().split("\n"):
+        if expect_url:
+            url_match = _URL_PATTERN.search(item)
+            if not url_match:
+                continue
+            parsed_data.update({"url": url_match.group(1)})
+            parsed.append(parsed_data)
+            parsed_data = get_provider_data()
+            expect_url = False
+            continue
+        data = {}
+        for target, pattern in _TARGET_PATTERNS.items():
+            regex_match = pattern.search(item)
+            if regex_match:
+                data.update({target: regex_match.group(1)})
+        if data.get("uri"):
+            uri = data.pop("uri")
+            if not uri.startswith("/"): uri = f"/{uri}"
+            data.update({"url": f"{m3u8_url}{uri}"})
+            parsed_data.update(data)
+            parsed.append(parsed_data)
+            parsed_data = get_provider_data()
+            continue
+        if data:
+            expect_url = True
+            parsed_data.update(data)
+    return parsed
+
+def synthetic_playlist(variants: int) -> str:
+    lines = ["#EXTM3U", "#EXT-X-VERSION:6", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    for i in range(max(variants // 10, 1)):
+        lines.append(f'#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud{i % 4}",NAME="Audio {i}",LANGUAGE="en",DEFAULT=NO,AUTOSELECT=YES,CHANNELS="6",URI="https://cdn.example.com/a/{i}/audio.m3u8"')
+        lines.append(f'#EXT-X-MEDIA:TYPE=SUBTITLES,GROUP-ID="sub",NAME="Subs {i}",LANGUAGE="fr",URI="https://cdn.example.com/s/{i}/subs.m3u8"')
+    resolutions = ("640x360", "854x480", "1280x720", "1920x1080")
+    for i in range(variants):
+        lines.append(f"## variant {i}")
+        lines.append(
+            f'#EXT-X-STREAM-INF:BANDWIDTH={500000 + i},AVERAGE-BANDWIDTH={450000 + i},RESOLUTION={resolutions[i % 4]},'
+            f'FRAME-RATE=23.976,CODECS="avc1.64001f,mp4a.40.2",AUDIO="aud{i % 4}",SUBTITLES="sub"'
+        )
+        lines.append(f"https://cdn.example.com/v/{i}/index.m3u8")
+    for i in range(max(variants // 10, 1)):
+        lines.append(f'#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH={90000 + i},RESOLUTION=640x360,CODECS="avc1.64001f",URI="https://cdn.example.com/i/{i}/iframe.m3u8"')
+    return "\n".join(lines)
+
+def measure(fn: Callable[[], object], runs: int) -> Tuple[float, int]:
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def main(argv: List[str] = sys.argv[1:]) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--variants", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    url = "https://cdn.example.com/master.m3u8"
+    data = synthetic_playlist(args.variants)
+    print(f"{len(data.splitlines())} lines, {len(data) / 1024:.1f}KiB")
+
+    playlist = parse_master(data, url)
+    print(f"variants={len(playlist.variants)} renditions={len(playlist.renditions)} iframes={len(playlist.iframe_variants)}")
+
+    results = {
+        "legacy": measure(lambda: legacy_parse(url.rpartition("/")[0], data), args.runs),
+        "hls": measure(lambda: parse_master(data, url), args.runs),
+        # Same fields the legacy parser pulls out, attribute lists are only split when read
+        "hls+attrs": measure(lambda: [
+            (variant.bandwidth, variant.resolution, variant.codecs) for variant in parse_master(data, url).variants
+        ], args.runs),
+    }
+    for name, (seconds, peak) in results.items():
+        print(f"\t{name:10} {seconds * 1000:8.2f}ms  peak {peak / 1024:8.1f}KiB")
+    speedup = results["legacy"][0] / results["hls"][0]
+    print(f"speedup x{speedup:.2f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
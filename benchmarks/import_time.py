@@ -0,0 +1,62 @@
+'''
+    Import time budget for `import mcat_providers`.
+
+    $ python benchmarks/import_time.py
+    $ python benchmarks/import_time.py --budget-ms 30 --module mcat_providers
+
+    Runs the import in a fresh interpreter under `python -X importtime` and exits non-zero
+    if it goes over budget or pulls in one of the heavy modules that should stay lazy.
+'''
+import re
+import sys
+import argparse
+import subprocess
+from typing import Dict, List, Tuple
+
+HEAVY_MODULES = ("httpx", "click", "rich", "dotenv", "pythonmonkey", "asyncio")
+_LINE_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+def measure(module: str, runs: int) -> Tuple[float, Dict[str, int]]:
+    best = float("inf")
+    best_imports: Dict[str, int] = {}
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True, text=True, check=True
+        )
+        imports: Dict[str, int] = {}
+        for line in proc.stderr.splitlines():
+            match = _LINE_PATTERN.match(line)
+            if match:
+                imports[match.group(4)] = int(match.group(2))
+        total = imports.get(module, 0) / 1000
+        if total < best:
+            best, best_imports = total, imports
+    return best, best_imports
+
+def main(argv: List[str] = sys.argv[1:]) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="mcat_providers")
+    parser.add_argument("--budget-ms", type=float, default=25.0)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    total_ms, imports = measure(args.module, args.runs)
+    heavy = sorted(name for name in imports if name.split(".")[0] in HEAVY_MODULES)
+    slowest = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:10]
+
+    print(f"import {args.module}: {total_ms:.2f}ms (budget {args.budget_ms:.2f}ms, best of {args.runs})")
+    for name, cumulative in slowest:
+        print(f"\t{cumulative / 1000:8.2f}ms  {name}")
+
+    failed = False
+    if heavy:
+        print(f"Heavy modules imported eagerly: {heavy}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print("Over budget!")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
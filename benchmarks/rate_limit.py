@@ -0,0 +1,116 @@
+'''
+    Per host AIMD limiter against a local stand-in server that throttles.
+
+    $ python benchmarks/rate_limit.py
+    $ python benchmarks/rate_limit.py --requests 400 --server-rate 40 --server-concurrency 8 --latency 0.02
+
+    The server allows `--server-rate` requests/s (bucket of one second) and `--server-concurrency` at once,
+    anything over that gets a 429 with `Retry-After: 1`. The same burst of GETs is sent through `HttpTransport`
+    with the limiter off and on (starting well above what the server allows) and the 429s, failed requests and
+    wall time of each are reported. Exits non-zero if the limited run lost any request.
+'''
+import sys
+import time
+import logging
+import httpx
+import asyncio
+import argparse
+from typing import Dict, List
+
+from mcat_providers.transport import HttpTransport, TransportConfig
+
+class ThrottlingServer:
+    def __init__(self, rate: float, concurrency: int, latency: float) -> None:
+        self.rate = rate
+        self.concurrency = concurrency
+        self.latency = latency
+        self.tokens = rate
+        self.refilled = time.monotonic()
+        self.inflight = 0
+        self.stats = {"ok": 0, "throttled": 0}
+
+    def admit(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens < 1 or self.inflight >= self.concurrency:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                if self.admit():
+                    self.inflight += 1
+                    try:
+                        await asyncio.sleep(self.latency)
+                    finally:
+                        self.inflight -= 1
+                    self.stats["ok"] += 1
+                    head, body = "HTTP/1.1 200 OK\r\n", b"ok"
+                else:
+                    self.stats["throttled"] += 1
+                    head, body = "HTTP/1.1 429 Too Many Requests\r\nRetry-After: 1\r\n", b"slow down"
+                writer.write(f"{head}Content-Length: {len(body)}\r\n\r\n".encode() + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+async def burst(url: str, requests: int, config: TransportConfig) -> Dict:
+    transport = HttpTransport(config)
+    start = time.perf_counter()
+    responses: List = await asyncio.gather(*(transport.get(url, site="bench") for _ in range(requests)), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    await transport.aclose()
+    ok = sum(1 for response in responses if isinstance(response, httpx.Response) and response.is_success)
+    return {"ok": ok, "failed": requests - ok, "seconds": round(elapsed, 2), "retries": transport.stats["throttle_retries"], "hosts": transport.limiter_stats()}
+
+async def run(args: argparse.Namespace) -> int:
+    code = 0
+    for limited in (False, True):
+        app = ThrottlingServer(args.server_rate, args.server_concurrency, args.latency)
+        server = await asyncio.start_server(app.handle, host="127.0.0.1", port=0)
+        port = server.sockets[0].getsockname()[1]
+        config = TransportConfig(
+            rate_limit=limited,
+            # Start 5x above what the server takes and let AIMD find the limit
+            host_rates={"127.0.0.1": args.server_rate * 5},
+            host_limits={"127.0.0.1": args.server_concurrency * 4},
+            throttle_retries=args.retries,
+        )
+        result = await burst(f"http://127.0.0.1:{port}/", args.requests, config)
+        server.close()
+        await server.wait_closed()
+
+        name = "limited" if limited else "unlimited"
+        print(f"\t{name:10} ok={result['ok']:5} failed={result['failed']:5} server_429s={app.stats['throttled']:5} retries={result['retries']:5} {result['seconds']:6.2f}s")
+        if limited:
+            host = result["hosts"]["127.0.0.1"]
+            print(f"\t{'':10} settled at rate={host['rate']}/s concurrency={host['concurrency']} decreases={host['decreases']} paused={host['paused']}")
+            if result["failed"]:
+                code = 1
+    return code
+
+def main(argv: List[str] = sys.argv[1:]) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--server-rate", type=float, default=50.0)
+    parser.add_argument("--server-concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--retries", type=int, default=8, help="Retries per request on 429 for the limited run")
+    args = parser.parse_args(argv)
+    # The unlimited run times out plenty, one line per request is just noise
+    logging.disable(logging.ERROR)
+    print(f"{args.requests} requests, server takes {args.server_rate}/s and {args.server_concurrency} at once")
+    return asyncio.run(run(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+'''
+    Result serialisation, `json.dumps(result.as_dict)` vs `mcat_providers.utils.serialize`.
+
+    $ python benchmarks/serialize.py
+    $ python benchmarks/serialize.py --providers 4 --streams 500 --runs 20
+
+    "cold" encodes freshly built results, "warm" encodes the same results again (streams, subtitles and
+    header sets keep their encoded fragments, which is what a long running server sees for cached titles).
+    Every format is loaded back and compared against the original before timing.
+'''
+import sys
+import json
+import time
+import argparse
+from typing import Callable, List, Tuple
+
+from mcat_providers.utils.types import ProviderHeaders, Subtitle, Stream, ProviderResponse, SourceResponse
+from mcat_providers.utils.serialize import to_json_bytes, loads_json, packb, unpackb
+
+def synthetic_result(providers: int, streams: int) -> SourceResponse:
+    qualities = ("640x360", "854x480", "1280x720", "1920x1080")
+    responses = []
+    for p in range(providers):
+        headers = ProviderHeaders(origin=f"https://provider{p}.example.com", referrer=f"https://provider{p}.example.com")
+        responses.append(ProviderResponse(
+            provider=f"Provider{p}",
+            streams=[
+                Stream(
+                    provider=f"Provider{p}",
+                    headers=headers,
+                    url=f"https://cdn{p}.example.com/{s:06d}/index-{qualities[s % 4]}.m3u8?token=abcdef{s}",
+                    ext=".m3u8",
+                    quality=qualities[s % 4],
+                    codec="avc1.64001f,mp4a.40.2",
+                    bandwith=500_000 + s,
+                    frame_rate=23.976,
+                )
+                for s in range(streams)
+            ],
+            subtitles=[Subtitle(language=f"Language {s}", url=f"https://cdn{p}.example.com/subs/{s}.vtt", ext=".vtt") for s in range(20)],
+        ))
+    return SourceResponse(source="Synthetic", providers=responses)
+
+def measure(fn: Callable[[SourceResponse], bytes], results: List[SourceResponse]) -> Tuple[float, int]:
+    best = float("inf")
+    size = 0
+    for result in results:
+        start = time.perf_counter()
+        size = len(fn(result))
+        best = min(best, time.perf_counter() - start)
+    return best, size
+
+def main(argv: List[str] = sys.argv[1:]) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--providers", type=int, default=4)
+    parser.add_argument("--streams", type=int, default=250)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    result = synthetic_result(args.providers, args.streams)
+    expected = json.dumps(result.as_dict).encode()
+    assert to_json_bytes(result) == expected, "to_json_bytes differs from json.dumps(as_dict)"
+    assert loads_json(expected).as_dict == result.as_dict, "JSON round trip failed"
+    assert unpackb(packb(result)).as_dict == result.as_dict, "MessagePack round trip failed"
+
+    def cold() -> List[SourceResponse]:
+        return [synthetic_result(args.providers, args.streams) for _ in range(args.runs)]
+
+    rows = {
+        "as_dict+json.dumps": measure(lambda r: json.dumps(r.as_dict).encode(), cold()),
+        "to_json_bytes cold": measure(to_json_bytes, cold()),
+        "to_json_bytes warm": measure(to_json_bytes, [result] * args.runs),
+        "packb cold": measure(packb, cold()),
+        "packb warm": measure(packb, [result] * args.runs),
+    }
+    print(f"{args.providers} providers x {args.streams} streams")
+    baseline = rows["as_dict+json.dumps"][0]
+    for name, (seconds, size) in rows.items():
+        print(f"\t{name:20} {seconds * 1000:8.2f}ms  {size / 1024:8.1f}KiB  x{baseline / seconds:.2f}")
+
+    data = packb(result)
+    load_rows = {
+        "loads_json": measure(lambda _: loads_json(expected).providers, [result] * args.runs),
+        "unpackb": measure(lambda _: unpackb(data).providers, [result] * args.runs),
+    }
+    for name, (seconds, _) in load_rows.items():
+        print(f"\t{name:20} {seconds * 1000:8.2f}ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
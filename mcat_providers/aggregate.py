@@ -0,0 +1,349 @@
+import re
+import asyncio
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from typing import Optional, Union, Dict, List, Tuple, Set, Hashable, AsyncIterator
+
+from mcat_providers.config import log
+from mcat_providers.probe import StreamProber
+from mcat_providers.sources import BaseSource
+from mcat_providers.plugins import PluginRegistry, PluginSpec, registry as default_registry
+from mcat_providers.utils.deadline import Deadline
+from mcat_providers.utils.exceptions import DeadlineExceeded
+from mcat_providers.utils.types import MediaType, MediaEnum, QualityEnum, Stream, Subtitle, ProviderResponse, SourceResponse
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+# A path segment this long is a hash or a token, so the same path on another host is the same file (CDN shards, mirrors)
+_TOKEN_SEGMENT = re.compile(r"[^/]{16,}")
+
+def normalize_url(url: str) -> str:
+    '''
+        Host and path of `url` in one spelling: lowercase host, no default port, scheme or fragment,
+        duplicate slashes collapsed and the query sorted.
+    '''
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != _DEFAULT_PORTS.get(parts.scheme.lower()):
+        host = f"{host}:{port}"
+    path = re.sub(r"/{2,}", "/", parts.path) or "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return f"{host}{path}?{query}" if query else f"{host}{path}"
+
+def content_path(url: str) -> Optional[str]:
+    '''The path of `url` when it names one file whatever the host is, i.e. it carries a hash-like segment.'''
+    path = re.sub(r"/{2,}", "/", urlsplit(url.strip()).path)
+    return path if _TOKEN_SEGMENT.search(path) else None
+
+def stream_fingerprints(stream: Stream) -> List[Hashable]:
+    '''Keys under which two streams are the same content, the URL ones and, once it is indexed, its playlist shape.'''
+    keys: List[Hashable] = [("url", normalize_url(stream.url))]
+    path = content_path(stream.url)
+    if path:
+        keys.append(("path", path))
+    index = stream.index
+    # A handful of segments is too little to tell two encodes apart
+    if index is not None and index.segment_count >= 3:
+        keys.append(("index", stream.quality, stream.bandwith, index.segment_count, round(index.total_duration, 1)))
+    return keys
+
+def subtitle_fingerprints(subtitle: Subtitle) -> List[Hashable]:
+    keys: List[Hashable] = [("url", normalize_url(subtitle.url))]
+    path = content_path(subtitle.url)
+    if path:
+        keys.append(("path", (subtitle.language or "").strip().lower(), path))
+    return keys
+
+class Deduplicator:
+    '''Drops streams and subtitles already seen under any of their fingerprints, first seen wins.'''
+    def __init__(self) -> None:
+        self.seen: Set[Hashable] = set()
+        self.stats = {"streams": 0, "duplicate_streams": 0, "subtitles": 0, "duplicate_subtitles": 0}
+
+    def _new(self, keys: List[Hashable]) -> bool:
+        if any(key in self.seen for key in keys):
+            return False
+        self.seen.update(keys)
+        return True
+
+    def filter(self, source: str, response: ProviderResponse) -> Optional[ProviderResponse]:
+        '''
+            Returns `response` with only the new streams and subtitles, renamed "<source>/<provider>".
+            When only its subtitles are new it comes back without streams, None when nothing is new.
+        '''
+        subtitles = []
+        for subtitle in response.subtitles:
+            if self._new(subtitle_fingerprints(subtitle)):
+                subtitles.append(subtitle)
+            else:
+                self.stats["duplicate_subtitles"] += 1
+        streams = []
+        for stream in response.streams:
+            if self._new(stream_fingerprints(stream)):
+                streams.append(stream)
+            else:
+                self.stats["duplicate_streams"] += 1
+        if not streams and not subtitles:
+            return None
+        self.stats["streams"] += len(streams)
+        self.stats["subtitles"] += len(subtitles)
+        return ProviderResponse(provider=f"{source}/{response.provider}", streams=streams, subtitles=subtitles)
+
+def rank_providers(responses: List[ProviderResponse]) -> List[ProviderResponse]:
+    '''
+        Best quality first within each provider (stable, so probed streams keep their throughput order),
+        and providers by their best stream: quality, then measured throughput, then arrival.
+        Subtitle only providers go last.
+    '''
+    def best(response: ProviderResponse) -> Tuple[int, float]:
+        return max(
+            ((stream.quality.rank, stream.probe.throughput if stream.probe and stream.probe.throughput else 0.0)
+            for stream in response.streams),
+            default=(-1, 0.0),
+        )
+
+    ranked = []
+    for response in responses:
+        streams = sorted(response.streams, key=lambda stream: stream.quality.rank, reverse=True)
+        ranked.append(ProviderResponse(provider=response.provider, streams=streams, subtitles=response.subtitles))
+    ranked.sort(key=best, reverse=True)
+    return ranked
+
+class Aggregator:
+    '''
+        Runs every registered source that supports the media type at once and merges what they find.
+
+        TMDB is resolved once up front (`BaseSource.resolve_tmdb` is cached across sources, so every source
+        reads that result), streams and subtitles found by more than one source are dropped by URL and content
+        fingerprint before anything is probed, and everything shares one deadline: sources that have not
+        finished when it runs out are cancelled and the merged result holds what came in before.
+
+        Quacks like a source (`scrape_iter`, `scrape_all`, `warm_up`, `stats`), so the CLI and the resolver
+        server take it as `--src all`.
+    '''
+    name = "Aggregate"
+    logger = log
+
+    def __init__(
+        self,
+        sources: Optional[Dict[str, BaseSource]] = None,
+        registry: Optional[PluginRegistry] = None,
+        prober: Optional[StreamProber] = None,
+        **source_kwargs
+    ) -> None:
+        # Given sources are always used, otherwise they are built from the registry the first time a media type needs them
+        self.fixed = sources is not None
+        self.sources: Dict[str, BaseSource] = {name.lower(): source for name, source in (sources or {}).items()}
+        self.registry = registry or default_registry
+        self.source_kwargs = source_kwargs
+        self._prober = prober
+        self.counters = {
+            "runs": 0, "tmdb_failures": 0, "source_failures": 0, "source_timeouts": 0,
+            "streams": 0, "duplicate_streams": 0, "subtitles": 0, "duplicate_subtitles": 0,
+        }
+
+    @property
+    def prober(self) -> StreamProber:
+        if self._prober is None:
+            self._prober = StreamProber()
+        return self._prober
+
+    def sources_for(self, media_type: Union[str, MediaEnum]) -> Dict[str, BaseSource]:
+        if self.fixed:
+            return self.sources
+        return self._load(self.registry.sources(media_type=media_type))
+
+    def _load(self, specs: List[PluginSpec]) -> Dict[str, BaseSource]:
+        found = {}
+        for spec in specs:
+            if spec.name not in self.sources:
+                try:
+                    self.sources[spec.name] = spec.load()(**self.source_kwargs)
+                except Exception as e:
+                    self.logger.error(f"Could not load source '{spec.name}': {e}")
+                    continue
+            found[spec.name] = self.sources[spec.name]
+        return found
+
+    async def warm_up(self) -> None:
+        if not self.fixed:
+            self._load(self.registry.sources())
+        await asyncio.gather(*(source.warm_up() for source in self.sources.values()))
+
+    @property
+    def stats(self) -> Dict:
+        return {
+            **self.counters,
+            "sources": {name: source.stats for name, source in self.sources.items()},
+        }
+
+    async def scrape_source(
+        self,
+        name: str,
+        source: BaseSource,
+        queue: asyncio.Queue,
+        deadline: Optional[Deadline],
+        **kwargs
+    ) -> None:
+        '''
+            Feeds `(name, response)` to `queue` as the source resolves them, `(name, None)` once it is done.
+            The source is cut off when the deadline runs out even if it does not check it itself.
+        '''
+        async def feed():
+            if hasattr(source, "scrape_iter"):
+                async for response in source.scrape_iter(deadline=deadline, **kwargs):
+                    queue.put_nowait((name, response))
+            else:
+                # A deadline always bypasses coalescing, the aggregate run is one call with its own budget
+                result = await source.scrape_all(deadline=deadline, **kwargs)
+                for response in (result.providers if result else ()):
+                    if response:
+                        queue.put_nowait((name, response))
+
+        try:
+            await (deadline.run(feed(), name) if deadline else feed())
+        except DeadlineExceeded:
+            self.counters["source_timeouts"] += 1
+            self.logger.error(f"'{name}' ran out of time")
+        except Exception as e:
+            self.counters["source_failures"] += 1
+            self.logger.error(f"'{name}' failed: {e}")
+        finally:
+            queue.put_nowait((name, None))
+
+    async def scrape_iter(
+        self,
+        media_type: str,
+        season: str = "0",
+        episode: str = "0",
+        source_id: Optional[str] = None,
+        tmdb: Optional[str] = None,
+        timeout: Optional[float] = None,
+        deadline: Optional[Deadline] = None,
+        probe_budget: Optional[float] = None,
+    ) -> AsyncIterator[ProviderResponse]:
+        '''
+            Yields each provider of every source as it resolves, minus the streams and subtitles an earlier one
+            already had. Responses are named "<source>/<provider>". `timeout` (or `deadline`) covers every source.
+        '''
+        if source_id or not tmdb:
+            self.logger.error("Aggregating needs a tmdb id, source ids only mean something to their own source")
+            return
+        media = MediaType(tmdb=tmdb, media_type=media_type, season=season, episode=episode)
+        sources = self.sources_for(media.media_type)
+        if not sources:
+            self.logger.error(f"No source supports {media.media_type.value}")
+            return
+        self.counters["runs"] += 1
+        deadline = Deadline.coerce(timeout, deadline)
+
+        if media.media_type in (MediaEnum.MOVIE, MediaEnum.SERIES):
+            try:
+                # Every source reads this from the shared cache instead of asking TMDB itself
+                lookup = BaseSource.resolve_tmdb(media)
+                await (deadline.run(lookup, "resolve_tmdb") if deadline else lookup)
+            except Exception as e:
+                self.counters["tmdb_failures"] += 1
+                self.logger.error(f"Could not resolve {media.base_gmid}: {e}")
+                return
+
+        queue: asyncio.Queue = asyncio.Queue()
+        kwargs = dict(media_type=media_type, season=season, episode=episode, tmdb=tmdb)
+        tasks = [
+            asyncio.ensure_future(self.scrape_source(name, source, queue, deadline, **kwargs))
+            for name, source in sources.items()
+        ]
+        deduplicator = Deduplicator()
+        running = len(tasks)
+        try:
+            while running:
+                name, response = await queue.get()
+                if response is None:
+                    running -= 1
+                    continue
+                response = deduplicator.filter(sources[name].name, response)
+                if response is None:
+                    continue
+                if probe_budget and response.streams:
+                    budget = min(probe_budget, deadline.remaining()) if deadline else probe_budget
+                    if budget > 0:
+                        response = await self.prober.rank(response, budget)
+                    if not response.streams and not response.subtitles:
+                        continue
+                yield response
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for key, count in deduplicator.stats.items():
+                self.counters[key] += count
+
+    async def probe(self, responses: List[ProviderResponse], budget: float) -> List[ProviderResponse]:
+        '''
+            Probes every stream of every response in one batch, so the fastest streams win whoever found them.
+            Dead streams are dropped, and responses left with neither streams nor subtitles.
+        '''
+        # URLs are unique after de-duplication
+        streams = await self.prober.probe_all([stream for response in responses for stream in response.streams], budget)
+        probed = {stream.url: (position, stream) for position, stream in enumerate(streams)}
+        ranked = []
+        for response in responses:
+            kept = sorted(probed[stream.url] for stream in response.streams if stream.url in probed)
+            if kept or response.subtitles:
+                ranked.append(ProviderResponse(provider=response.provider, streams=[stream for _, stream in kept], subtitles=response.subtitles))
+        return ranked
+
+    async def scrape_all(
+        self,
+        media_type: str,
+        season: str = "0",
+        episode: str = "0",
+        source_id: Optional[str] = None,
+        tmdb: Optional[str] = None,
+        min_quality: Optional[Union[str, QualityEnum]] = None,
+        timeout: Optional[float] = None,
+        deadline: Optional[Deadline] = None,
+        probe_budget: Optional[float] = None,
+    ) -> Optional[SourceResponse]:
+        '''
+            Every source's providers merged and ranked (see `rank_providers`). Streams are probed once
+            after de-duplication, within `probe_budget` and whatever is left of the deadline.
+            `min_quality` drops streams below it, rather than stopping at the first provider like a single source does.
+        '''
+        deadline = Deadline.coerce(timeout, deadline)
+        scrape_deadline = deadline
+        if deadline and probe_budget:
+            # Keep time back for probing, otherwise a slow source would use the whole budget up
+            remaining = deadline.remaining()
+            scrape_deadline = Deadline(remaining - min(probe_budget, remaining / 2))
+        responses = [
+            response async for response in self.scrape_iter(
+                media_type=media_type,
+                season=season,
+                episode=episode,
+                source_id=source_id,
+                tmdb=tmdb,
+                deadline=scrape_deadline,
+            )
+        ]
+
+        if probe_budget and responses:
+            budget = min(probe_budget, deadline.remaining()) if deadline else probe_budget
+            if budget > 0:
+                responses = await self.probe(responses, budget)
+
+        if min_quality:
+            floor = QualityEnum.coerce(min_quality).rank
+            filtered = []
+            for response in responses:
+                streams = [stream for stream in response.streams if stream.quality.rank >= floor]
+                if streams or response.subtitles:
+                    filtered.append(ProviderResponse(provider=response.provider, streams=streams, subtitles=response.subtitles))
+            responses = filtered
+
+        if not any(response.streams for response in responses):
+            self.logger.error("No source found a stream!")
+            return None
+        return SourceResponse(source=self.name, providers=rank_providers(responses))
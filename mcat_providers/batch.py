@@ -0,0 +1,252 @@
+import os
+import csv
+import sys
+import json
+import time
+import asyncio
+from typing import Optional, Dict, List, Iterator, Iterable, Set, TextIO, IO
+
+from mcat_providers.config import log
+from mcat_providers.sources import BaseSource
+from mcat_providers.utils.types import MediaType
+from mcat_providers.utils.id_index import SourceIdIndex
+from mcat_providers.utils.decorators import refresh_caches
+from mcat_providers.utils.serialize import NDJSONWriter
+
+ROW_FIELDS = ("tmdb", "media_type", "season", "episode")
+
+def read_rows(path: str) -> Iterator[Dict]:
+    '''
+        Reads (tmdb, media_type, season, episode) rows from a JSONL or CSV file.
+        Only `tmdb` is required, the rest default to a movie.
+    '''
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        first_line = f.readline()
+        f.seek(0)
+        if path.endswith((".jsonl", ".ndjson", ".json")) or first_line.lstrip().startswith("{"):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for line_no, row in enumerate(rows, start=1):
+            if not row.get("tmdb"):
+                log.warning(f"Skipping row {line_no} with no tmdb: {row}")
+                continue
+            yield {
+                "tmdb": str(row["tmdb"]).strip(),
+                "media_type": (row.get("media_type") or "movie").strip(),
+                "season": str(row.get("season") or "0").strip(),
+                "episode": str(row.get("episode") or "0").strip(),
+            }
+
+def row_key(row: Dict) -> str:
+    return MediaType(
+        tmdb=row["tmdb"],
+        media_type=row["media_type"],
+        season=row["season"],
+        episode=row["episode"]
+    ).gmid
+
+class Checkpoint:
+    '''
+        Append-only list of the keys of rows that were scraped successfully, failed rows are tried again on the next run.
+        Every key is flushed as soon as its result has been written so a crash loses at most the rows in flight.
+    '''
+    def __init__(self, path: Optional[str]) -> None:
+        self.path = path
+        self.done: Set[str] = set()
+        self._file: Optional[TextIO] = None
+
+    def load(self) -> Set[str]:
+        if self.path and os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.done.update(line.strip() for line in f if line.strip())
+        return self.done
+
+    def mark(self, key: str) -> None:
+        self.done.add(key)
+        if not self.path:
+            return
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(f"{key}\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class BatchRunner:
+    '''
+        Scrapes rows concurrently through one source instance (and so one warm client),
+        writing an NDJSON record per row as soon as it finishes.
+    '''
+    def __init__(
+        self,
+        source: BaseSource,
+        output: IO[bytes],
+        concurrency: int = 8,
+        checkpoint: Optional[Checkpoint] = None,
+    ) -> None:
+        self.source = source
+        self.writer = NDJSONWriter(output)
+        self.concurrency = max(1, concurrency)
+        self.checkpoint = checkpoint or Checkpoint(None)
+        self.stats = {"done": 0, "failed": 0, "skipped": 0}
+
+    async def scrape_row(self, row: Dict) -> Dict:
+        start = time.perf_counter()
+        record: Dict = {"key": row_key(row), **row, "ok": False, "error": None, "result": None}
+        try:
+            result = await self.source.scrape_all(**row)
+            if result:
+                record.update({"ok": True, "result": result})
+            else:
+                record["error"] = "No sources found"
+        except Exception as e:
+            log.error(f"Failed to scrape {record['key']}: {e}")
+            record["error"] = f"{e.__class__.__name__}: {e}"
+        record["elapsed"] = round(time.perf_counter() - start, 3)
+        return record
+
+    def write(self, record: Dict) -> None:
+        self.writer.write(record)
+        if record["ok"]:
+            self.checkpoint.mark(record["key"])
+        self.stats["done" if record["ok"] else "failed"] += 1
+
+    async def worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            row = await queue.get()
+            try:
+                if row is None:
+                    return
+                self.write(await self.scrape_row(row))
+            finally:
+                queue.task_done()
+
+    async def run(self, rows: Iterator[Dict]) -> Dict:
+        done = self.checkpoint.load()
+        # Bounded so huge inputs are streamed in rather than loaded up front
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self.worker(queue)) for _ in range(self.concurrency)]
+        seen: Set[str] = set()
+        try:
+            for row in rows:
+                key = row_key(row)
+                if key in done or key in seen:
+                    self.stats["skipped"] += 1
+                    continue
+                seen.add(key)
+                await queue.put(row)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            self.checkpoint.close()
+        return self.stats
+
+def run_batch(
+    source: BaseSource,
+    input_path: str,
+    output_path: str = "-",
+    concurrency: int = 8,
+    checkpoint_path: Optional[str] = None,
+    loop: Optional[asyncio.AbstractEventLoop] = None,
+) -> Dict:
+    output = sys.stdout.buffer if output_path == "-" else open(output_path, "ab")
+    try:
+        runner = BatchRunner(source, output, concurrency=concurrency, checkpoint=Checkpoint(checkpoint_path))
+        coro = runner.run(read_rows(input_path))
+        return loop.run_until_complete(coro) if loop else asyncio.run(coro)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+
+def read_result_titles(path: str) -> Iterator[MediaType]:
+    '''Titles (not episodes) of every successful record in a batch output file.'''
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("ok") and record.get("tmdb"):
+                yield MediaType(tmdb=record["tmdb"], media_type=record.get("media_type") or "movie")
+
+async def refresh_id_index(
+    source: BaseSource,
+    titles: Iterable[MediaType],
+    index: Optional[SourceIdIndex] = None,
+    concurrency: int = 8,
+) -> Dict:
+    '''
+        Looks up every title that is missing from `index` (the source's own by default) or stale in it,
+        entries that are still fresh are skipped. Returns counts, the index is not saved.
+    '''
+    if not hasattr(source, "search_source_id"):
+        # Only sources that can search for a title by its TMDB data (`search_source_id`) can fill an index
+        raise ValueError(f"'{source.name}' cannot look up its own ids")
+    index = index or source.id_index
+    stats = {"added": 0, "updated": 0, "unchanged": 0, "missing": 0, "failed": 0, "fresh": 0}
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    seen: Set[str] = set()
+
+    async def refresh(media: MediaType) -> None:
+        gmid = media.base_gmid
+        previous = index.get(gmid)
+        async with semaphore:
+            try:
+                # Re-verified against the source, not read back from the caches the last lookup filled
+                with refresh_caches():
+                    source_id = await source.search_source_id(media)
+            except Exception as e:
+                log.error(f"Failed to look up {gmid}: {e}")
+                stats["failed"] += 1
+                return
+        if not source_id:
+            stats["missing"] += 1
+            return
+        index.set(gmid, source_id)
+        stats["added" if previous is None else "unchanged" if previous == source_id else "updated"] += 1
+
+    tasks = []
+    for media in titles:
+        gmid = media.base_gmid
+        if gmid in seen:
+            continue
+        seen.add(gmid)
+        if not index.is_stale(gmid):
+            stats["fresh"] += 1
+            continue
+        tasks.append(refresh(media))
+    await asyncio.gather(*tasks)
+    return stats
+
+def build_id_index(
+    source: BaseSource,
+    results_path: Optional[str] = None,
+    index_path: Optional[str] = None,
+    max_age: Optional[float] = None,
+    concurrency: int = 8,
+    loop: Optional[asyncio.AbstractEventLoop] = None,
+) -> Dict:
+    '''
+        Fills the source's id index from a batch output file and refreshes every stale entry already in it,
+        then saves it. Re-running only looks up titles that are new or older than `max_age` seconds.
+    '''
+    index = SourceIdIndex(index_path) if index_path else source.id_index
+    if max_age is not None:
+        index.max_age = max_age
+    source.id_index = index
+
+    titles: List[MediaType] = list(read_result_titles(results_path)) if results_path else []
+    for gmid, _, _ in index.items():
+        kind, _, tmdb = gmid.partition(".")
+        titles.append(MediaType(tmdb=tmdb, media_type="movie" if kind == "M" else "series"))
+
+    coro = refresh_id_index(source, titles, index=index, concurrency=concurrency)
+    stats = loop.run_until_complete(coro) if loop else asyncio.run(coro)
+    stats["entries"] = index.save()
+    return stats
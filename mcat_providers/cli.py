@@ -0,0 +1,225 @@
+import sys
+import json
+import click
+from typing import Optional, List
+
+from mcat_providers import settings
+
+def get_source(src: str, media_type: Optional[str] = None, **kwargs):
+    '''
+        Imports and builds the source through the plugin registry, only the one asked for gets imported.
+        "all" is every registered source at once, merged by `mcat_providers.aggregate.Aggregator`.
+    '''
+    from mcat_providers.plugins import registry
+    if src.lower() == "all":
+        from mcat_providers.aggregate import Aggregator
+        return Aggregator(**kwargs)
+    spec = registry.source(src)
+    if spec is None:
+        raise click.UsageError(f"Unknown source: '{src}' (available: {', '.join(spec.name for spec in registry.sources())})")
+    if media_type is not None and not spec.supports(media_type=media_type):
+        raise click.UsageError(f"'{spec.name}' does not support {media_type} (only {', '.join(spec.media_types)})")
+    return spec.load()(**kwargs)
+
+def handle_source(src: str, tmdb: str, media_type: str, se: str, ep: str, quality: Optional[str] = None, timeout: Optional[float] = None, probe: Optional[float] = None, fmt: str = "json", **kwargs) -> bytes:
+    source = get_source(src, media_type=media_type)
+    sources_list = settings.loop.run_until_complete(
+        source.scrape_all(
+            tmdb=tmdb,
+            media_type=media_type,
+            season=se,
+            episode=ep,
+            min_quality=quality,
+            timeout=timeout,
+            probe_budget=probe
+        )
+    )
+    if not sources_list:
+        raise click.ClickException("No sources found")
+    if fmt == "msgpack":
+        return sources_list.to_msgpack()
+    return sources_list.to_json_bytes()
+
+def handle_flixhq(*args, **kwargs) -> bytes:
+    return handle_source("flixhq", *args, **kwargs)
+
+def stream_source(src: str, tmdb: str, media_type: str, se: str, ep: str, timeout: Optional[float] = None, probe: Optional[float] = None, **kwargs):
+    '''Prints one JSON line per provider as soon as it resolves.'''
+    from mcat_providers.utils.serialize import NDJSONWriter
+
+    source = get_source(src, media_type=media_type)
+    writer = NDJSONWriter(sys.stdout.buffer)
+
+    async def run():
+        async for response in source.scrape_iter(tmdb=tmdb, media_type=media_type, season=se, episode=ep, timeout=timeout, probe_budget=probe):
+            writer.write(response)
+        return writer.count
+
+    return settings.loop.run_until_complete(run())
+
+def stream_flixhq(*args, **kwargs):
+    return stream_source("flixhq", *args, **kwargs)
+
+@click.group(invoke_without_command=True)
+@click.option("--src", help="Source name, or 'all' to merge every source")
+@click.option("--tmdb")
+@click.option("--media-type", default="movie")
+@click.option("--se", default="0")
+@click.option("--ep", default="0")
+@click.option("--quality", default=None, help="Return the first provider with a stream at or above this quality (e.g. 720p)")
+@click.option("--timeout", type=float, default=None, help="End-to-end budget in seconds")
+@click.option("--probe", type=float, default=None, help="Seconds to spend checking streams play, dead ones are dropped and the rest ranked by throughput")
+@click.option("--stream", is_flag=True, help="Print each provider as NDJSON as soon as it resolves")
+@click.option("--format", "fmt", type=click.Choice(["json", "msgpack"]), default="json", show_default=True, help="Output format (--stream is always NDJSON)")
+@click.option("--log-level", default=40, show_default=True) # logging.ERROR default
+@click.pass_context
+def main(ctx: click.Context, src: str, **kwargs):
+    settings.rich_handle.setLevel(kwargs.pop("log_level"))
+    if ctx.invoked_subcommand:
+        return
+
+    if not src or not kwargs.get("tmdb"):
+        raise click.UsageError("--src and --tmdb are required unless a subcommand is used")
+
+    if kwargs.pop("stream"):
+        return stream_source(src, **kwargs)
+
+    data = handle_source(src, **kwargs)
+    sys.stdout.buffer.write(data if kwargs["fmt"] == "msgpack" else data + b"\n")
+    sys.stdout.buffer.flush()
+    return data
+
+def parse_range(spec: Optional[str]) -> Optional[List[str]]:
+    '''"1-3,5" -> ["1", "2", "3", "5"], nothing or "all" -> None (every one).'''
+    if not spec or spec.strip().lower() in ("all", "*"):
+        return None
+    numbers: List[str] = []
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        if not first.isdigit() or (last and not last.isdigit()):
+            raise click.BadParameter(f"Bad range: '{part}'")
+        numbers.extend(str(number) for number in range(int(first), int(last or first) + 1))
+    return numbers
+
+@main.command()
+@click.option("--src", default="flixhq", show_default=True)
+@click.option("--tmdb", required=True)
+@click.option("--se", default=None, help="Seasons, e.g. '1', '1-3' or '1,4' (default: all)")
+@click.option("--ep", default=None, help="Episodes of each season, e.g. '1-5' (default: all)")
+@click.option("-c", "--concurrency", default=4, show_default=True, help="Max episodes scraped at once")
+@click.option("--quality", default=None, help="Only keep the first provider with a stream at or above this quality (e.g. 720p)")
+@click.option("--timeout", type=float, default=None, help="Budget in seconds per episode")
+@click.option("--probe", type=float, default=None, help="Seconds to spend checking each episode's streams play")
+def episodes(src: str, tmdb: str, se: Optional[str], ep: Optional[str], concurrency: int, quality: Optional[str], timeout: Optional[float], probe: Optional[float]):
+    '''Scrape a whole season (or any range of episodes), printing one NDJSON line per episode as it finishes.'''
+    from mcat_providers.utils.serialize import NDJSONWriter
+
+    if src.lower() == "all":
+        raise click.UsageError("episodes runs one source at a time")
+    source = get_source(src, media_type="tv")
+    writer = NDJSONWriter(sys.stdout.buffer)
+
+    async def run():
+        async for season, episode, response in source.scrape_episodes(
+            tmdb=tmdb,
+            seasons=parse_range(se),
+            episodes=parse_range(ep),
+            concurrency=concurrency,
+            min_quality=quality,
+            timeout=timeout,
+            probe_budget=probe,
+        ):
+            writer.write({"season": season, "episode": episode, "ok": response is not None, "result": response.as_dict if response else None})
+        return writer.count
+
+    if not settings.loop.run_until_complete(run()):
+        raise click.ClickException("No episodes found")
+
+@main.command()
+@click.argument("input_path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--src", default="flixhq", show_default=True)
+@click.option("-o", "--output", default="-", show_default=True, help="NDJSON file to append results to")
+@click.option("-c", "--concurrency", default=8, show_default=True, help="Max titles scraped at once")
+@click.option("--checkpoint", default=None, help="Keys of the rows that succeeded, defaults to '<output>.ckpt'")
+@click.option("--resume/--no-resume", default=True, show_default=True, help="Skip rows already in the checkpoint")
+@click.option("--js-workers", default=None, type=int, help="Processes for the JS key extraction (0 = in-process)")
+def batch(input_path: str, src: str, output: str, concurrency: int, checkpoint: str, resume: bool, js_workers: Optional[int]):
+    '''Scrape every (tmdb, media_type, season, episode) row of a JSONL/CSV file.'''
+    from mcat_providers.batch import run_batch
+
+    if js_workers is not None:
+        settings.js_workers = js_workers
+
+    if checkpoint is None and output != "-":
+        checkpoint = f"{output}.ckpt"
+    if checkpoint and not resume:
+        open(checkpoint, "w").close()
+
+    stats = run_batch(
+        get_source(src),
+        input_path=input_path,
+        output_path=output,
+        concurrency=concurrency,
+        checkpoint_path=checkpoint,
+        loop=settings.loop,
+    )
+    print(json.dumps(stats), file=sys.stderr)
+
+@main.command()
+@click.argument("results_path", required=False, type=click.Path(exists=True, dir_okay=False))
+@click.option("--src", default="flixhq", show_default=True)
+@click.option("--index", "index_path", default=None, help="Index file, defaults to '<MCAT_ID_INDEX_DIR>/<src>.idx'")
+@click.option("--max-age", default=30.0, show_default=True, help="Days before an entry is looked up again")
+@click.option("-c", "--concurrency", default=8, show_default=True, help="Max lookups at once")
+def index(results_path: Optional[str], src: str, index_path: Optional[str], max_age: float, concurrency: int):
+    '''Build or refresh the offline TMDB -> source id index from `batch` output.'''
+    from mcat_providers.batch import build_id_index
+
+    if src.lower() == "all":
+        raise click.UsageError("Each source has its own index, pick one")
+    try:
+        stats = build_id_index(
+            get_source(src),
+            results_path=results_path,
+            index_path=index_path,
+            max_age=max_age * 24 * 3600,
+            concurrency=concurrency,
+            loop=settings.loop,
+        )
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    print(json.dumps(stats), file=sys.stderr)
+
+@main.command()
+def plugins():
+    '''List the registered sources and providers with what they support, without importing them.'''
+    from mcat_providers.plugins import registry
+    print(json.dumps(registry.as_dict, indent=2))
+
+@main.command()
+@click.option("--src", "sources", multiple=True, default=["flixhq"], show_default=True)
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8765, show_default=True)
+@click.option("--unix", "unix_path", default=None, help="Listen on a unix socket instead of TCP")
+@click.option("--max-inflight", default=64, show_default=True, help="Max resolves running at once")
+@click.option("--ready-file", default=None, help="Written once warm-up has finished")
+@click.option("--js-workers", default=None, type=int, help="Processes for the JS key extraction (0 = in-process)")
+def serve(sources: List[str], host: str, port: int, unix_path: str, max_inflight: int, ready_file: str, js_workers: Optional[int]):
+    '''Run a long-lived resolver that keeps runtimes, connections and caches warm.'''
+    from mcat_providers.server import ResolverServer
+
+    if js_workers is not None:
+        settings.js_workers = js_workers
+
+    async def run():
+        server = ResolverServer(
+            {src: get_source(src) for src in sources},
+            max_inflight=max_inflight,
+            ready_file=ready_file,
+        )
+        await server.serve_forever(host=host, port=port, unix_path=unix_path)
+
+    try:
+        settings.loop.run_until_complete(run())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,207 @@
+import os
+import logging
+from typing import TYPE_CHECKING, Any, Optional, Union
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+default_ua = "Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0"
+
+log = logging.getLogger()
+
+# Seconds each kind of lookup stays in the persistent cache
+DEFAULT_CACHE_TTLS = {
+    "tmdb": 7 * 24 * 3600,
+    "search": 24 * 3600,
+    "source_id": 7 * 24 * 3600,
+    "seasons": 24 * 3600,
+    "episodes": 6 * 3600,
+}
+# Misses ("no flixhq match", empty search pages) are retried much sooner
+DEFAULT_NEGATIVE_TTL = 10 * 60
+
+class Settings:
+    '''
+        Holds everything that used to be created when `mcat_providers` was imported.
+        Nothing in here touches the disk, network or event loop until it is first asked for,
+        so importing the package stays cheap for short-lived workers.
+    '''
+    def __init__(
+        self,
+        env_path: Optional[Union["Path", str]] = None,
+        log_file: Optional[str] = None,
+        log_level: Union[int, str] = logging.NOTSET,
+        console_level: Union[int, str] = logging.CRITICAL,
+    ) -> None:
+        self.env_path = str(env_path) if env_path else None
+        # Only written when asked for, a library should not drop files into whatever directory it is run from
+        self.log_file = os.getenv("MCAT_LOG_FILE", log_file) or None
+        self.log_level = log_level
+        self.console_level = console_level
+
+        self._env_loaded = False
+        self._logging_ready = False
+        self._rich_handle: Optional[logging.Handler] = None
+        self.cache_path = os.getenv("MCAT_CACHE_PATH") or os.path.join(
+            os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+            "mcat-providers",
+            "cache.sqlite3"
+        )
+        self.cache_enabled = os.getenv("MCAT_CACHE", "1").lower() not in ("0", "false", "off")
+        # Versioned downloads (rabbitstream wasm, payload.js) that should survive restarts
+        self.artifact_dir = os.getenv("MCAT_ARTIFACT_DIR") or os.path.join(os.path.dirname(self.cache_path), "artifacts")
+        # Offline gmid -> source id indexes, one `<source>.idx` per source, built with `mcat-providers index`
+        self.id_index_dir = os.getenv("MCAT_ID_INDEX_DIR") or os.path.join(os.path.dirname(self.cache_path), "ids")
+        self.cache_ttls = DEFAULT_CACHE_TTLS.copy()
+        self.negative_ttl = DEFAULT_NEGATIVE_TTL
+
+        # Processes used for the rabbitstream JS key extraction, 0 keeps it on the event loop
+        self.js_workers = int(os.getenv("MCAT_JS_WORKERS", "0"))
+        # Fetch every variant's media playlist and attach a `MediaPlaylistIndex` to its `Stream`
+        self.index_playlists = os.getenv("MCAT_INDEX_PLAYLISTS", "0").lower() in ("1", "true", "on")
+        # Seconds a finished `scrape_all` is handed to identical calls, concurrent ones always share one scrape
+        self.scrape_reuse_window = float(os.getenv("MCAT_SCRAPE_REUSE_WINDOW", "20"))
+
+        self._loop: Any = None
+        self._cache: Any = None
+        self._transport_config: Any = None
+        self._transport: Any = None
+        self._sync_client: Any = None
+
+    # Config
+    def _find_env_path(self) -> str:
+        env_path = os.path.join(os.getcwd(), ".mcat")
+        if os.path.exists(env_path):
+            return env_path
+        return os.path.join(os.path.dirname(__file__), ".mcat")
+
+    def load_env(self) -> Optional[str]:
+        if self._env_loaded:
+            return self.env_path
+        self._env_loaded = True
+        env_path = self.env_path or self._find_env_path()
+        if not os.path.exists(env_path):
+            return None
+        from dotenv import load_dotenv
+        load_dotenv(env_path)
+        self.env_path = env_path
+        return env_path
+
+    @property
+    def tmdb_api_key(self) -> Optional[str]:
+        self.load_env()
+        return os.getenv("TMDB_API_KEY")
+
+    # Logging
+    def setup_logging(self) -> logging.Logger:
+        if self._logging_ready:
+            return log
+        self._logging_ready = True
+        if self.log_file:
+            logging.basicConfig(
+                level=self.log_level,
+                format='%(asctime)s %(levelname)s | %(name)s | %(message)s',
+                datefmt='[%H:%M:%S]',
+                handlers=[logging.FileHandler(self.log_file, mode="w")]
+            )
+        else:
+            log.setLevel(self.log_level)
+        log.addHandler(self.rich_handle)
+        return log
+
+    @property
+    def rich_handle(self) -> logging.Handler:
+        if self._rich_handle is None:
+            from rich.logging import RichHandler
+            self._rich_handle = RichHandler(rich_tracebacks=True)
+            self._rich_handle.setLevel(self.console_level)
+            self.setup_logging()
+        return self._rich_handle
+
+    # Runtime
+    @property
+    def loop(self):
+        if self._loop is None or self._loop.is_closed():
+            import asyncio
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+        return self._loop
+
+    @property
+    def transport_config(self):
+        if self._transport_config is None:
+            from mcat_providers.transport import TransportConfig
+            self._transport_config = TransportConfig(http2=os.getenv("MCAT_HTTP2", "").lower() in ("1", "true"))
+        return self._transport_config
+
+    @transport_config.setter
+    def transport_config(self, value) -> None:
+        if self._transport is not None:
+            raise RuntimeError("The shared transport has already been created!")
+        self._transport_config = value
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            from mcat_providers.transport import HttpTransport
+            self.setup_logging()
+            self._transport = HttpTransport(self.transport_config)
+        return self._transport
+
+    @property
+    def default_timeout(self):
+        return self.transport_config.default_timeout
+
+    @property
+    def client(self):
+        return self.transport.client
+
+    @property
+    def sync_client(self):
+        if self._sync_client is None:
+            import httpx
+            self.setup_logging()
+            self._sync_client = httpx.Client(timeout=self.default_timeout)
+        return self._sync_client
+
+    # Cache
+    @property
+    def cache(self):
+        if not self.cache_enabled:
+            return None
+        if self._cache is None:
+            from mcat_providers.utils.cache import SQLiteCache
+            self._cache = SQLiteCache(self.cache_path)
+        return self._cache
+
+    @cache.setter
+    def cache(self, value) -> None:
+        self._cache = value
+        self.cache_enabled = value is not None
+
+    def cache_ttl(self, kind: str, negative: bool = False) -> float:
+        if negative:
+            return min(self.negative_ttl, self.cache_ttls.get(kind, self.negative_ttl))
+        return self.cache_ttls.get(kind, self.negative_ttl)
+
+    async def aclose(self) -> None:
+        if self._transport is not None:
+            await self._transport.aclose()
+        if self._cache is not None:
+            self._cache.close()
+        if self._sync_client is not None:
+            self._sync_client.close()
+            self._sync_client = None
+
+class SettingsAttribute:
+    '''
+        Class level stand-in for a `Settings` property, only resolved when it is read.
+        Assigning the same name on an instance overrides it for that instance.
+    '''
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __get__(self, instance, owner) -> Any:
+        return getattr(settings, self.name)
+
+settings = Settings()
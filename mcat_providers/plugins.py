@@ -0,0 +1,213 @@
+'''
+    Registry of sources and providers that only imports a plugin when it is first used.
+
+    Each plugin is described by a `PluginSpec`: its name, the "module:Class" to load and what it can do
+    (media types, hosts, the server names a provider handles), so dispatch can rule it out without importing it.
+    The built-in specs live here, other packages add theirs through entry points that point at a spec,
+    kept in a module that is cheap to import:
+
+        [options.entry_points]
+        mcat_providers.sources =
+            mysource = my_package.plugin:MYSOURCE
+        mcat_providers.providers =
+            myprovider = my_package.plugin:MYPROVIDER
+'''
+import importlib
+from typing import Any, Optional, Dict, List, Tuple, Iterable
+
+from mcat_providers.config import log
+
+SOURCE_GROUP = "mcat_providers.sources"
+PROVIDER_GROUP = "mcat_providers.providers"
+
+class PluginSpec:
+    '''What a source or provider declares up front, `load()` imports `target` the first time it is called.'''
+    def __init__(
+        self,
+        name: str,
+        target: str,
+        media_types: Iterable[str] = (),
+        hosts: Iterable[str] = (),
+        servers: Iterable[str] = (),
+        description: str = "",
+    ) -> None:
+        self.name = name.lower()
+        self.target = target
+        self.media_types: Tuple[str, ...] = tuple(media_types)
+        self.hosts: Tuple[str, ...] = tuple(hosts)
+        self.servers: Tuple[str, ...] = tuple(server.lower() for server in servers)
+        self.description = description
+        self._loaded: Optional[type] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded is not None
+
+    def load(self) -> type:
+        if self._loaded is None:
+            module_name, _, attr = self.target.partition(":")
+            self._loaded = getattr(importlib.import_module(module_name), attr)
+        return self._loaded
+
+    def supports(self, media_type: Optional[str] = None, host: Optional[str] = None, server: Optional[str] = None) -> bool:
+        '''Checks against the declared capabilities, an empty capability list supports everything.'''
+        if media_type is not None and self.media_types:
+            from mcat_providers.utils.types import MediaEnum
+            if MediaEnum.map_enum(media_type).value not in self.media_types:
+                return False
+        if host is not None and self.hosts:
+            host = host.lower()
+            if not any(host == known or host.endswith(f".{known}") for known in self.hosts):
+                return False
+        if server is not None and self.servers and server.lower() not in self.servers:
+            return False
+        return True
+
+    @property
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "target": self.target,
+            "media_types": list(self.media_types),
+            "hosts": list(self.hosts),
+            "servers": list(self.servers),
+            "description": self.description,
+            "loaded": self.loaded,
+        }
+
+    def __repr__(self) -> str:
+        return f"PluginSpec(name='{self.name}', target='{self.target}', loaded={self.loaded})"
+
+FLIXHQ = PluginSpec(
+    name="flixhq",
+    target="mcat_providers.sources.flixhq:FlixHq",
+    media_types=("Movie", "Series"),
+    hosts=("flixhq.to",),
+    description="flixhq.to, resolved through TMDB",
+)
+RABBITSTREAM = PluginSpec(
+    name="rabbitstream",
+    target="mcat_providers.providers.rabbitstream:Rabbitstream",
+    hosts=("rabbitstream.net",),
+    servers=("upcloud", "vidcloud"),
+    description="Rabbitstream embeds (flixhq's UpCloud and VidCloud servers), needs the JS runtime",
+)
+
+def _entry_points(group: str) -> List[Any]:
+    from importlib import metadata
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        return list(entry_points.select(group=group))
+    return list(entry_points.get(group, []))
+
+class PluginRegistry:
+    '''
+        Sources and providers by name. Entry points are only scanned on the first lookup and
+        only the modules holding the specs are imported then, never the plugins themselves.
+    '''
+    def __init__(self, sources: Iterable[PluginSpec] = (), providers: Iterable[PluginSpec] = (), discover: bool = True) -> None:
+        self._sources: Dict[str, PluginSpec] = {spec.name: spec for spec in sources}
+        self._providers: Dict[str, PluginSpec] = {spec.name: spec for spec in providers}
+        self._discovered = not discover
+
+    def _discover(self) -> None:
+        if self._discovered:
+            return
+        self._discovered = True
+        for group, specs in ((SOURCE_GROUP, self._sources), (PROVIDER_GROUP, self._providers)):
+            try:
+                entry_points = _entry_points(group)
+            except Exception as e:
+                log.warning(f"Could not read the '{group}' entry points: {e}")
+                continue
+            for entry_point in entry_points:
+                if entry_point.name.lower() in specs:
+                    continue
+                try:
+                    spec = entry_point.load()
+                except Exception as e:
+                    log.error(f"Failed to load plugin '{entry_point.name}' from '{group}': {e}")
+                    continue
+                if not isinstance(spec, PluginSpec):
+                    log.error(f"Plugin '{entry_point.name}' in '{group}' is not a PluginSpec")
+                    continue
+                specs[spec.name] = spec
+
+    def register_source(self, spec: PluginSpec) -> None:
+        self._sources[spec.name] = spec
+
+    def register_provider(self, spec: PluginSpec) -> None:
+        self._providers[spec.name] = spec
+
+    def sources(self, media_type: Optional[str] = None, host: Optional[str] = None) -> List[PluginSpec]:
+        self._discover()
+        return [spec for spec in self._sources.values() if spec.supports(media_type=media_type, host=host)]
+
+    def providers(self, host: Optional[str] = None, server: Optional[str] = None) -> List[PluginSpec]:
+        self._discover()
+        return [spec for spec in self._providers.values() if spec.supports(host=host, server=server)]
+
+    def source(self, name: str) -> Optional[PluginSpec]:
+        self._discover()
+        return self._sources.get(name.lower())
+
+    def provider(self, name: str) -> Optional[PluginSpec]:
+        self._discover()
+        return self._providers.get(name.lower())
+
+    def provider_for_server(self, server: str) -> Optional[PluginSpec]:
+        '''The provider that declares `server` (e.g. "upcloud") among its servers.'''
+        self._discover()
+        server = server.lower()
+        for spec in self._providers.values():
+            if server in spec.servers:
+                return spec
+        return None
+
+    def create_source(self, name: str, **kwargs) -> Any:
+        spec = self.source(name)
+        if spec is None:
+            raise ValueError(f"Unknown source: '{name}'")
+        return spec.load()(**kwargs)
+
+    @property
+    def as_dict(self) -> Dict[str, List[Dict]]:
+        self._discover()
+        return {
+            "sources": [spec.as_dict for spec in self._sources.values()],
+            "providers": [spec.as_dict for spec in self._providers.values()],
+        }
+
+class LazyProviders:
+    '''
+        Server name -> provider instance for a source, built the first time a server is actually used.
+        `known` are server names the source has seen but has no provider for, they map to None.
+    '''
+    def __init__(self, registry: PluginRegistry, known: Iterable[str] = (), **provider_kwargs) -> None:
+        self.registry = registry
+        self.known = {name.lower() for name in known}
+        self.provider_kwargs = provider_kwargs
+        self._instances: Dict[str, Any] = {}
+
+    def handles(self, server: str) -> bool:
+        '''Whether a provider is registered for `server`, without importing it.'''
+        return self.registry.provider_for_server(server) is not None
+
+    def get(self, server: str, default: Any = None) -> Any:
+        server = server.lower()
+        if server in self._instances:
+            return self._instances[server]
+        spec = self.registry.provider_for_server(server)
+        if spec is None:
+            return None if server in self.known else default
+        instance = self._instances[server] = spec.load()(**self.provider_kwargs)
+        return instance
+
+    def load_all(self) -> List[Any]:
+        '''Builds a provider for every registered server.'''
+        for spec in self.registry.providers():
+            for server in spec.servers:
+                self.get(server)
+        return list(self._instances.values())
+
+registry = PluginRegistry(sources=(FLIXHQ,), providers=(RABBITSTREAM,))
@@ -0,0 +1,158 @@
+import time
+import asyncio
+from typing import Optional, List, Dict, Tuple, Iterable
+
+from mcat_providers.config import SettingsAttribute, log
+from mcat_providers.transport import HttpTransport
+from mcat_providers.utils.deadline import Deadline
+from mcat_providers.utils.exceptions import DeadlineExceeded
+from mcat_providers.utils.hls import MasterPlaylistParser, MediaPlaylistParser, MediaPlaylistIndex
+from mcat_providers.utils.types import Stream, ProviderResponse
+
+class ProbeResult:
+    '''
+        What one probe saw. `ttfb` is the playlist's time to first byte in seconds and
+        `throughput` the delivered bandwidth of the first segment in bits/s (comparable to `Stream.bandwith`).
+    '''
+    def __init__(
+        self,
+        url: str,
+        alive: bool,
+        ttfb: Optional[float] = None,
+        throughput: Optional[float] = None,
+        received: int = 0,
+        error: Optional[str] = None,
+    ) -> None:
+        self.url = url
+        self.alive = alive
+        self.ttfb = ttfb
+        self.throughput = throughput
+        self.received = received
+        self.error = error
+
+    @property
+    def as_dict(self) -> Dict:
+        return {
+            "alive": self.alive,
+            "ttfb": round(self.ttfb, 4) if self.ttfb is not None else None,
+            "throughput": int(self.throughput) if self.throughput is not None else None,
+            "received": self.received,
+            "error": self.error,
+        }
+
+    def __repr__(self) -> str:
+        return f"ProbeResult(url='{self.url}', alive={self.alive}, ttfb={self.ttfb}, throughput={self.throughput})"
+
+class StreamProber:
+    '''
+        Checks that streams actually play before they are handed out: fetches each playlist and the start
+        of its first segment with the headers the stream carries, at most `concurrency` at a time.
+        Dead streams are dropped and the rest are ordered by measured throughput.
+    '''
+    transport = SettingsAttribute("transport")
+
+    def __init__(self, transport: Optional[HttpTransport] = None, concurrency: int = 8, sample_bytes: int = 256 * 1024) -> None:
+        if transport is not None:
+            self.transport = transport
+        self.concurrency = concurrency
+        self.sample_bytes = sample_bytes
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def get_playlist(self, url: str, headers: Dict) -> Tuple[float, MediaPlaylistIndex]:
+        '''Returns the TTFB and index of a media playlist, following a master playlist to its first variant.'''
+        start = time.monotonic()
+        req = await self.transport.get(url, site="probe_playlist", headers=headers, stream=True)
+        ttfb = time.monotonic() - start
+        try:
+            if not req.is_success:
+                raise ValueError(f"Playlist returned {req.status_code}")
+            media = MediaPlaylistParser(str(req.url))
+            master = MasterPlaylistParser(str(req.url))
+            async for line in req.aiter_lines():
+                media.feed(line)
+                master.feed(line)
+        finally:
+            await req.aclose()
+        index = media.close()
+        variants = master.close().variants
+        if index.first_segment is None and variants:
+            _, index = await self.get_playlist(variants[0].url, headers)
+        return ttfb, index
+
+    async def get_segment(self, index: MediaPlaylistIndex, headers: Dict) -> Tuple[int, float]:
+        '''Reads up to `sample_bytes` of the first segment, returns the bytes read and the seconds it took.'''
+        if index.first_segment is None:
+            raise ValueError("Playlist has no segments")
+        headers = dict(headers)
+        length = min(index.byte_lengths[0], self.sample_bytes) if index.byte_lengths[0] >= 0 else self.sample_bytes
+        offset = max(index.byte_offsets[0], 0)
+        headers["Range"] = f"bytes={offset}-{offset + length - 1}"
+
+        start = time.monotonic()
+        req = await self.transport.get(index.first_segment, site="probe_segment", headers=headers, stream=True)
+        received = 0
+        try:
+            if not req.is_success:
+                raise ValueError(f"Segment returned {req.status_code}")
+            async for chunk in req.aiter_bytes():
+                received += len(chunk)
+                if received >= length:
+                    break
+        finally:
+            await req.aclose()
+        if not received:
+            raise ValueError("Segment was empty")
+        return received, time.monotonic() - start
+
+    async def probe(self, stream: Stream) -> Stream:
+        '''Returns `stream` with its `probe` (and `index`, if it had none) filled in.'''
+        headers = stream.headers.headers
+        index = stream.index
+        async with self.semaphore:
+            try:
+                ttfb, playlist_index = await self.get_playlist(stream.url, headers)
+                if index is None and playlist_index.segment_count:
+                    index = playlist_index
+                received, elapsed = await self.get_segment(playlist_index, headers)
+            except (DeadlineExceeded, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                log.info(f"Probe failed for {stream.url}: {e}")
+                return stream.replace(probe=ProbeResult(stream.url, alive=False, error=f"{e.__class__.__name__}: {e}"))
+        probe = ProbeResult(stream.url, alive=True, ttfb=ttfb, throughput=received * 8 / max(elapsed, 1e-6), received=received)
+        return stream.replace(probe=probe, index=index)
+
+    async def probe_all(self, streams: Iterable[Stream], budget: float) -> List[Stream]:
+        '''
+            Probes every stream within `budget` seconds.
+            Returns the live streams fastest first, followed by any the budget ran out on (in their original order).
+        '''
+        streams = list(streams)
+        deadline = Deadline(budget)
+        tasks = [asyncio.ensure_future(deadline.run(self.probe(stream), "probe")) for stream in streams]
+        try:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        measured, unknown = [], []
+        for stream, task in zip(streams, tasks):
+            if task.cancelled() or task.exception() is not None:
+                unknown.append(stream.replace(probe=None))
+                continue
+            stream = task.result()
+            if stream.probe.alive:
+                measured.append(stream)
+        measured.sort(key=lambda stream: stream.probe.throughput, reverse=True)
+        return measured + unknown
+
+    async def rank(self, response: ProviderResponse, budget: float) -> ProviderResponse:
+        streams = await self.probe_all(response.streams, budget)
+        return ProviderResponse(provider=response.provider, streams=streams, subtitles=response.subtitles)
@@ -1,10 +1,13 @@
-import re
+import asyncio
 import hashlib
 from pathlib import Path
-from typing import Optional, Union, List, Dict
+from typing import Optional, Union, List, Dict, Iterable
 
-from mcat_providers import client, sync_client, default_ua, log
+import httpx
+from mcat_providers.config import SettingsAttribute, default_ua, log
+from mcat_providers.transport import HttpTransport, TransportConfig, ClientAttribute
 from mcat_providers.utils.types import ProviderHeaders, Stream
+from mcat_providers.utils.hls import MasterPlaylist, MediaPlaylistIndex, parse_master, parse_media_lines
 from mcat_providers.utils.exceptions import DisabledProviderError
 
 class BaseProvider:
@@ -14,23 +17,33 @@ class BaseProvider:
 
     # Defaults
     logger = log
-    client = client
-    sync_client = sync_client
+    transport = SettingsAttribute("transport")
+    client = ClientAttribute()
+    sync_client = SettingsAttribute("sync_client")
+    index_playlists = SettingsAttribute("index_playlists")
     default_headers: Dict = {"User-Agent": default_ua}
 
-    # Internals
-    _URL_PATTERN = re.compile(r"^(https:\/\/.+)$")
-    _TARGET_PATTERNS = {
-        "bandwith": re.compile(r"BANDWIDTH=(\d+)"),
-        "quality": re.compile(r"RESOLUTION=(\d+x\d+)"),
-        "codecs": re.compile(r"CODECS=(?:\"|\')([^\"\']+)"),
-        "uri": re.compile(r"URI=(?:\"|\')([^\'\"]+)")
-    }
-
-    # def __init__(self):
-    #     if self.disabled:
-    #         print(f"'{self.__class__.__name__}' has been disabled!")
+    def __init__(
+        self,
+        transport: Optional[Union[HttpTransport, TransportConfig, httpx.AsyncBaseTransport]] = None,
+        **kwargs
+    ) -> None:
+        # if self.disabled:
+        #     print(f"'{self.__class__.__name__}' has been disabled!")
             # raise DisabledProviderError(f"'{self.__class__.__name__}' has been disabled!")
+        if transport is not None:
+            self.transport = HttpTransport.coerce(transport)
+
+    async def fetch(self, url: str, site: str = "default", **kwargs) -> httpx.Response:
+        return await self.transport.get(url, site=site, owner=self.__class__.__name__, **kwargs)
+
+    async def warm_up(self) -> None:
+        '''Loads anything the provider needs before its first resolve (runtimes, wasm, connections).'''
+        await self.fetch(self.base, site="warm_up", headers=self.default_headers)
+
+    @classmethod
+    def shutdown(cls) -> None:
+        '''Releases process wide resources (e.g. worker pools), called when a long-lived resolver stops.'''
 
     @staticmethod
     def validate_working_dir(working_dir: Union[Path, str]) -> Path:
@@ -48,57 +61,57 @@ class BaseProvider:
             raise ValueError("Unknown md5 formatting mode '{}'".format(_mode))
             
     @classmethod
-    def parse_m3u8(cls, headers: ProviderHeaders, m3u8_url: str, m3u8_data: str) -> List:
-        '''
-            This is badly written.
-            Oh well.
-        '''
-        def get_provider_data():
-            return {
-                "provider": cls.__name__,
-                "headers": headers,
-                "url": "",
-                "ext": ".m3u8",
-                "quality": ""
-            }
+    def streams_from_playlist(cls, headers: ProviderHeaders, playlist: MasterPlaylist) -> List[Stream]:
+        # Channels of each audio group, the DEFAULT=YES rendition wins
+        audio_channels: Dict[str, Optional[int]] = {}
+        for rendition in playlist.renditions:
+            if rendition.type == "AUDIO" and (rendition.group_id not in audio_channels or rendition.default):
+                audio_channels[rendition.group_id] = rendition.channels
+        return [
+            Stream(
+                provider=cls.__name__,
+                headers=headers,
+                url=variant.url,
+                ext=".m3u8",
+                quality=variant.resolution or "",
+                codec=variant.codecs,
+                bandwith=variant.bandwidth,
+                audio_channels=audio_channels.get(variant.audio),
+                frame_rate=variant.frame_rate,
+            )
+            for variant in playlist.variants
+        ]
 
+    async def get_media_playlist(self, url: str, headers: ProviderHeaders) -> MediaPlaylistIndex:
+        req = await self.fetch(url, site="get_media_playlist", headers=headers.headers, stream=True)
+        try:
+            if not req.is_success:
+                raise ValueError(f"Failed to request media playlist ({req.status_code}): {url}")
+            return await parse_media_lines(req.aiter_lines(), str(req.url))
+        finally:
+            await req.aclose()
 
-        m3u8_data_split = m3u8_data.strip().split("\n")
-        parsed_data = get_provider_data()
-        m3u8_data_parsed = []
-        expect_url = False
+    async def index_streams(self, streams: List[Stream], headers: ProviderHeaders) -> List[Stream]:
+        '''Fetches the media playlist of every stream at once and returns them with their index, failures keep `index` as None.'''
+        results = await asyncio.gather(
+            *(self.get_media_playlist(stream.url, headers) for stream in streams if stream.index is None),
+            return_exceptions=True
+        )
+        indexed = []
+        results_iter = iter(results)
+        for stream in streams:
+            if stream.index is None:
+                result = next(results_iter)
+                if isinstance(result, BaseException):
+                    self.logger.error(f"Failed to index {stream.url}: {result}")
+                else:
+                    stream = stream.replace(index=result)
+            indexed.append(stream)
+        return indexed
 
-        if not m3u8_data_split:
-            print("No m3u8 data!")
+    @classmethod
+    def parse_m3u8(cls, headers: ProviderHeaders, m3u8_url: str, m3u8_data: Union[str, Iterable[str]]) -> List[Stream]:
+        '''`m3u8_url` is the url of the playlist itself, variant URIs are resolved against it.'''
+        if not m3u8_data:
             raise ValueError("No m3u8 data!")
-        
-        for item in m3u8_data_split:
-            if expect_url:
-                url_match = BaseProvider._URL_PATTERN.search(item)
-                if not url_match:
-                    continue
-                parsed_data.update({"url": url_match.group(1)})
-                m3u8_data_parsed.append(Stream(**parsed_data))
-                parsed_data = get_provider_data()
-                expect_url = False
-                continue
-            data = {}
-            for target, pattern in BaseProvider._TARGET_PATTERNS.items():
-                regex_match = pattern.search(item)
-                if regex_match:
-                    data.update({target: regex_match.group(1)})
-            if data.get("uri"):
-                uri = data.pop("uri")
-                if not uri.startswith("/"): uri = f"/{uri}"
-                url = f"{m3u8_url}{uri}"
-                data.update({"url": url})
-                parsed_data.update(data)
-                m3u8_data_parsed.append(Stream(**parsed_data))
-                parsed_data = get_provider_data()
-                continue
-
-            if data:
-                expect_url = True
-                parsed_data.update(data)
-
-        return m3u8_data_parsed
\ No newline at end of file
+        return cls.streams_from_playlist(headers, parse_master(m3u8_data, m3u8_url))
@@ -1,20 +1,21 @@
 import re
 import json
-import httpx
-import base64
-import pythonmonkey
-
-from Cryptodome.Cipher import AES
-from Cryptodome.Util.Padding import unpad
+import asyncio
 
 from pathlib import Path
 from typing import Optional, Dict, List
 from tenacity import retry, retry_if_exception_type, stop_after_attempt, RetryError
 
+from mcat_providers.config import SettingsAttribute
 from mcat_providers.providers import BaseProvider
+from mcat_providers.providers.rabbitstream import worker
+from mcat_providers.providers.rabbitstream.worker import KeyExtractionPool
+from mcat_providers.utils.deadline import Deadline
+from mcat_providers.utils.artifacts import ArtifactHandle
+from mcat_providers.utils.hls import parse_master_lines
 from mcat_providers.utils.exceptions import IntegrityError
 from mcat_providers.utils.types import ProviderHeaders, ProviderResponse, Subtitle
-from mcat_providers.utils.decorators import async_lru_cache, async_lru_cache_parameterless
+from mcat_providers.utils.decorators import async_cache
 
 class Rabbitstream(BaseProvider):
     base = "https://rabbitstream.net"
@@ -38,81 +39,97 @@ class Rabbitstream(BaseProvider):
     # I will update the hash manually if I modify the file, so updating should fix the issue.
     # If updating doesnt fix the issue then you can fix this manually by updating the file_hash in __meta__ to the new MD5 hash
     # Only update the file hash if you are happy with the content of the file and have deemed it as safe
-    if not file_dir.exists():
-        payload_url = embedded_file["url"]
-        expected_hash = embedded_file["hash"]
-        BaseProvider.logger.info(f"Attempting to download most recent version of '{filename}'")
-        try:
-            req = httpx.get(payload_url)
-        except Exception as e:
-            BaseProvider.logger.error(e)
-            raise IntegrityError(f"Failed to retrieve '{filename}'")
-        md5 = BaseProvider.calculate_md5(req.text.encode(), "hexdigest")
+    @staticmethod
+    def validate_payload(content: bytes) -> None:
+        filename, expected_hash = Rabbitstream.filename, Rabbitstream.embedded_file["hash"]
+        if not content:
+            raise IntegrityError(f"Could not find any content inside '{filename}' for the WASM bundle!")
+        md5 = BaseProvider.calculate_md5(content, "hexdigest")
         BaseProvider.logger.info(f"Checksum = {md5}, Expected = {expected_hash}")
         if md5 != expected_hash:
             raise IntegrityError(f"Could not validate the checksum of '{filename}'...")
-        with open(file_dir, "w", encoding="utf-8") as f:
-            f.write(req.text)
-
-    with open(file_dir, "r", encoding="utf-8") as f:
-        payload = f.read()
 
-    if not payload:
-        raise IntegrityError(f"Could not find any content inside '{filename}' for the WASM bundle!")
+    # Both live in the on-disk artifact store and are revalidated in the background,
+    # a copy of payload.js next to this file is used to seed the store
+    payload_file = ArtifactHandle(
+        name="rabbitstream-payload",
+        url=embedded_file["url"],
+        site="get_payload",
+        max_age=24 * 3600,
+        validate=lambda content: Rabbitstream.validate_payload(content),
+        seed_path=str(file_dir),
+    )
+    wasm_file = ArtifactHandle(
+        name="rabbitstream-wasm",
+        url=f"{base}/images/loading.png?v=0.6",
+        site="get_wasm",
+        max_age=3600,
+    )
+    wasm_version_pattern = re.compile(r"images\/loading\.png\?v=([\w.]+)")
 
-    instantiate_and_decrypt = pythonmonkey.eval(payload)
+    # The JS runtime is only created on the first decrypt, in-process or in each pool worker
+    js_workers = SettingsAttribute("js_workers")
+    _pool: Optional[KeyExtractionPool] = None
 
     def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
         self.client_headers = kwargs.get("headers") or {}
         self.client_headers.update(self.default_headers)
     
     @staticmethod
     def base64_to_bytearray(encoded_str) -> bytearray:
-        return bytearray(base64.b64decode(encoded_str))
+        return worker.base64_to_bytearray(encoded_str)
 
     def format_wasm_key(self, keys: List, kversion: str) -> str:
-        def convert_to_bytes(kversion: int) -> List[int]:
-            return [
-                (4278190080 & kversion) >> 24,
-                (16711680 & kversion) >> 16,
-                (65280 & kversion) >> 8,
-                255 & kversion
-            ]
-        
-        def xor_with_version(keys: List, kversion_bytes: List[int]) -> Optional[List]:
-            try:
-                for i in range(len(keys)):
-                    keys[i] ^= kversion_bytes[i % len(kversion_bytes)]
-                return keys
-            except Exception as e:
-                self.logger.error(e)
-                return None
-
-        converted = convert_to_bytes(int(kversion))
-        processed_keys = xor_with_version(keys, converted) or keys
-        return base64.b64encode(bytearray(processed_keys)).decode('utf-8')
+        return worker.format_wasm_key(keys, kversion)
 
     def generate_encryption_key(self, salt, secret) -> bytes:
-        key = self.calculate_md5(secret + salt)
-        current_key = key
-        while len(current_key) < 48:
-            key = self.calculate_md5(key + secret + salt)
-            current_key += key
-        return current_key
+        return worker.generate_encryption_key(salt, secret)
 
     def decrypt_aes_data(self, ciphertext, decryption_key) -> str:
-        cipher_data = self.base64_to_bytearray(ciphertext)
-        encrypted = cipher_data[16:]
-        AES_CBC = AES.new(
-            decryption_key[:32], AES.MODE_CBC, iv=decryption_key[32:]
-        )
-        decrypted_data = unpad(
-            AES_CBC.decrypt(encrypted), AES.block_size
-        )
-        return decrypted_data.decode("utf-8")
+        return worker.decrypt_aes_data(ciphertext, decryption_key)
+
+    @classmethod
+    def get_pool(cls, payload: str) -> Optional[KeyExtractionPool]:
+        workers = cls.js_workers
+        if workers <= 0:
+            return None
+        if cls._pool is None or cls._pool.workers != workers or cls._pool.payload != payload:
+            # Workers load the payload when they start, a new payload needs new workers
+            if cls._pool is not None:
+                cls._pool.shutdown()
+            cls._pool = KeyExtractionPool(payload, workers)
+        return cls._pool
+
+    @classmethod
+    def shutdown(cls) -> None:
+        if cls._pool is not None:
+            cls._pool.shutdown()
+            cls._pool = None
+
+    async def get_payload(self) -> str:
+        artifact = await self.payload_file.get(self.transport)
+        return artifact.text
+
+    async def instantiate_and_decrypt(self, xrax: str, meta: str, wasm: bytes) -> worker.Keys:
+        '''Runs payload.js for the keys, in the worker pool when `settings.js_workers` is set.'''
+        payload = await self.get_payload()
+        pool = self.get_pool(payload)
+        if pool:
+            return await pool.extract_keys(xrax, meta, wasm)
+        return await worker.call_runtime(worker.load_runtime(payload), xrax, meta, wasm)
+
+    async def decrypt_sources(self, ciphertext: str, keys: List, kversion: str) -> str:
+        '''Key derivation and AES, kept off the event loop.'''
+        pool = self.get_pool(await self.get_payload())
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(pool.executor if pool else None, worker.decrypt_sources, ciphertext, keys, kversion)
 
     async def get_meta(self, xrax: str) -> Optional[str]:
-        embed_req = await self.client.get(f"https://rabbitstream.net/v2/embed-4/{xrax}?z=", headers=self.client_headers)
+        embed_req = await self.fetch(f"https://rabbitstream.net/v2/embed-4/{xrax}?z=", site="get_meta", headers=self.client_headers)
+        wasm_version = self.wasm_version_pattern.search(embed_req.text)
+        if wasm_version:
+            self.wasm_file.set_url(f"{self.base}/images/loading.png?v={wasm_version.group(1)}")
         meta_match = re.search(r"name=\"fyq\"\s?content=\"(\w+)\"", embed_req.text)
         if not meta_match:
             self.logger.error("No meta could be retrived!")
@@ -120,10 +137,13 @@ class Rabbitstream(BaseProvider):
         return meta_match.group(1)
 
     async def get_sources(self, xrax: str, keys: List, kversion: str, kid: str, browserid: str) -> Optional[Dict]:
-        req = await self.client.get(
+        req = await self.fetch(
                 f"https://rabbitstream.net/ajax/v2/embed-4/getSources",
+                site="get_sources",
                 params={"id": xrax, "v": kversion, "h": kid, "b": browserid},
-                headers=self.client_headers
+                headers=self.client_headers,
+                # The keys are single use, a resent request can only fail
+                retry=False,
             )
         if not req.is_success:
             self.logger.error(
@@ -138,21 +158,35 @@ class Rabbitstream(BaseProvider):
             return None
         return data
 
-    @async_lru_cache_parameterless
+    async def warm_up(self) -> None:
+        # Pulls the wasm, opens the connection and starts the JS runtime(s)
+        await self.get_wasm()
+        payload = await self.get_payload()
+        pool = self.get_pool(payload)
+        if pool:
+            await pool.warm_up()
+        else:
+            worker.load_runtime(payload)
+
     async def get_wasm(self) -> bytes:
-        wasm_req = await self.client.get(f'https://rabbitstream.net/images/loading.png?v=0.6', headers=self.client_headers)
-        return wasm_req.content
+        artifact = await self.wasm_file.get(self.transport, headers=self.client_headers)
+        return artifact.content
 
-    @async_lru_cache(maxsize=128)
+    # Decrypted sources carry short lived tokens
+    @async_cache(maxsize=256, ttl=600, max_bytes=16 * 1024 * 1024)
     @retry(retry=retry_if_exception_type(ValueError), stop=stop_after_attempt(3))
     async def get_data(self, xrax: str) -> Dict:
-        wasm = await self.get_wasm()
+        # The embed page carries the wasm `?v=`, so it has to be read before the wasm is picked
         meta = await self.get_meta(xrax)
+        wasm = await self.get_wasm()
         if not wasm or not meta:
             raise ValueError("Failed to retrieve wasm or meta!\n\tWasm Exists: {}\nMeta - {}".format(not not wasm, meta))
 
+        deadline = Deadline.current()
+        if deadline:
+            deadline.check("instantiate_and_decrypt")
         keys, kversion, kid, browserid = await self.instantiate_and_decrypt(xrax, meta, wasm)
-        sources_data = await self.get_sources(xrax=xrax, keys=keys.tolist(), kversion=kversion, kid=kid, browserid=browserid)
+        sources_data = await self.get_sources(xrax=xrax, keys=keys, kversion=kversion, kid=kid, browserid=browserid)
         if not sources_data:
             self.logger.error("Could not retrieve encrypted sources!")
             raise ValueError("Could not retrieve encrypted sources!")
@@ -162,26 +196,11 @@ class Rabbitstream(BaseProvider):
             self.logger.error("Could not retrieve ciphertext from encrypted sources!")
             raise ValueError("Could not retrieve ciphertext from encrypted sources!")
 
-        formatted_key = self.format_wasm_key(
-            keys=keys.tolist(),
+        decrypted = await self.decrypt_sources(
+            ciphertext=ciphertext,
+            keys=keys,
             kversion=kversion
         )
-        if not formatted_key:
-            self.logger.error("No formatted key!")
-            raise ValueError("No formatted key!")
-
-        decryption_key = self.generate_encryption_key(
-            salt=self.base64_to_bytearray(ciphertext)[8:16], 
-            secret=formatted_key.encode("utf-8")
-        )
-        if not decryption_key:
-            self.logger.error("No decryption key!")
-            raise ValueError("No decryption key!")
-
-        decrypted = self.decrypt_aes_data(
-            ciphertext=ciphertext, 
-            decryption_key=decryption_key
-        )
         if not decrypted or "https://" not in decrypted:
             self.logger.error("Failed to decrypt AES data!")
             raise ValueError("Failed to decrypt AES data!")
@@ -190,15 +209,19 @@ class Rabbitstream(BaseProvider):
         sources_data.update({"sources": json.loads(decrypted)})
         return sources_data
 
-    @async_lru_cache(maxsize=128)
+    @async_cache(maxsize=256, ttl=600, key=lambda self, playlist, provider_headers=None: playlist)
     async def get_qualities(self, playlist: str, provider_headers=ProviderHeaders) -> List:
-        req = await self.client.get(playlist, headers=provider_headers.headers)
-        if not req.is_success:
-            self.logger.error("Failed to request playlist!")
-            raise ValueError("Failed to request playlist!")
+        req = await self.fetch(playlist, site="get_qualities", headers=provider_headers.headers, stream=True)
+        try:
+            if not req.is_success:
+                self.logger.error("Failed to request playlist!")
+                raise ValueError("Failed to request playlist!")
+            # Parsed as the body arrives, relative URIs resolve against wherever we were redirected to
+            master = await parse_master_lines(req.aiter_lines(), str(req.url))
+        finally:
+            await req.aclose()
 
-        base = playlist.rpartition("/")[0]
-        m3u8_data = self.parse_m3u8(headers=provider_headers, m3u8_url=base, m3u8_data=req.text)
+        m3u8_data = self.streams_from_playlist(headers=provider_headers, playlist=master)
         if not m3u8_data:
             self.logger.error("No result from parse_m3u8!")
             raise ValueError("No result from parse_m3u8!")
@@ -230,4 +253,6 @@ class Rabbitstream(BaseProvider):
             return None
 
         qualities = await self.get_qualities(playlist=playlist.get("file"), provider_headers=headers)
+        if self.index_playlists:
+            qualities = await self.index_streams(qualities, headers)
         return ProviderResponse(provider=self.__class__.__name__, streams=qualities, subtitles=data.get("subtitles"))
\ No newline at end of file
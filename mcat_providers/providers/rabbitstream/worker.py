@@ -0,0 +1,148 @@
+'''
+    Everything the key extraction workers run.
+    Kept free of httpx/client state so the functions can be sent to another process as-is.
+    Each worker process loads `payload.js` into its own pythonmonkey runtime once and keeps it warm.
+'''
+import base64
+import hashlib
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Optional, List, Tuple
+
+from Cryptodome.Cipher import AES
+from Cryptodome.Util.Padding import unpad
+
+from mcat_providers.config import log
+
+Keys = Tuple[List[int], str, str, str]
+
+_runtime: Any = None
+_runtime_payload: Optional[str] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def load_runtime(payload: str) -> Any:
+    global _runtime, _runtime_payload
+    if _runtime is None or _runtime_payload != payload:
+        import pythonmonkey
+        _runtime = pythonmonkey.eval(payload)
+        _runtime_payload = payload
+    return _runtime
+
+async def call_runtime(runtime: Any, xrax: str, meta: str, wasm: bytes) -> Keys:
+    keys, kversion, kid, browserid = await runtime(xrax, meta, wasm)
+    return keys.tolist(), kversion, kid, browserid
+
+def init_worker(payload: str) -> None:
+    global _loop
+    load_runtime(payload)
+    # pythonmonkey settles its promises on an asyncio loop, each worker keeps one around
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+
+def ping() -> bool:
+    return _runtime is not None
+
+def extract_keys(xrax: str, meta: str, wasm: bytes) -> Keys:
+    assert _runtime is not None and _loop is not None, "Worker was not initialised with a payload!"
+    return _loop.run_until_complete(call_runtime(_runtime, xrax, meta, wasm))
+
+# Crypto
+def calculate_md5(input_bytes: bytes) -> bytes:
+    return hashlib.md5(input_bytes).digest()
+
+def base64_to_bytearray(encoded_str) -> bytearray:
+    return bytearray(base64.b64decode(encoded_str))
+
+def format_wasm_key(keys: List, kversion: str) -> str:
+    def convert_to_bytes(kversion: int) -> List[int]:
+        return [
+            (4278190080 & kversion) >> 24,
+            (16711680 & kversion) >> 16,
+            (65280 & kversion) >> 8,
+            255 & kversion
+        ]
+
+    def xor_with_version(keys: List, kversion_bytes: List[int]) -> Optional[List]:
+        try:
+            for i in range(len(keys)):
+                keys[i] ^= kversion_bytes[i % len(kversion_bytes)]
+            return keys
+        except Exception as e:
+            log.error(e)
+            return None
+
+    converted = convert_to_bytes(int(kversion))
+    processed_keys = xor_with_version(keys, converted) or keys
+    return base64.b64encode(bytearray(processed_keys)).decode('utf-8')
+
+def generate_encryption_key(salt, secret) -> bytes:
+    key = calculate_md5(secret + salt)
+    current_key = key
+    while len(current_key) < 48:
+        key = calculate_md5(key + secret + salt)
+        current_key += key
+    return current_key
+
+def decrypt_aes_data(ciphertext, decryption_key) -> str:
+    cipher_data = base64_to_bytearray(ciphertext)
+    encrypted = cipher_data[16:]
+    AES_CBC = AES.new(
+        decryption_key[:32], AES.MODE_CBC, iv=decryption_key[32:]
+    )
+    decrypted_data = unpad(
+        AES_CBC.decrypt(encrypted), AES.block_size
+    )
+    return decrypted_data.decode("utf-8")
+
+def decrypt_sources(ciphertext: str, keys: List, kversion: str) -> str:
+    formatted_key = format_wasm_key(keys=list(keys), kversion=kversion)
+    if not formatted_key:
+        raise ValueError("No formatted key!")
+    decryption_key = generate_encryption_key(
+        salt=base64_to_bytearray(ciphertext)[8:16],
+        secret=formatted_key.encode("utf-8")
+    )
+    if not decryption_key:
+        raise ValueError("No decryption key!")
+    return decrypt_aes_data(ciphertext=ciphertext, decryption_key=decryption_key)
+
+class KeyExtractionPool:
+    '''
+        Pool of worker processes, each with a warm JS runtime, so key extraction scales with cores
+        instead of being serialised on the event loop. Workers are spawned (not forked) so no
+        SpiderMonkey or event loop state is shared with the parent.
+    '''
+    def __init__(self, payload: str, workers: int) -> None:
+        assert workers > 0, "A key extraction pool needs at least one worker!"
+        self.payload = payload
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(self.payload,),
+            )
+        return self._executor
+
+    async def warm_up(self) -> None:
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, ping) for _ in range(self.workers)))
+
+    async def extract_keys(self, xrax: str, meta: str, wasm: bytes) -> Keys:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, extract_keys, xrax, meta, bytes(wasm))
+
+    async def decrypt_sources(self, ciphertext: str, keys: List, kversion: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, decrypt_sources, ciphertext, keys, kversion)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
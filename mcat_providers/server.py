@@ -0,0 +1,234 @@
+import json
+import math
+import time
+import signal
+import asyncio
+from urllib.parse import urlsplit, parse_qsl
+from typing import Optional, Union, Dict, List, Tuple
+
+from mcat_providers.config import settings, log
+from mcat_providers.sources import BaseSource
+from mcat_providers.utils.decorators import cache_stats
+from mcat_providers.utils.types import SourceResponse
+from mcat_providers.utils.serialize import packb
+
+class ResolverServer:
+    '''
+        Small HTTP/1.1 server (TCP or unix socket) that keeps sources, providers, the JS runtime,
+        the wasm, open connections and every in-process cache warm between requests.
+
+        GET  /health                     -> always 200 once listening
+        GET  /ready                      -> 200 once warm-up has finished, 503 before
+        GET  /resolve?tmdb=278&media_type=movie[&season=1&episode=1][&quality=720p][&timeout=10][&probe=3][&src=flixhq]
+        POST /resolve                    -> same, with the parameters as a JSON body
+        GET  /stats
+
+        Responses are JSON, or MessagePack when the request sends `Accept: application/msgpack`.
+        `serve_forever` stops on SIGINT/SIGTERM and `close()`s, which lets running resolves finish for up to
+        `shutdown_timeout` seconds and then releases connections, caches and the JS worker pools.
+    '''
+    max_body = 64 * 1024
+    shutdown_timeout = 5.0
+
+    def __init__(self, sources: Dict[str, BaseSource], max_inflight: int = 64, ready_file: Optional[str] = None) -> None:
+        assert sources, "At least one source is needed!"
+        self.sources = {name.lower(): source for name, source in sources.items()}
+        self.default_source = next(iter(self.sources))
+        self.ready = asyncio.Event()
+        self.stopping = asyncio.Event()
+        self.ready_file = ready_file
+        self.inflight = asyncio.Semaphore(max_inflight)
+        self.stats = {"requests": 0, "resolved": 0, "failed": 0, "started": time.time(), "warmup_seconds": None}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._warm_up_task: Optional[asyncio.Task] = None
+
+    async def warm_up(self) -> None:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(source.warm_up() for source in self.sources.values()), return_exceptions=True)
+        for name, result in zip(self.sources, results):
+            if isinstance(result, Exception):
+                log.error(f"Warm-up failed for '{name}': {result}")
+        self.stats["warmup_seconds"] = round(time.perf_counter() - start, 3)
+        self.ready.set()
+        if self.ready_file:
+            with open(self.ready_file, "w", encoding="utf-8") as f:
+                f.write(str(self.stats["warmup_seconds"]))
+        log.info(f"Resolver ready after {self.stats['warmup_seconds']}s")
+
+    @staticmethod
+    def seconds(params: Dict, name: str) -> Optional[float]:
+        '''A positive number of seconds from `params`, None when it is missing, ValueError when it is not one.'''
+        value = params.get(name)
+        if value is None or value == "":
+            return None
+        try:
+            seconds = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be a number of seconds, not '{value}'")
+        if not math.isfinite(seconds) or seconds <= 0:
+            raise ValueError(f"{name} must be a positive number of seconds, not '{value}'")
+        return seconds
+
+    async def resolve(self, params: Dict) -> Tuple[int, Union[Dict, SourceResponse]]:
+        src = str(params.get("src") or self.default_source).lower()
+        source = self.sources.get(src)
+        if not source:
+            return 404, {"error": f"Unknown source: '{src}'"}
+        if not params.get("tmdb") and not params.get("source_id"):
+            return 400, {"error": "tmdb or source_id is required"}
+        try:
+            timeout = self.seconds(params, "timeout")
+            probe_budget = self.seconds(params, "probe")
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        await self.ready.wait()
+        async with self.inflight:
+            try:
+                result = await source.scrape_all(
+                    media_type=params.get("media_type") or "movie",
+                    season=str(params.get("season") or "0"),
+                    episode=str(params.get("episode") or "0"),
+                    source_id=params.get("source_id"),
+                    tmdb=params.get("tmdb"),
+                    min_quality=params.get("quality"),
+                    timeout=timeout,
+                    probe_budget=probe_budget,
+                )
+            except Exception as e:
+                log.error(f"Failed to resolve {params}: {e}")
+                self.stats["failed"] += 1
+                return 502, {"error": f"{e.__class__.__name__}: {e}"}
+        if not result:
+            self.stats["failed"] += 1
+            return 404, {"error": "No sources found"}
+        self.stats["resolved"] += 1
+        return 200, result
+
+    async def route(self, method: str, target: str, body: bytes) -> Tuple[int, Union[Dict, SourceResponse]]:
+        url = urlsplit(target)
+        if url.path == "/health":
+            return 200, {"status": "ok"}
+        if url.path == "/ready":
+            return (200, {"ready": True}) if self.ready.is_set() else (503, {"ready": False})
+        if url.path == "/stats":
+            return 200, {
+                **self.stats,
+                "caches": cache_stats(),
+                "sources": {name: source.stats for name, source in self.sources.items()},
+            }
+        if url.path == "/resolve":
+            if method == "POST":
+                try:
+                    params = json.loads(body or b"{}")
+                except ValueError:
+                    return 400, {"error": "Body must be JSON"}
+                if not isinstance(params, dict):
+                    return 400, {"error": "Body must be a JSON object"}
+            else:
+                params = dict(parse_qsl(url.query))
+            return await self.resolve(params)
+        return 404, {"error": f"Unknown path: '{url.path}'"}
+
+    @staticmethod
+    def encode_response(status: int, data: Union[Dict, SourceResponse], keep_alive: bool, msgpack: bool = False) -> bytes:
+        if msgpack:
+            body, content_type = packb(data), "application/msgpack"
+        elif isinstance(data, SourceResponse):
+            body, content_type = data.to_json_bytes(), "application/json"
+        else:
+            body, content_type = json.dumps(data).encode(), "application/json"
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 502: "Bad Gateway", 503: "Service Unavailable"}
+        head = (
+            f"HTTP/1.1 {status} {reason.get(status, 'Error')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        return head.encode() + body
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split(" ", 2)
+                headers: Dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version.strip() == "HTTP/1.1"
+                length = int(headers.get("content-length") or 0)
+                if length > self.max_body:
+                    writer.write(self.encode_response(413, {"error": "Body too large"}, False))
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                self.stats["requests"] += 1
+                status, data = await self.route(method.upper(), target, body)
+                msgpack = "application/msgpack" in headers.get("accept", "") or "application/x-msgpack" in headers.get("accept", "")
+                writer.write(self.encode_response(status, data, keep_alive, msgpack))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError) as e:
+            log.debug(f"Dropping connection: {e}")
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765, unix_path: Optional[str] = None) -> asyncio.AbstractServer:
+        if unix_path:
+            self._server = await asyncio.start_unix_server(self.handle, path=unix_path)
+        else:
+            self._server = await asyncio.start_server(self.handle, host=host, port=port)
+        log.info(f"Resolver listening on {unix_path or f'{host}:{port}'}")
+        # Accept connections straight away so /health and /ready answer during warm-up
+        self._warm_up_task = asyncio.ensure_future(self.warm_up())
+        return self._server
+
+    async def serve_forever(self, **kwargs) -> None:
+        '''Serves until SIGINT/SIGTERM (or `stopping` is set), then closes.'''
+        await self.start(**kwargs)
+        loop = asyncio.get_running_loop()
+        handled = []
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.stopping.set)
+                handled.append(signum)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Windows, or not the main thread
+                pass
+        try:
+            await self.stopping.wait()
+        finally:
+            for signum in handled:
+                loop.remove_signal_handler(signum)
+            await self.close()
+
+    async def close(self) -> None:
+        '''Stops listening, gives running requests `shutdown_timeout` seconds, then releases everything kept warm.'''
+        from mcat_providers.plugins import registry
+
+        if self._server is not None:
+            self._server.close()
+            try:
+                await asyncio.wait_for(self._server.wait_closed(), self.shutdown_timeout)
+            except asyncio.TimeoutError:
+                log.warning(f"Requests still running after {self.shutdown_timeout}s, closing anyway")
+            self._server = None
+        if self._warm_up_task is not None and not self._warm_up_task.done():
+            self._warm_up_task.cancel()
+            await asyncio.gather(self._warm_up_task, return_exceptions=True)
+        # Only providers that were imported can hold anything
+        for spec in registry.providers():
+            if spec.loaded:
+                try:
+                    spec.load().shutdown()
+                except Exception as e:
+                    log.error(f"Failed to shut down '{spec.name}': {e}")
+        await settings.aclose()
+        log.info("Resolver stopped")
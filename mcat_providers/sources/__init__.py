@@ -1,10 +1,14 @@
 import os
-from typing import Optional, Dict
+import httpx
+from typing import Optional, Union, Dict
 
-from mcat_providers import client, sync_client, default_ua, log
+from mcat_providers.config import SettingsAttribute, settings, default_ua, log
+from mcat_providers.transport import HttpTransport, TransportConfig, ClientAttribute
+from mcat_providers.probe import StreamProber
 from mcat_providers.providers import BaseProvider
-from mcat_providers.utils.types import MediaType, MediaEnum
-from mcat_providers.utils.decorators import async_lru_cache
+from mcat_providers.utils.types import MediaType, MediaEnum, ProviderResponse
+from mcat_providers.utils.decorators import async_cache, persistent_cache
+from mcat_providers.utils.id_index import SourceIdIndex
 from mcat_providers.utils.exceptions import DisabledSourceError
 
 class BaseSource:
@@ -14,13 +18,97 @@ class BaseSource:
 
     # Defaults
     logger = log
-    client = client
-    sync_client = sync_client
-    tmdb_api_key = os.getenv("TMDB_API_KEY")
+    transport = SettingsAttribute("transport")
+    client = ClientAttribute()
+    sync_client = SettingsAttribute("sync_client")
+    tmdb_api_key = SettingsAttribute("tmdb_api_key")
     default_headers = {"User-Agent": default_ua}
 
+    def __init__(
+        self,
+        transport: Optional[Union[HttpTransport, TransportConfig, httpx.AsyncBaseTransport]] = None,
+        **kwargs
+    ) -> None:
+        if transport is not None:
+            self.transport = HttpTransport.coerce(transport)
+
+    async def fetch(self, url: str, site: str = "default", **kwargs) -> httpx.Response:
+        return await self.transport.get(url, site=site, owner=self.__class__.__name__, **kwargs)
+
+    async def warm_up(self) -> None:
+        '''Opens a connection to the source so the first real request skips the TCP/TLS handshake.'''
+        await self.fetch(self.base, site="warm_up", headers=self.default_headers)
+
+    @property
+    def stats(self) -> Dict:
+        '''Source specific counters, served on the resolver's `/stats`.'''
+        return {"hosts": self.transport.limiter_stats()}
+
+    @property
+    def id_index(self) -> SourceIdIndex:
+        '''Offline gmid -> source id map, consulted before searching the source.'''
+        if getattr(self, "_id_index", None) is None:
+            self._id_index = SourceIdIndex(os.path.join(settings.id_index_dir, f"{self.name.lower()}.idx"))
+        return self._id_index
+
+    @id_index.setter
+    def id_index(self, index: SourceIdIndex) -> None:
+        self._id_index = index
+
+    @property
+    def prober(self) -> StreamProber:
+        if getattr(self, "_prober", None) is None:
+            self._prober = StreamProber(self.transport)
+        return self._prober
+
+    async def expected_runtime(self, media: MediaType) -> Optional[float]:
+        '''TMDB runtime of `media` in minutes, only looked up when media playlists are indexed (nothing else can check it).'''
+        if not settings.index_playlists or not media.tmdb:
+            return None
+        try:
+            data = await self.resolve_tmdb(media)
+        except Exception as e:
+            self.logger.warning(f"No runtime for {media.base_gmid}: {e}")
+            return None
+        return (data or {}).get("duration") or None
+
+    def check_runtime(self, response: ProviderResponse, minutes: Optional[float]) -> Optional[ProviderResponse]:
+        '''Drops indexed streams that are not `minutes` long, None when every stream is off (most likely a different title).'''
+        if not minutes:
+            return response
+        streams = [stream for stream in response.streams if stream.index is None or stream.index.matches_runtime(minutes) is not False]
+        if len(streams) == len(response.streams):
+            return response
+        if not streams:
+            self.logger.error(f"Every stream from '{response.provider}' is the wrong length for a {minutes} minute runtime!")
+            return None
+        return ProviderResponse(provider=response.provider, streams=streams, subtitles=response.subtitles)
+
+    async def resolve_provider(
+        self,
+        provider: BaseProvider,
+        url: str,
+        probe_budget: Optional[float] = None,
+        runtime: Optional[float] = None,
+    ) -> Optional[ProviderResponse]:
+        '''
+            Resolves `url` with `provider`. With `runtime` (minutes) indexed streams of the wrong length are dropped,
+            with `probe_budget` dead streams are dropped and the rest ranked by throughput.
+        '''
+        response = await provider.resolve(url)
+        if response and runtime:
+            response = self.check_runtime(response, runtime)
+        if not response or not probe_budget:
+            return response
+        response = await self.prober.rank(response, probe_budget)
+        if not response.streams:
+            self.logger.error(f"Every stream from '{response.provider}' failed its probe!")
+            return None
+        return response
+
     @classmethod
-    @async_lru_cache(maxsize=128)
+    @async_cache(maxsize=256, ttl=3600, key=lambda cls, media: media.base_gmid)
+    @persistent_cache("tmdb", key=lambda cls, media: media.base_gmid)
     async def resolve_tmdb(cls, media: MediaType):
         """
         Needs a TMDB_API_KEY in .mcat env in current state
@@ -43,7 +131,7 @@ class BaseSource:
         url = f"{base_url}{endpoint}"
 
         try:
-            response = await cls.client.get(url, headers=headers)
+            response = await cls.transport.get(url, site="resolve_tmdb", owner=cls.__name__, headers=headers)
             response.raise_for_status()  
             data = response.json()
             return {
@@ -1,14 +1,20 @@
 import re
+import time
 import httpx
 import asyncio
 
 from datetime import datetime
-from typing import Optional, Union, List, Dict, Tuple
+from collections import Counter
+from typing import Optional, Union, List, Dict, Tuple, Set, Callable, Iterable, AsyncIterator, Counter as CounterType
 
+from mcat_providers.config import settings
 from mcat_providers.sources import BaseSource
-from mcat_providers.utils.decorators import async_lru_cache
-from mcat_providers.providers.rabbitstream import Rabbitstream
-from mcat_providers.utils.types import ProviderResponse, SourceResponse, MediaType, MediaEnum
+from mcat_providers.utils.deadline import Deadline
+from mcat_providers.utils.exceptions import DeadlineExceeded, SearchError
+from mcat_providers.utils.health import HealthRegistry, HALF_OPEN
+from mcat_providers.utils.decorators import async_cache, persistent_cache
+from mcat_providers.plugins import LazyProviders, registry
+from mcat_providers.utils.types import ProviderResponse, SourceResponse, MediaType, MediaEnum, QualityEnum
 
 class FlixHq(BaseSource):
     name = "FlixHq"
@@ -18,32 +24,56 @@ class FlixHq(BaseSource):
         **BaseSource.default_headers
     }
     entries_pattern = re.compile(r"<div class=\"film-detail\">.+?(?=\"clearfix\")")
+    pager_pattern = re.compile(r"[?&]page=(\d+)")
+    # Search pages read per lookup at most
+    max_search_pages = 3
+    # Ambiguous search results (remakes, same name series) whose pages are fetched at once
+    verify_concurrency = 4
+    # See `score_candidate`, an exact release date is needed, with every genre as well it confirms the candidate
+    confirmed_candidate_score = 6
+    min_candidate_score = 4
+    # Seconds one server gets (get_file and resolve) before the next server of the same provider is tried
+    server_timeout = 15.0
 
     def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
         # self.client.cookies.update({"show_share": "true"})
         self.client_headers = kwargs.get("headers") or {}
         self.client_headers.update(self.default_headers)
-        self.providers = {
-            "upcloud": Rabbitstream(**kwargs),
-            "vidcloud": Rabbitstream(**kwargs),
-            "upstream": None,
-            "doodstream": None,
-            "mixdrop": None,
-            "voe": None,
+        # Pages read per `query_flix` lookup -> number of lookups
+        self.search_pages: CounterType[int] = Counter()
+        # Success rate, latency and circuit breaker of each server name ("upcloud", "vidcloud", ...)
+        self.health = HealthRegistry()
+        # Providers share our transport unless they are given their own
+        provider_kwargs = {**kwargs, "transport": kwargs.get("provider_transport") or kwargs.get("transport")}
+        # Rabbitstream (upcloud, vidcloud) and its JS runtime are only imported once one of its servers is picked
+        self.providers = LazyProviders(
+            provider_kwargs.pop("registry", None) or registry,
+            known=("upstream", "doodstream", "mixdrop", "voe"),
+            **provider_kwargs
+        )
+
+    async def warm_up(self) -> None:
+        # Warming up is meant to pay the imports and JS runtime start up front, so load every provider
+        providers = {id(provider): provider for provider in self.providers.load_all()}
+        await asyncio.gather(super().warm_up(), *(provider.warm_up() for provider in providers.values()))
+
+    @property
+    def stats(self) -> Dict:
+        scrapes = self.scrape_coalesced.cache.stats()
+        return {
+            **super().stats,
+            "servers": self.health.snapshot(),
+            "search_pages": {str(pages): count for pages, count in sorted(self.search_pages.items())},
+            # Calls that ran a scrape, joined one in flight or were served a recent result
+            "scrapes": {"started": scrapes["misses"], "joined": scrapes["joins"], "reused": scrapes["hits"]},
         }
 
-    @async_lru_cache(maxsize=128)
-    async def query_flix(self, title: str):
-        title = title.lower().strip()
-        title = "-".join(title.split(" "))
-        tasks = [self.client.get(f"{self.base}/search/{title}", params={"page": i}) for i in range(1, 4)]
-        responses = await asyncio.gather(*tasks)
-        entries = []
-        for response in responses:
-            data = self.entries_pattern.findall(response.text.replace("\n", "\\n"))
-            entries.extend(data)
+    def parse_search_page(self, text: str) -> Tuple[List[Dict], int]:
+        '''Returns the entries on a search page and the number of pages the pager says there are.'''
+        text = text.replace("\n", "\\n")
         results = []
-        for entry in entries:
+        for entry in self.entries_pattern.findall(text):
             title = re.search(r"title=\"([^\"]+)\"", entry)
             href = re.search(r"href=\"([^\"]+)\"", entry)
             fdi_type = re.search(r"fdi-type\">([^<]+)", entry)
@@ -65,20 +95,73 @@ class FlixHq(BaseSource):
                 "season_count": int(data_1.split(" ")[-1] or -1) if media_type == "tv" else 0,
                 "last_season_episode_count": int(data_2.split(" ")[-1] or -1) if media_type == "tv" else 0
             })
+        # No pager means everything fit on one page
+        pager = text.find("class=\"pagination")
+        pages = [int(page) for page in self.pager_pattern.findall(text, pager)] if pager != -1 else []
+        return results, max(pages, default=1)
+
+    @async_cache(maxsize=1024, ttl=3600, key=lambda self, slug, page: (slug, page), skip=lambda value: value is None)
+    @persistent_cache("search", key=lambda self, slug, page: f"{slug}:{page}", negative=lambda value: not value["entries"])
+    async def get_search_page(self, slug: str, page: int) -> Optional[Dict]:
+        req = await self.fetch(f"{self.base}/search/{slug}", site="query_flix", params={"page": page})
+        if not req.is_success:
+            self.logger.error(f"Could not retrieve search page {page} for '{slug}'")
+            return None
+        entries, pages = self.parse_search_page(req.text)
+        return {"entries": entries, "pages": pages}
+
+    async def query_flix(self, title: str, accept: Optional[Callable[[Dict], bool]] = None) -> List[Dict]:
+        '''
+            Searches flixhq for `title`, page 1 first and the next pages only when they are needed.
+            With `accept` the search stops at the first page that has an entry it accepts, without it
+            every page (up to `max_search_pages`) is read. Entries listed on more than one page are returned once.
+            Raises `SearchError` when a page it needed failed to load, an empty list means flixhq has nothing.
+        '''
+        slug = "-".join(title.lower().strip().split(" "))
+        first = await self.get_search_page(slug, 1)
+        if first is None:
+            raise SearchError(f"Search for '{title}' failed")
+        last_page = min(first["pages"], self.max_search_pages)
+        pages = [first]
+        if accept is None:
+            rest = await asyncio.gather(*(self.get_search_page(slug, page) for page in range(2, last_page + 1)))
+            pages.extend(rest)
+        else:
+            page = 1
+            while page < last_page and not any(accept(entry) for entry in pages[-1]["entries"]):
+                page += 1
+                pages.append(await self.get_search_page(slug, page))
+                if pages[-1] is None:
+                    break
+        self.search_pages[len(pages)] += 1
+        if any(data is None for data in pages):
+            raise SearchError(f"Search for '{title}' failed on page {pages.index(None) + 1}")
+
+        results, seen = [], set()
+        for data in pages:
+            for entry in data["entries"]:
+                if entry["url"] in seen:
+                    continue
+                seen.add(entry["url"])
+                results.append(entry)
         return results
 
+    @async_cache(maxsize=256, ttl=3600, skip=lambda value: value is None)
+    @persistent_cache("seasons", key=lambda self, flixhq_id: str(flixhq_id))
     async def get_seasons(self, flixhq_id: str) -> Optional[Dict]:
         headers={"X-Requested-With": "XMLHttpRequest", **self.default_headers}
-        req = await self.client.get(f"{self.base}/ajax/season/list/{flixhq_id}", headers=headers)
+        req = await self.fetch(f"{self.base}/ajax/season/list/{flixhq_id}", site="get_seasons", headers=headers)
         if not req.is_success:
             self.logger.error("Could not retieve available seasons!")
             return None
         season_ids = re.findall(r"<a\sdata-id=\"(\w+)\".+?(?=Season)Season\s(\d+)", req.text.replace("\n", ""))
         return {i[1]: i[0] for i in season_ids}
 
+    @async_cache(maxsize=1024, ttl=3600, skip=lambda value: value is None)
+    @persistent_cache("episodes", key=lambda self, season_id: str(season_id))
     async def get_episodes(self, season_id: str) -> Optional[Dict]:
         headers={"X-Requested-With": "XMLHttpRequest", **self.default_headers}
-        req = await self.client.get(f"{self.base}/ajax/season/episodes/{season_id}", headers=headers)
+        req = await self.fetch(f"{self.base}/ajax/season/episodes/{season_id}", site="get_episodes", headers=headers)
         if not req.is_success:
             self.logger.error("Could not retieve available episodes!")
             return None
@@ -87,7 +170,7 @@ class FlixHq(BaseSource):
 
     async def get_sources(self, source_id: str, media_type: MediaType) -> Optional[List]:
         headers={"X-Requested-With": "XMLHttpRequest", **self.default_headers}
-        req = await self.client.get(f"{self.base}/ajax/episode/{'list' if media_type == 'Movie' else 'servers'}/{source_id}", headers=headers)
+        req = await self.fetch(f"{self.base}/ajax/episode/{'list' if media_type == 'Movie' else 'servers'}/{source_id}", site="get_sources", headers=headers)
         if not req.is_success:
             self.logger.error("Could not retieve available sources!")
             return None
@@ -100,7 +183,7 @@ class FlixHq(BaseSource):
 
     async def get_file(self, name: str, provider_id: int) -> Tuple[str, Optional[str]]:
         headers={"X-Requested-With": "XMLHttpRequest", **self.default_headers}
-        req = await self.client.get(f"{self.base}/ajax/episode/sources/{provider_id}", headers=headers)
+        req = await self.fetch(f"{self.base}/ajax/episode/sources/{provider_id}", site="get_file", headers=headers)
         if not req.is_success:
             self.logger.error(f"Could not retieve source: '{name}'")
             return name, None
@@ -110,6 +193,90 @@ class FlixHq(BaseSource):
             return name, None
         return name, data.get("link")
 
+    async def get_candidate_details(self, url: str) -> Optional[Dict]:
+        '''Release date, genres and runtime from a title's page.'''
+        req = await self.fetch(url, site="verify_source")
+        if not req.is_success:
+            self.logger.error(f"Could not retrieve candidate page: '{url}'")
+            return None
+        full_date = re.search(r"Released:<\/span>\s+?(\d+-\d+-\d+)", req.text)
+        start = req.text.find('<span class="type">Genre:</span>')
+        end = req.text.find('<div class="row-line">', start)
+        segment = req.text[start:end] if start != -1 else ""
+        runtime = re.search(r"Duration:<\/span>\s+?(\d+)", req.text)
+        return {
+            "release": full_date.group(1) if full_date else None,
+            "genres": re.findall(r"href=\"\/genre\/[^\"]+\"\s+?title=\"([^\"]+)\"", segment),
+            "duration": int(runtime.group(1)) if runtime else None,
+        }
+
+    @staticmethod
+    def score_candidate(details: Dict, release: str, genres: List, duration: int) -> float:
+        '''
+            Exact release date 4, anything else (even the same year, remakes often are) rules the candidate out,
+            then genres up to 2 (the share of the page's genres TMDB also lists) and a runtime within 2 minutes 1.
+        '''
+        if not details["release"] or details["release"] != release:
+            return 0
+        score = 4.0
+        page_genres = details["genres"]
+        if page_genres:
+            score += 2 * sum(genre in genres for genre in page_genres) / len(page_genres)
+        elif not genres:
+            score += 2
+        if duration and details["duration"] and abs(details["duration"] - duration) <= 2:
+            score += 1
+        return score
+
+    async def verify_candidates(self, candidates: List[Dict], release: str, genres: List, duration: int) -> Optional[Dict]:
+        '''
+            Scores the candidates' pages, `verify_concurrency` at a time, and returns the best one scoring at least
+            `min_candidate_score` (ties go to the earlier search result). Stops as soon as one is confirmed,
+            i.e. its release date and every genre match.
+            Raises `SearchError` when none qualifies but a candidate page failed to load, it might have been the one.
+        '''
+        semaphore = asyncio.Semaphore(self.verify_concurrency)
+        failed = []
+
+        async def verify(position: int, item: Dict) -> Tuple[int, Dict, float]:
+            async with semaphore:
+                try:
+                    details = await self.get_candidate_details(item["url"])
+                except (DeadlineExceeded, asyncio.CancelledError):
+                    raise
+                except Exception as e:
+                    self.logger.error(f"Failed to verify candidate '{item['url']}': {e}")
+                    details = None
+            if details is None:
+                failed.append(item["url"])
+            return position, item, self.score_candidate(details, release, genres, duration) if details else 0
+
+        tasks = [asyncio.ensure_future(verify(position, item)) for position, item in enumerate(candidates)]
+        best: Optional[Tuple[int, Dict, float]] = None
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                position, item, score = await next_done
+                self.logger.debug(f"Candidate '{item['url']}' scored {score}")
+                if best is None or (score, -position) > (best[2], -best[0]):
+                    best = (position, item, score)
+                if score >= self.confirmed_candidate_score:
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if best is None or best[2] < self.min_candidate_score:
+            if failed:
+                raise SearchError(f"Could not verify {len(failed)} candidate(s): {failed}")
+            return None
+        return best[1]
+
+    @persistent_cache(
+        "source_id",
+        key=lambda self, title, media_type, duration, release, *args, **kwargs: f"{MediaEnum(media_type).value}:{title}:{release}",
+        # None is a real "no match", a search that failed raises `SearchError` and is never stored
+        skip=lambda source_id: False
+    )
     async def resolve_source_id(
         self, 
         title: str, 
@@ -123,53 +290,33 @@ class FlixHq(BaseSource):
         last_season_episode_count: int,
         languages: List
     ) -> Optional[str]:
-        results = await self.query_flix(title)
         title_year = int(release.split("-")[0])
         last_aired_year = int(last_air_date.split("-")[0])
         current_year = datetime.now().year
-        filtered_results = []
 
-        for item in results:
-            if item["type"] != media_type: 
-                continue
+        def matches(item: Dict) -> bool:
+            if item["type"] != media_type:
+                return False
             if item["duration"] not in (duration, -1):
-                continue
+                return False
             if item["title"] != title:
-                continue
+                return False
             if media_type == "Movie":
                 if item["year"] != title_year:
-                    continue
+                    return False
             elif media_type == "Series" and (current_year - last_aired_year) >= 1:
                 if item["last_season_episode_count"] not in (last_season_episode_count, -1):
-                    continue
+                    return False
                 if item["season_count"] not in (season_count, -1):
-                    continue
-            filtered_results.append(item)
+                    return False
+            return True
+
+        results = await self.query_flix(title, accept=matches)
+        filtered_results = [item for item in results if matches(item)]
         
         if len(filtered_results) > 1:
-            for item in filtered_results.copy():
-                if not filtered_results:
-                    break
-                index = filtered_results.index(item)
-                req = await self.client.get(item["url"])
-                full_date = re.search(r"Released:<\/span>\s+?(\d+-\d+-\d+)", req.text)
-                if not full_date:
-                    filtered_results.pop(index)
-                    continue
-                if full_date.group(1) != release:
-                    filtered_results.pop(index)
-                    continue
-                start = req.text.find('<span class="type">Genre:</span>')
-                end = req.text.find('<div class="row-line">', start)
-                segment = req.text[start:end]
-                page_genres = re.findall(r"href=\"\/genre\/[^\"]+\"\s+?title=\"([^\"]+)\"", segment)
-                if not page_genres and genres:
-                    filtered_results.pop(index)
-                for genre in page_genres:
-                    if genre in genres:
-                        continue
-                    filtered_results.pop(index)
-                    break
+            best = await self.verify_candidates(filtered_results, release, genres, duration)
+            filtered_results = [best] if best else []
 
         if not filtered_results:
             return None
@@ -178,84 +325,417 @@ class FlixHq(BaseSource):
         source_id = result["url"].split("-")[-1]
         return source_id
 
-    async def scrape_all(
-        self, 
-        media_type: str, 
-        season: str = "0", 
-        episode: str = "0",
-        source_id: Optional[str] = None, 
-        tmdb: Optional[str] = None,
-    ) -> Optional[SourceResponse]:
-        assert source_id or tmdb, "source_id or tmdb must be passed with call!"
-        media = MediaType(
-            tmdb=tmdb,
-            source_id=source_id,
-            media_type=media_type,
-            episode=episode,
-            season=season
-        )
+    async def search_source_id(self, media: MediaType) -> Optional[str]:
+        data = await self.resolve_tmdb(media)
+        if not data:
+            return None
+        return await self.resolve_source_id(**data)
+
+    async def get_servers(self, media: MediaType) -> Optional[List[Tuple[str, str]]]:
+        '''
+            Resolves `media` down to the (server name, link id) pairs we have a provider for.
+            The flixhq id comes from the offline index when it has the title, an indexed id that no longer
+            works is dropped and the title is searched for again.
+        '''
+        if media.source_id:
+            return await self.get_title_servers(media, media.source_id)
 
-        flixhq_id = source_id
-        if not source_id:
-            data = await self.resolve_tmdb(media)
-            flixhq_id = await self.resolve_source_id(**data)
+        indexed_id = self.id_index.get(media.base_gmid)
+        if indexed_id:
+            servers = await self.get_title_servers(media, indexed_id)
+            if servers is not None:
+                return servers
+            self.logger.warning(f"Indexed flixhq id {indexed_id} for {media.base_gmid} failed, searching instead")
 
+        try:
+            flixhq_id = await self.search_source_id(media)
+        except SearchError as e:
+            # Nothing learned, keep whatever the index has
+            self.logger.error(e)
+            return None
         if not flixhq_id:
             self.logger.error("No valid flixhq_id!")
+            if indexed_id:
+                self.id_index.discard(media.base_gmid)
             return None
+        self.id_index.set(media.base_gmid, flixhq_id)
+        if flixhq_id == indexed_id:
+            # The id was right, the episode (or its servers) just is not there
+            return None
+        return await self.get_title_servers(media, flixhq_id)
 
+    async def get_title_servers(self, media: MediaType, flixhq_id: str) -> Optional[List[Tuple[str, str]]]:
         source_id = flixhq_id
         if media.media_type == "Series":
-            seasons = await self.get_seasons(flixhq_id)
-            season_id = seasons.get(season)
+            seasons = await self.get_seasons(flixhq_id) or {}
+            season_id = seasons.get(media.season)
             if not season_id:
-                self.logger.error(f"Season '{season}' does not exist in available seasons '{list(seasons.keys())}'")
+                self.logger.error(f"Season '{media.season}' does not exist in available seasons '{list(seasons.keys())}'")
                 return None
-            episodes = await self.get_episodes(season_id)
-            episode_id = episodes.get(episode)
+            episodes = await self.get_episodes(season_id) or {}
+            episode_id = episodes.get(media.episode)
             if not episode_id:
-                self.logger.error(f"Episode '{episode}' does not exist in available episodes '{list(episodes.keys())}'")
+                self.logger.error(f"Episode '{media.episode}' does not exist in available episodes '{list(episodes.keys())}'")
                 return None
             source_id = episode_id
-            
-        sources = await self.get_sources(source_id, media.media_type)
+        return await self.get_provider_servers(source_id, media.media_type)
+
+    async def get_provider_servers(self, source_id: str, media_type: MediaType) -> Optional[List[Tuple[str, str]]]:
+        '''(server name, link id) pairs for a movie id or an episode id.'''
+        sources = await self.get_sources(source_id, media_type)
         if not sources:
-            print("Could not retrieve sources!")
+            self.logger.error("Could not retrieve sources!")
             return None
+        return [(name, provider_id) for name, provider_id in sources if self.providers.handles(name)]
+
+    async def scrape_iter(
+        self,
+        media_type: str,
+        season: str = "0",
+        episode: str = "0",
+        source_id: Optional[str] = None,
+        tmdb: Optional[str] = None,
+        timeout: Optional[float] = None,
+        deadline: Optional[Deadline] = None,
+        probe_budget: Optional[float] = None,
+        episode_id: Optional[str] = None,
+    ) -> AsyncIterator[ProviderResponse]:
+        '''
+            Yields each `ProviderResponse` as soon as its provider has resolved.
+            Providers run concurrently, but each one tries its servers in health order and only falls back to
+            the next server when one fails or takes longer than `server_timeout`.
+            Anything still running is cancelled once the consumer stops iterating.
+            `timeout` (or an existing `deadline`) bounds the whole pipeline, every step only gets what is left of it.
+            `probe_budget` probes each provider's streams for up to that many seconds before it is yielded.
+            `episode_id` is flixhq's own episode id, when it is already known the title/season/episode lookups are skipped.
+        '''
+        assert source_id or tmdb, "source_id or tmdb must be passed with call!"
+        media = MediaType(
+            tmdb=tmdb,
+            source_id=source_id,
+            media_type=media_type,
+            episode=episode,
+            season=season
+        )
 
-        def remove_provider(name):
-            for idx, data in enumerate(sources.copy()):
-                value, _ = data
-                if value == name: 
-                    del sources[idx]
+        deadline = Deadline.coerce(timeout, deadline)
 
-        for name, ctx in self.providers.items():
-            if not ctx:
-                remove_provider(name)
-        
-        tasks = [self.get_file(name, provider_id) for name, provider_id in sources]
-        seen_providers: List = []
-        sub_tasks: List = []
+        def spawn(coro, step: str) -> asyncio.Future:
+            return asyncio.ensure_future(deadline.run(coro, step) if deadline else coro)
 
-        for task in asyncio.as_completed(tasks):
-            name, file = await task
-            if not file:
-                continue
+        try:
+            servers = self.get_provider_servers(episode_id, media.media_type) if episode_id else self.get_servers(media)
+            sources = await spawn(servers, "get_servers")
+            # Only known when playlists are indexed, streams of the wrong length are then dropped
+            runtime = await spawn(self.expected_runtime(media), "resolve_tmdb") if sources and settings.index_playlists else None
+        except DeadlineExceeded as e:
+            self.logger.error(e)
+            return
+        if not sources:
+            return
+
+        # Healthiest servers first, ones with an open breaker are skipped until it half-opens
+        allowed, skipped = self.health.select(dict.fromkeys(name for name, _ in sources))
+        if skipped:
+            self.logger.info(f"Skipping unhealthy servers {skipped}")
+        rank = {name: position for position, name in enumerate(allowed)}
+        sources = sorted((source for source in sources if source[0] in rank), key=lambda source: rank[source[0]])
+
+        # Servers grouped by the provider that resolves them, each group in health order
+        groups: Dict[str, List[Tuple[str, str, object]]] = {}
+        for name, provider_id in sources:
             resolver = self.providers.get(name, "unknown")
-            name = resolver.__class__.__name__
-            if name in seen_providers:
-                continue
-            seen_providers.append(name)
-            if not resolver:
-                continue
             if resolver == "unknown":
                 self.logger.warning(f"Unknown source '{name}'")
                 continue
-            sub_tasks.append(resolver.resolve(file))
-    
-        if not sub_tasks:
-            self.logger.error("No resolver tasks!")
+            if resolver:
+                groups.setdefault(resolver.__class__.__name__, []).append((name, provider_id, resolver))
+
+        # Every group tries its servers one after the other, only a half-open server (a probe) runs alongside
+        tasks: Dict[asyncio.Future, str] = {}
+        attempted: Set[str] = set()
+        for provider_name, servers in groups.items():
+            ordered = [server for server in servers if self.health[server[0]].state != HALF_OPEN]
+            probes = [server for server in servers if self.health[server[0]].state == HALF_OPEN]
+            if not ordered:
+                ordered, probes = probes, []
+            tasks[spawn(self.resolve_in_order(ordered, probe_budget, attempted, runtime), provider_name)] = provider_name
+            for server in probes:
+                tasks[spawn(self.resolve_in_order([server], probe_budget, attempted, runtime), f"{provider_name}.probe")] = provider_name
+
+        resolved: Set[str] = set()
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception():
+                        self.logger.error(f"Provider task failed: {task.exception()}")
+                        continue
+                    response = task.result()
+                    provider_name = tasks[task]
+                    # A probe and its group can both come through, the provider is only handed out once
+                    if response and provider_name not in resolved:
+                        resolved.add(provider_name)
+                        yield response
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            # Half-open servers that were let through but never tried give their probe back
+            for name in rank:
+                if name not in attempted:
+                    self.health[name].release()
+
+    async def resolve_server(
+        self,
+        name: str,
+        provider_id: str,
+        resolver,
+        probe_budget: Optional[float] = None,
+        runtime: Optional[float] = None,
+    ) -> Optional[ProviderResponse]:
+        '''get_file and resolve for one server within `server_timeout`, the outcome goes into its health record.'''
+        started = time.monotonic()
+        response = None
+        try:
+            _, file = await asyncio.wait_for(self.get_file(name, provider_id), self.server_timeout)
+            if file:
+                remaining = self.server_timeout - (time.monotonic() - started)
+                response = await asyncio.wait_for(self.resolve_provider(resolver, file, probe_budget, runtime=runtime), max(remaining, 0.001))
+        except asyncio.CancelledError:
+            # Cut off from outside (deadline or consumer), says nothing about the server
+            self.health[name].release()
+            raise
+        except DeadlineExceeded as e:
+            # The caller's budget ran out (a subclass of TimeoutError, so it is caught first), not the server's
+            self.logger.error(f"Server '{name}' cut off: {e}")
+            self.health[name].release()
+            return None
+        except asyncio.TimeoutError:
+            self.logger.error(f"Server '{name}' timed out after {self.server_timeout}s")
+        except Exception as e:
+            self.logger.error(f"Server '{name}' failed: {e}")
+        deadline = Deadline.current()
+        if not response and deadline is not None and deadline.expired:
+            # Providers that swallow errors turn a spent budget into a plain None, that is not the server's fault either
+            self.health[name].release()
             return None
+        self.health.record(name, bool(response), time.monotonic() - started)
+        return response
 
-        responses = await asyncio.gather(*sub_tasks)
-        return SourceResponse(source=self.__class__.__name__, providers=responses)
\ No newline at end of file
+    async def resolve_in_order(
+        self,
+        servers: List[Tuple[str, str, object]],
+        probe_budget: Optional[float],
+        attempted: Set[str],
+        runtime: Optional[float] = None,
+    ) -> Optional[ProviderResponse]:
+        '''Tries `servers` one at a time, moving on only when one fails, times out or only has streams of the wrong length.'''
+        for name, provider_id, resolver in servers:
+            attempted.add(name)
+            response = await self.resolve_server(name, provider_id, resolver, probe_budget, runtime)
+            if response:
+                return response
+        return None
+
+    async def scrape_all(
+        self, 
+        media_type: str, 
+        season: str = "0", 
+        episode: str = "0",
+        source_id: Optional[str] = None, 
+        tmdb: Optional[str] = None,
+        min_quality: Optional[Union[str, QualityEnum]] = None,
+        timeout: Optional[float] = None,
+        deadline: Optional[Deadline] = None,
+        probe_budget: Optional[float] = None,
+        episode_id: Optional[str] = None,
+    ) -> Optional[SourceResponse]:
+        '''
+            Resolves every provider, or with `min_quality` returns as soon as one provider has a stream
+            at or above that quality and cancels the rest.
+            `timeout` is an end-to-end budget in seconds shared by every step.
+            `probe_budget` drops dead streams and orders the rest by measured throughput.
+
+            Identical calls (same gmid and options) that arrive while one is running join it instead of scraping
+            again, and its result is reused for `settings.scrape_reuse_window` seconds after. Calls bound
+            to an existing `deadline` always scrape on their own.
+        '''
+        kwargs = dict(
+            media_type=media_type,
+            season=season,
+            episode=episode,
+            source_id=source_id,
+            tmdb=tmdb,
+            min_quality=min_quality,
+            timeout=timeout,
+            probe_budget=probe_budget,
+            episode_id=episode_id,
+        )
+        if deadline is not None:
+            return await self.scrape_uncoalesced(deadline=deadline, **kwargs)
+        return await self.scrape_coalesced(**kwargs)
+
+    def scrape_key(self, media_type: str, season: str = "0", episode: str = "0", source_id: Optional[str] = None, tmdb: Optional[str] = None, min_quality=None, **options) -> Tuple:
+        media = MediaType(tmdb=tmdb, source_id=source_id, media_type=media_type, season=season, episode=episode)
+        title = media.gmid if tmdb else (media.media_type.value, source_id, media.season, media.episode)
+        quality = QualityEnum.coerce(min_quality).value if min_quality else None
+        return (self.__class__.__name__, title, quality, tuple(sorted(options.items())))
+
+    # A failed scrape (None) is shared with the calls joined on it but not reused after
+    @async_cache(
+        maxsize=1024,
+        ttl=lambda: settings.scrape_reuse_window,
+        key=lambda self, **kwargs: self.scrape_key(**kwargs),
+        skip=lambda value: value is None,
+    )
+    async def scrape_coalesced(self, **kwargs) -> Optional[SourceResponse]:
+        return await self.scrape_uncoalesced(**kwargs)
+
+    async def scrape_uncoalesced(
+        self,
+        media_type: str,
+        season: str = "0",
+        episode: str = "0",
+        source_id: Optional[str] = None,
+        tmdb: Optional[str] = None,
+        min_quality: Optional[Union[str, QualityEnum]] = None,
+        timeout: Optional[float] = None,
+        deadline: Optional[Deadline] = None,
+        probe_budget: Optional[float] = None,
+        episode_id: Optional[str] = None,
+    ) -> Optional[SourceResponse]:
+        iterator = self.scrape_iter(
+            media_type=media_type,
+            season=season,
+            episode=episode,
+            source_id=source_id,
+            tmdb=tmdb,
+            timeout=timeout,
+            deadline=deadline,
+            probe_budget=probe_budget,
+            episode_id=episode_id
+        )
+        if min_quality:
+            return await self.scrape_first(iterator, QualityEnum.coerce(min_quality))
+
+        responses = [response async for response in iterator]
+        if not responses:
+            self.logger.error("No provider could be resolved!")
+            return None
+        return SourceResponse(source=self.__class__.__name__, providers=responses)
+
+    async def get_episode_ids(
+        self,
+        tmdb: Optional[str] = None,
+        source_id: Optional[str] = None,
+        seasons: Optional[Iterable[str]] = None,
+        episodes: Optional[Iterable[str]] = None,
+    ) -> Optional[Tuple[str, Dict[Tuple[str, str], str]]]:
+        '''
+            Resolves a show once and returns its flixhq id and {(season, episode): episode id} for the requested
+            `seasons` and `episodes` (every one when None), season episode lists are fetched concurrently.
+        '''
+        media = MediaType(tmdb=tmdb, source_id=source_id, media_type="Series")
+        flixhq_id = source_id or self.id_index.get(media.base_gmid)
+        season_ids = await self.get_seasons(flixhq_id) if flixhq_id else None
+        if not season_ids and not source_id:
+            # Not indexed, or the indexed id is stale
+            try:
+                flixhq_id = await self.search_source_id(media)
+            except SearchError as e:
+                self.logger.error(e)
+                flixhq_id = None
+            if flixhq_id:
+                self.id_index.set(media.base_gmid, flixhq_id)
+                season_ids = await self.get_seasons(flixhq_id)
+        if not season_ids:
+            self.logger.error(f"Could not find the seasons of {media.base_gmid if tmdb else source_id}")
+            return None
+
+        wanted_seasons = [str(season) for season in seasons] if seasons is not None else list(season_ids)
+        missing = [season for season in wanted_seasons if season not in season_ids]
+        if missing:
+            self.logger.error(f"Seasons {missing} do not exist in available seasons '{list(season_ids)}'")
+        wanted_seasons = [season for season in wanted_seasons if season in season_ids]
+        wanted_episodes = {str(episode) for episode in episodes} if episodes is not None else None
+
+        episode_maps = await asyncio.gather(*(self.get_episodes(season_ids[season]) for season in wanted_seasons))
+        episode_ids = {}
+        for season, episode_map in zip(wanted_seasons, episode_maps):
+            for episode, episode_id in (episode_map or {}).items():
+                if wanted_episodes is None or episode in wanted_episodes:
+                    episode_ids[(season, episode)] = episode_id
+        return flixhq_id, episode_ids
+
+    async def scrape_episodes(
+        self,
+        tmdb: Optional[str] = None,
+        source_id: Optional[str] = None,
+        seasons: Optional[Iterable[str]] = None,
+        episodes: Optional[Iterable[str]] = None,
+        concurrency: int = 4,
+        min_quality: Optional[Union[str, QualityEnum]] = None,
+        timeout: Optional[float] = None,
+        probe_budget: Optional[float] = None,
+    ) -> AsyncIterator[Tuple[str, str, Optional[SourceResponse]]]:
+        '''
+            Scrapes many episodes of one show, yielding (season, episode, response or None) as each one finishes.
+            The show, its seasons and their episode lists are resolved once up front, then at most `concurrency`
+            episodes are scraped at a time through the same providers. `timeout` is per episode.
+        '''
+        assert source_id or tmdb, "source_id or tmdb must be passed with call!"
+        resolved = await self.get_episode_ids(tmdb=tmdb, source_id=source_id, seasons=seasons, episodes=episodes)
+        if not resolved:
+            return
+        flixhq_id, episode_ids = resolved
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def scrape(season: str, episode: str, episode_id: str) -> Tuple[str, str, Optional[SourceResponse]]:
+            async with semaphore:
+                try:
+                    response = await self.scrape_all(
+                        media_type="Series",
+                        season=season,
+                        episode=episode,
+                        source_id=flixhq_id,
+                        tmdb=tmdb,
+                        min_quality=min_quality,
+                        timeout=timeout,
+                        probe_budget=probe_budget,
+                        episode_id=episode_id,
+                    )
+                except Exception as e:
+                    self.logger.error(f"Failed to scrape S{season}E{episode}: {e}")
+                    response = None
+            return season, episode, response
+
+        tasks = [asyncio.ensure_future(scrape(season, episode, episode_id)) for (season, episode), episode_id in episode_ids.items()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def scrape_first(self, iterator: AsyncIterator[ProviderResponse], min_quality: QualityEnum) -> Optional[SourceResponse]:
+        try:
+            async for response in iterator:
+                streams = [stream for stream in response.streams if stream.quality.rank >= min_quality.rank]
+                if not streams:
+                    self.logger.info(f"'{response.provider}' has nothing at {min_quality.value} or above")
+                    continue
+                # Stable, so probed streams keep their throughput order within a quality
+                streams.sort(key=lambda stream: stream.quality.rank, reverse=True)
+                response = ProviderResponse(provider=response.provider, streams=streams, subtitles=response.subtitles)
+                return SourceResponse(source=self.__class__.__name__, providers=[response])
+        finally:
+            # Cancels every get_file/resolve still in flight
+            await iterator.aclose()
+        self.logger.error(f"No provider had a stream at {min_quality.value} or above!")
+        return None
@@ -0,0 +1,356 @@
+import time
+import httpx
+import asyncio
+from collections import deque
+from urllib.parse import urlsplit
+from typing import Optional, Union, Dict, Deque, Set, Callable, Awaitable
+
+from mcat_providers.config import log
+from mcat_providers.utils.deadline import Deadline
+from mcat_providers.utils.exceptions import DeadlineExceeded
+from mcat_providers.utils.limiter import AIMDLimiter, parse_retry_after
+
+# Per call site timeouts, looked up as "<Owner>.<site>" first and then "<site>".
+# Anything not listed falls back to `TransportConfig.default_timeout`.
+DEFAULT_TIMEOUT = httpx.Timeout(15.0, connect=5.0, pool=5.0)
+DEFAULT_TIMEOUTS: Dict[str, httpx.Timeout] = {
+    "resolve_tmdb": httpx.Timeout(10.0, connect=3.0, pool=5.0),
+    "query_flix": httpx.Timeout(10.0, connect=3.0, pool=5.0),
+    "get_seasons": httpx.Timeout(8.0, connect=3.0, pool=5.0),
+    "get_episodes": httpx.Timeout(8.0, connect=3.0, pool=5.0),
+    "FlixHq.get_sources": httpx.Timeout(8.0, connect=3.0, pool=5.0),
+    "get_file": httpx.Timeout(8.0, connect=3.0, pool=5.0),
+    "verify_source": httpx.Timeout(10.0, connect=3.0, pool=5.0),
+    "get_meta": httpx.Timeout(8.0, connect=3.0, pool=5.0),
+    "Rabbitstream.get_sources": httpx.Timeout(10.0, connect=3.0, pool=5.0),
+    # The wasm and payload.js are the only large bodies we pull, give them room to stream
+    "get_wasm": httpx.Timeout(30.0, connect=5.0, pool=5.0),
+    "get_payload": httpx.Timeout(30.0, connect=5.0, pool=5.0),
+    "get_qualities": httpx.Timeout(8.0, connect=3.0, pool=5.0),
+    "get_media_playlist": httpx.Timeout(8.0, connect=3.0, pool=5.0),
+    # A CDN that is this slow to answer is as good as dead to a player
+    "probe_playlist": httpx.Timeout(5.0, connect=3.0, pool=5.0),
+    "probe_segment": httpx.Timeout(5.0, connect=3.0, pool=5.0),
+    "warm_up": httpx.Timeout(10.0, connect=5.0, pool=5.0),
+}
+# Idempotent GETs that are safe to fire twice, "Rabbitstream.get_sources" is left out as its keys are single use
+DEFAULT_HEDGE_SITES: Set[str] = {
+    "resolve_tmdb",
+    "query_flix",
+    "get_seasons",
+    "get_episodes",
+    "FlixHq.get_sources",
+    "get_file",
+    "verify_source",
+    "get_meta",
+    "get_qualities",
+}
+DEFAULT_HOST_LIMITS: Dict[str, int] = {
+    "flixhq.to": 20,
+    "rabbitstream.net": 20,
+    "api.themoviedb.org": 10,
+}
+# Requests per second each host starts at (and never goes above), the rest get `TransportConfig.default_rate`
+DEFAULT_HOST_RATES: Dict[str, float] = {
+    "flixhq.to": 10.0,
+    "rabbitstream.net": 10.0,
+    # TMDB allows ~50/s per IP
+    "api.themoviedb.org": 40.0,
+}
+
+class TransportConfig:
+    '''
+        Everything needed to build the shared `httpx.AsyncClient`.
+        `host_limits` maps a host to its own connection pool size, every other host shares the default pool.
+        With `rate_limit` every host also gets an `AIMDLimiter` starting at its `host_rates` entry (or `default_rate`)
+        and its pool size (or `default_host_concurrency`) in flight, GETs answered with 429/503 are retried
+        up to `throttle_retries` times (unless the call passes `retry=False`).
+        Pass `transport` to swap the network out entirely (e.g. `httpx.MockTransport` or a proxy transport).
+    '''
+    def __init__(
+        self,
+        http2: bool = False,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        host_limits: Optional[Dict[str, int]] = None,
+        timeouts: Optional[Dict[str, httpx.Timeout]] = None,
+        default_timeout: httpx.Timeout = DEFAULT_TIMEOUT,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        follow_redirects: bool = False,
+        hedge: bool = False,
+        hedge_sites: Optional[Set[str]] = None,
+        hedge_quantile: float = 0.95,
+        hedge_min_samples: int = 20,
+        hedge_min_delay: float = 0.05,
+        rate_limit: bool = True,
+        host_rates: Optional[Dict[str, float]] = None,
+        default_rate: float = 50.0,
+        default_host_concurrency: int = 32,
+        throttle_retries: int = 2,
+    ) -> None:
+        self.http2 = http2
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.host_limits = DEFAULT_HOST_LIMITS.copy() if host_limits is None else host_limits
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.default_timeout = default_timeout
+        self.transport = transport
+        self.follow_redirects = follow_redirects
+        # Hedging fires a duplicate of an idempotent GET once it is slower than `hedge_quantile`
+        # of its recent latencies, the first reply wins and the other is cancelled
+        self.hedge = hedge
+        self.hedge_sites = DEFAULT_HEDGE_SITES.copy() if hedge_sites is None else hedge_sites
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.rate_limit = rate_limit
+        self.host_rates = DEFAULT_HOST_RATES.copy() if host_rates is None else host_rates
+        self.default_rate = default_rate
+        self.default_host_concurrency = default_host_concurrency
+        self.throttle_retries = throttle_retries
+
+    def timeout_for(self, site: str, owner: Optional[str] = None) -> httpx.Timeout:
+        if owner:
+            timeout = self.timeouts.get(f"{owner}.{site}")
+            if timeout:
+                return timeout
+        return self.timeouts.get(site, self.default_timeout)
+
+    def should_hedge(self, method: str, site: str, owner: Optional[str] = None) -> bool:
+        if not self.hedge or method != "GET":
+            return False
+        return site in self.hedge_sites or f"{owner}.{site}" in self.hedge_sites
+
+    def build_limiter(self, host: str) -> AIMDLimiter:
+        return AIMDLimiter(
+            rate=self.host_rates.get(host, self.default_rate),
+            max_concurrency=self.host_limits.get(host, self.default_host_concurrency),
+        )
+
+    def limits(self, max_connections: Optional[int] = None) -> httpx.Limits:
+        max_connections = max_connections or self.max_connections
+        return httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=min(max_connections, self.max_keepalive_connections),
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def build_client(self) -> httpx.AsyncClient:
+        if self.transport:
+            return httpx.AsyncClient(
+                transport=self.transport,
+                timeout=self.default_timeout,
+                follow_redirects=self.follow_redirects,
+            )
+        mounts = {
+            f"all://{host}": httpx.AsyncHTTPTransport(limits=self.limits(limit), http2=self.http2)
+            for host, limit in self.host_limits.items()
+        }
+        return httpx.AsyncClient(
+            http2=self.http2,
+            limits=self.limits(),
+            mounts=mounts,
+            timeout=self.default_timeout,
+            follow_redirects=self.follow_redirects,
+        )
+
+class LatencyTracker:
+    '''Rolling window of successful request latencies per call site.'''
+    def __init__(self, window: int = 200) -> None:
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, key: str, seconds: float) -> None:
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def quantile(self, key: str, quantile: float, min_samples: int = 1) -> Optional[float]:
+        samples = self._samples.get(key)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+def cap_timeout(timeout: httpx.Timeout, remaining: float) -> httpx.Timeout:
+    def cap(value: Optional[float]) -> float:
+        return remaining if value is None else min(value, remaining)
+    return httpx.Timeout(connect=cap(timeout.connect), read=cap(timeout.read), write=cap(timeout.write), pool=cap(timeout.pool))
+
+class HttpTransport:
+    '''
+        Owns one `httpx.AsyncClient` built from a `TransportConfig` and applies the per call site timeouts.
+        Sources and providers share `settings.transport` unless they are given their own.
+    '''
+    def __init__(self, config: Optional[TransportConfig] = None, client: Optional[httpx.AsyncClient] = None) -> None:
+        self.config = config or TransportConfig()
+        self.latency = LatencyTracker()
+        self.stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "deadline_exceeded": 0, "throttle_retries": 0}
+        self.limiters: Dict[str, AIMDLimiter] = {}
+        self._client = client
+
+    @classmethod
+    def coerce(cls, transport: Union["HttpTransport", TransportConfig, httpx.AsyncBaseTransport]) -> "HttpTransport":
+        if isinstance(transport, HttpTransport):
+            return transport
+        if isinstance(transport, TransportConfig):
+            return cls(transport)
+        if isinstance(transport, httpx.AsyncBaseTransport):
+            return cls(TransportConfig(transport=transport))
+        raise TypeError(f"Cannot build a transport from '{transport.__class__.__name__}'")
+
+    def limiter_for(self, url: str) -> Optional[AIMDLimiter]:
+        if not self.config.rate_limit:
+            return None
+        host = urlsplit(str(url)).hostname or ""
+        limiter = self.limiters.get(host)
+        if limiter is None:
+            limiter = self.limiters[host] = self.config.build_limiter(host)
+        return limiter
+
+    def limiter_stats(self) -> Dict[str, Dict]:
+        return {host: limiter.snapshot() for host, limiter in self.limiters.items()}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = self.config.build_client()
+        return self._client
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        site: str = "default",
+        owner: Optional[str] = None,
+        **kwargs
+    ) -> httpx.Response:
+        step = f"{owner}.{site}" if owner else site
+        timeout = kwargs.pop("timeout", None) or self.config.timeout_for(site, owner)
+        # stream=True returns once the headers are in, the caller reads the body and must `aclose()` it
+        stream = kwargs.pop("stream", False)
+        # retry=False for calls that must not be sent twice (single use keys), a 429/503 is then returned as is
+        retryable = kwargs.pop("retry", True)
+        deadline = Deadline.current()
+        remaining = None
+        if deadline:
+            try:
+                remaining = deadline.check(step)
+            except DeadlineExceeded:
+                self.stats["deadline_exceeded"] += 1
+                raise
+            timeout = cap_timeout(timeout, remaining)
+
+        limiter = self.limiter_for(url)
+
+        async def send() -> httpx.Response:
+            if limiter:
+                await limiter.acquire()
+            start = time.monotonic()
+            response: Optional[httpx.Response] = None
+            failed = False
+            try:
+                if stream:
+                    request = self.client.build_request(method, url, timeout=timeout, **kwargs)
+                    response = await self.client.send(request, stream=True)
+                else:
+                    response = await self.client.request(method, url, timeout=timeout, **kwargs)
+            except httpx.TransportError:
+                failed = True
+                raise
+            finally:
+                elapsed = time.monotonic() - start
+                # A streamed body is read after this, so its slot is given back once the headers are in
+                if limiter and response is not None:
+                    limiter.release(response.status_code, elapsed, parse_retry_after(response.headers.get("Retry-After")))
+                elif limiter:
+                    limiter.release(failed=failed)
+            self.latency.record(step, elapsed)
+            return response
+
+        async def attempt() -> httpx.Response:
+            if not stream and self.config.should_hedge(method, site, owner):
+                return await self._hedged(send, step)
+            return await send()
+
+        async def with_retries() -> httpx.Response:
+            retries = self.config.throttle_retries if retryable and limiter and method == "GET" else 0
+            for retry in range(retries + 1):
+                response = await attempt()
+                if response.status_code not in (429, 503) or retry == retries:
+                    return response
+                self.stats["throttle_retries"] += 1
+                log.info(f"'{step}' got {response.status_code}, retrying: {url}")
+                await response.aclose()
+                # The limiter holds every request to the host back for Retry-After, this covers responses without one
+                if not response.headers.get("Retry-After"):
+                    await asyncio.sleep(0.5 * 2 ** retry)
+            return response
+
+        self.stats["requests"] += 1
+        try:
+            coro = with_retries()
+            if remaining is None:
+                return await coro
+            # Read timeouts are per chunk, this caps the request as a whole
+            return await asyncio.wait_for(coro, remaining)
+        except asyncio.TimeoutError:
+            self.stats["deadline_exceeded"] += 1
+            raise DeadlineExceeded(f"'{step}' ran out of its time budget: {url}")
+        except httpx.TimeoutException:
+            log.error(f"Timed out on '{step}': {url}")
+            raise
+
+    async def _hedged(self, send: Callable[[], Awaitable[httpx.Response]], step: str) -> httpx.Response:
+        delay = self.latency.quantile(step, self.config.hedge_quantile, self.config.hedge_min_samples)
+        if delay is None:
+            return await send()
+        primary = asyncio.ensure_future(send())
+        hedge: Optional[asyncio.Future] = None
+        winner: Optional[asyncio.Future] = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=max(delay, self.config.hedge_min_delay))
+            if done:
+                winner = primary
+                return primary.result()
+
+            self.stats["hedged"] += 1
+            hedge = asyncio.ensure_future(send())
+            pending = {primary, hedge}
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.stats["hedge_wins"] += 1
+                        winner = task
+                        return task.result()
+                    error = task.exception()
+            assert error is not None
+            raise error
+        finally:
+            for task in (primary, hedge):
+                if task is None or task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None:
+                    # Both replies landed in the same wakeup, the one not returned still holds a connection
+                    await task.result().aclose()
+
+    async def get(self, url: str, site: str = "default", owner: Optional[str] = None, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, site=site, owner=owner, **kwargs)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+class ClientAttribute:
+    '''Resolves to the `httpx.AsyncClient` of whichever transport the class or instance is using.'''
+    def __get__(self, instance, owner) -> httpx.AsyncClient:
+        return (instance if instance is not None else owner).transport.client
@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import tempfile
+from urllib.parse import urlsplit, parse_qs
+from typing import Any, Optional, Dict, Callable
+
+from mcat_providers.config import settings, log
+from mcat_providers.utils.exceptions import IntegrityError
+
+def url_version(url: str, default: str = "latest") -> str:
+    '''The `?v=` of an asset url, which is how the hosts we scrape version their files.'''
+    return parse_qs(urlsplit(url).query).get("v", [default])[0]
+
+def _write_atomic(path: str, data: bytes) -> None:
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class Artifact:
+    '''One immutable, validated version of a downloaded file.'''
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        version: str,
+        sha256: str,
+        path: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        checked_at: float = 0.0,
+    ) -> None:
+        self.name = name
+        self.url = url
+        self.version = version
+        self.sha256 = sha256
+        self.path = path
+        self.etag = etag
+        self.last_modified = last_modified
+        self.checked_at = checked_at
+        self._content: Optional[bytes] = None
+
+    @property
+    def content(self) -> bytes:
+        if self._content is None:
+            with open(self.path, "rb") as f:
+                self._content = f.read()
+        return self._content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8")
+
+    @property
+    def as_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "url": self.url,
+            "version": self.version,
+            "sha256": self.sha256,
+            "path": self.path,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "checked_at": self.checked_at,
+        }
+
+    def __repr__(self) -> str:
+        return f"Artifact(name='{self.name}', version='{self.version}', sha256='{self.sha256[:12]}')"
+
+class ArtifactStore:
+    '''
+        Versioned files on disk: `<root>/<name>/<version>-<sha256>.bin` plus a `current.json` pointer.
+        Every write goes through a temp file and `os.replace`, so readers in other processes only ever
+        see a complete file and pointer. Once the pointer moves, the versions it no longer names are removed.
+    '''
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def _dir(self, name: str) -> str:
+        directory = os.path.join(self.root, name)
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def load(self, name: str) -> Optional[Artifact]:
+        pointer = os.path.join(self.root, name, "current.json")
+        if not os.path.exists(pointer):
+            return None
+        try:
+            with open(pointer, "r", encoding="utf-8") as f:
+                artifact = Artifact(**json.load(f))
+        except (ValueError, TypeError) as e:
+            log.error(f"Bad artifact pointer for '{name}': {e}")
+            return None
+        if not os.path.exists(artifact.path):
+            return None
+        return artifact
+
+    def save(
+        self,
+        name: str,
+        url: str,
+        content: bytes,
+        version: Optional[str] = None,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> Artifact:
+        version = version or url_version(url)
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = os.path.join(self._dir(name), f"{version}-{sha256}.bin")
+        if not os.path.exists(path):
+            _write_atomic(path, content)
+        artifact = Artifact(name, url, version, sha256, path, etag, last_modified, time.time())
+        artifact._content = content
+        self.point(artifact)
+        return artifact
+
+    def point(self, artifact: Artifact) -> None:
+        pointer = os.path.join(self._dir(artifact.name), "current.json")
+        _write_atomic(pointer, json.dumps(artifact.as_dict).encode())
+        self.prune(artifact)
+
+    def prune(self, current: Artifact) -> int:
+        '''Removes every stored version of `current.name` other than `current`, returns how many went.'''
+        directory = self._dir(current.name)
+        keep = os.path.abspath(current.path)
+        removed = 0
+        for filename in os.listdir(directory):
+            path = os.path.join(directory, filename)
+            # Only versions, temp files may be another process's write in progress
+            if not filename.endswith(".bin") or os.path.abspath(path) == keep:
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError as e:
+                log.warning(f"Could not remove old artifact '{path}': {e}")
+        return removed
+
+class ArtifactHandle:
+    '''
+        The "current" version of one remote file.
+        `get()` serves whatever is on disk and revalidates it in the background with
+        ETag/If-Modified-Since once it is older than `max_age`, swapping `current` when it changed.
+        `validate` can reject a download (e.g. a checksum mismatch), the old version is kept if it does.
+    '''
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        site: str,
+        max_age: float = 3600,
+        validate: Optional[Callable[[bytes], None]] = None,
+        seed_path: Optional[str] = None,
+    ) -> None:
+        self.name = name
+        self.url = url
+        self.site = site
+        self.max_age = max_age
+        self.validate = validate
+        self.seed_path = seed_path
+        self.current: Optional[Artifact] = None
+        self._store: Optional[ArtifactStore] = None
+        self._refresh: Optional[asyncio.Future] = None
+
+    @property
+    def store(self) -> ArtifactStore:
+        if self._store is None:
+            self._store = ArtifactStore(settings.artifact_dir)
+        return self._store
+
+    @property
+    def version(self) -> str:
+        return url_version(self.url)
+
+    def load(self) -> Optional[Artifact]:
+        '''Reads the current version (and its content) from disk, or seeds it. Blocking, `get()` runs it in a thread.'''
+        if self.current is None:
+            artifact = self.store.load(self.name)
+            if artifact is None:
+                artifact = self.load_seed()
+            if artifact is not None and artifact.version == self.version:
+                # Read the file here, so `content` never touches the disk from the event loop
+                artifact.content
+                self.current = artifact
+        return self.current
+
+    def load_seed(self) -> Optional[Artifact]:
+        '''Promotes the copy shipped next to the code, only if it passes `validate` like a download would.'''
+        if not self.seed_path or not os.path.exists(self.seed_path):
+            return None
+        with open(self.seed_path, "rb") as f:
+            content = f.read()
+        if self.validate:
+            try:
+                self.validate(content)
+            except IntegrityError as e:
+                log.error(f"Bundled '{self.name}' failed validation, ignoring it: {e}")
+                return None
+        artifact = self.store.save(self.name, self.url, content)
+        artifact.checked_at = 0.0
+        return artifact
+
+    def set_url(self, url: str) -> None:
+        '''Points the handle at a new url (e.g. a bumped `?v=`), the next `get()` fetches it.'''
+        if url == self.url:
+            return
+        log.info(f"'{self.name}' moved from '{self.url}' to '{url}'")
+        self.url = url
+        if self.current is not None and self.current.version != self.version:
+            self.current = None
+
+    async def get(self, transport: Any, headers: Optional[Dict] = None) -> Artifact:
+        artifact = self.current
+        if artifact is None:
+            # Disk I/O stays off the event loop
+            artifact = await asyncio.to_thread(self.load)
+        if artifact is None:
+            # Concurrent first callers share one download
+            if self._refresh is None or self._refresh.done():
+                self._refresh = asyncio.ensure_future(self.revalidate(transport, headers))
+            return await asyncio.shield(self._refresh) or await self.revalidate(transport, headers)
+        if time.time() - artifact.checked_at > self.max_age and (self._refresh is None or self._refresh.done()):
+            self._refresh = asyncio.ensure_future(self._revalidate_quietly(transport, headers))
+        return artifact
+
+    async def _revalidate_quietly(self, transport: Any, headers: Optional[Dict]) -> Optional[Artifact]:
+        try:
+            return await self.revalidate(transport, headers)
+        except Exception as e:
+            log.warning(f"Background revalidation of '{self.name}' failed: {e}")
+            return None
+
+    async def revalidate(self, transport: Any, headers: Optional[Dict] = None) -> Artifact:
+        current = self.current
+        headers = dict(headers or {})
+        if current is not None:
+            if current.etag:
+                headers["If-None-Match"] = current.etag
+            if current.last_modified:
+                headers["If-Modified-Since"] = current.last_modified
+
+        url = self.url
+        response = await transport.get(url, site=self.site, headers=headers)
+        if response.status_code == 304 and current is not None:
+            current.checked_at = time.time()
+            await asyncio.to_thread(self.store.point, current)
+            return current
+        if not response.is_success:
+            if current is not None:
+                log.warning(f"Could not revalidate '{self.name}' ({response.status_code}), keeping {current}")
+                return current
+            raise IntegrityError(f"Failed to retrieve '{self.name}' from '{url}' ({response.status_code})")
+
+        content = response.content
+        if self.validate:
+            try:
+                self.validate(content)
+            except IntegrityError:
+                if current is not None:
+                    log.error(f"Downloaded '{self.name}' failed validation, keeping {current}")
+                    return current
+                raise
+
+        artifact = await asyncio.to_thread(
+            self.store.save,
+            self.name,
+            url,
+            content,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+        if current is None or current.sha256 != artifact.sha256:
+            log.info(f"'{self.name}' is now {artifact}")
+        # Single reference swap, readers holding the old artifact keep a consistent copy
+        self.current = artifact
+        return artifact
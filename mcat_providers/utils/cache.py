@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Tuple, Dict
+
+MISSING = object()
+
+class CacheBackend:
+    '''
+        Persistent key/value store shared by every cached lookup.
+        Values must be JSON serialisable, `kind` namespaces keys (e.g. "tmdb", "search").
+    '''
+    def get(self, kind: str, key: str) -> Any:
+        '''Returns the cached value or `MISSING`.'''
+        raise NotImplementedError
+
+    def set(self, kind: str, key: str, value: Any, ttl: float) -> None:
+        raise NotImplementedError
+
+    def delete(self, kind: str, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self, kind: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+class MemoryCache(CacheBackend):
+    '''Process local backend with the same TTL/LRU semantics, handy when the disk should not be touched.'''
+    def __init__(self, max_entries: int = 10_000) -> None:
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Tuple[str, str], Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kind: str, key: str) -> Any:
+        with self._lock:
+            item = self._data.get((kind, key))
+            if item is None:
+                return MISSING
+            expires, value = item
+            if expires < time.time():
+                del self._data[(kind, key)]
+                return MISSING
+            self._data.move_to_end((kind, key))
+            return json.loads(value)
+
+    def set(self, kind: str, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._data[(kind, key)] = (time.time() + ttl, json.dumps(value))
+            self._data.move_to_end((kind, key))
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, kind: str, key: str) -> None:
+        with self._lock:
+            self._data.pop((kind, key), None)
+
+    def clear(self, kind: Optional[str] = None) -> None:
+        with self._lock:
+            if kind is None:
+                self._data.clear()
+                return
+            for item in [item for item in self._data if item[0] == kind]:
+                del self._data[item]
+
+class SQLiteCache(CacheBackend):
+    '''
+        SQLite backed cache, safe to share between processes on one host (WAL + busy timeout).
+        Entries expire after their TTL and the least recently used ones are evicted once
+        `max_entries` or `max_bytes` is exceeded.
+    '''
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS cache ("
+        "kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+        "size INTEGER NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL, "
+        "PRIMARY KEY (kind, key))"
+    )
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 100_000,
+        max_bytes: int = 256 * 1024 * 1024,
+        busy_timeout: float = 5.0,
+        evict_every: int = 256,
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.busy_timeout = busy_timeout
+        self.evict_every = evict_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # Connections must not cross a fork, every process opens its own
+        if self._conn is None or self._pid != os.getpid():
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(self._SCHEMA)
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, kind: str, key: str) -> Any:
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value, expires FROM cache WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+            if row is None:
+                return MISSING
+            value, expires = row
+            if expires < now:
+                self.conn.execute("DELETE FROM cache WHERE kind = ? AND key = ?", (kind, key))
+                return MISSING
+            self.conn.execute("UPDATE cache SET accessed = ? WHERE kind = ? AND key = ?", (now, kind, key))
+        return json.loads(value)
+
+    def set(self, kind: str, key: str, value: Any, ttl: float) -> None:
+        now = time.time()
+        data = json.dumps(value, separators=(",", ":"))
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache (kind, key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, key, data, len(data), now + ttl, now)
+            )
+            self._writes += 1
+            if self._writes % self.evict_every == 0:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        conn = self.conn
+        conn.execute("DELETE FROM cache WHERE expires < ?", (now,))
+        count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY accessed ASC LIMIT ?)", (excess,)
+            )
+        if size > self.max_bytes:
+            # Drop the oldest rows until we are back under budget
+            freed = 0
+            stale = []
+            for rowid, row_size in conn.execute("SELECT rowid, size FROM cache ORDER BY accessed ASC"):
+                stale.append((rowid,))
+                freed += row_size
+                if size - freed <= self.max_bytes:
+                    break
+            conn.executemany("DELETE FROM cache WHERE rowid = ?", stale)
+
+    def evict(self) -> None:
+        with self._lock:
+            self._evict(time.time())
+
+    def delete(self, kind: str, key: str) -> None:
+        with self._lock:
+            self.conn.execute("DELETE FROM cache WHERE kind = ? AND key = ?", (kind, key))
+
+    def clear(self, kind: Optional[str] = None) -> None:
+        with self._lock:
+            if kind is None:
+                self.conn.execute("DELETE FROM cache")
+            else:
+                self.conn.execute("DELETE FROM cache WHERE kind = ?", (kind,))
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            rows = self.conn.execute("SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM cache GROUP BY kind").fetchall()
+        return {kind: {"entries": count, "bytes": size} for kind, count, size in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
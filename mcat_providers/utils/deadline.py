@@ -0,0 +1,68 @@
+import time
+import asyncio
+from contextvars import ContextVar
+from typing import Optional, Awaitable, TypeVar
+
+from mcat_providers.utils.exceptions import DeadlineExceeded
+
+T = TypeVar("T")
+
+_current_deadline: ContextVar[Optional["Deadline"]] = ContextVar("mcat_deadline", default=None)
+
+class Deadline:
+    '''
+        End-to-end time budget for one call.
+        The budget follows the work through a context variable, so every request made inside
+        `deadline.run(...)` (and any task it spawns) only gets the time that is left.
+        A nested deadline can never outlive the one it was created under.
+    '''
+    def __init__(self, timeout: float) -> None:
+        self.timeout = timeout
+        self.expires = time.monotonic() + timeout
+        parent = Deadline.current()
+        if parent and parent.expires < self.expires:
+            self.expires = parent.expires
+
+    @staticmethod
+    def current() -> Optional["Deadline"]:
+        return _current_deadline.get()
+
+    @classmethod
+    def coerce(cls, timeout: Optional[float] = None, deadline: Optional["Deadline"] = None) -> Optional["Deadline"]:
+        if deadline is not None:
+            return deadline
+        if timeout:
+            return cls(timeout)
+        return cls.current()
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, step: str = "call") -> float:
+        '''Returns the remaining budget, raising `DeadlineExceeded` if there is none left.'''
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"No time left for '{step}' ({self.timeout}s budget)")
+        return remaining
+
+    async def run(self, awaitable: Awaitable[T], step: str = "call") -> T:
+        '''Runs `awaitable` in its own task under this deadline, cancelling it once the budget is spent.'''
+        async def runner():
+            # Set inside the task so the deadline never leaks into the caller's context
+            _current_deadline.set(self)
+            return await awaitable
+        remaining = self.check(step)
+        task = asyncio.ensure_future(runner())
+        try:
+            return await asyncio.wait_for(task, remaining)
+        except DeadlineExceeded:
+            raise
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"'{step}' ran past its {self.timeout}s budget")
+
+    def __repr__(self) -> str:
+        return f"Deadline(timeout={self.timeout}, remaining={self.remaining():.3f})"
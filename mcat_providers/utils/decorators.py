@@ -1,18 +1,251 @@
+import sys
+import time
 import asyncio
 import functools
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Optional, Union, Dict, Tuple, Hashable
 
-def async_lru_cache_parameterless(async_function):
-    @functools.lru_cache
-    def cached_async_function(*args, **kwargs):
-        coroutine = async_function(*args, **kwargs)
-        return asyncio.ensure_future(coroutine)
-    return cached_async_function
-
-def async_lru_cache(*lru_cache_args, **lru_cache_kwargs):
-    def async_lru_cache_decorator(async_function):
-        @functools.lru_cache(*lru_cache_args, **lru_cache_kwargs)
-        def cached_async_function(*args, **kwargs):
-            coroutine = async_function(*args, **kwargs)
-            return asyncio.ensure_future(coroutine)
+from mcat_providers.config import settings, log
+
+def approx_size(value: Any, _depth: int = 0) -> int:
+    '''Rough deep size of a cached value, good enough to bound memory use.'''
+    size = sys.getsizeof(value)
+    if _depth > 4:
+        return size
+    if isinstance(value, dict):
+        return size + sum(approx_size(k, _depth + 1) + approx_size(v, _depth + 1) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return size + sum(approx_size(item, _depth + 1) for item in value)
+    if hasattr(value, "__dict__"):
+        return size + approx_size(vars(value), _depth + 1)
+    return size
+
+class _Entry:
+    __slots__ = ("value", "error", "expires", "size")
+
+    def __init__(self, value: Any, error: Optional[BaseException], expires: float, size: int) -> None:
+        self.value = value
+        self.error = error
+        self.expires = expires
+        self.size = size
+
+class AsyncCache:
+    '''
+        Results (not futures) of an async function, so entries are usable from any event loop.
+        Concurrent calls for the same key on the same loop share one in-flight future.
+    '''
+    def __init__(
+        self,
+        name: str,
+        maxsize: Optional[int] = 128,
+        ttl: Optional[Union[float, Callable[[], Optional[float]]]] = None,
+        failure_ttl: float = 0,
+        max_bytes: Optional[int] = None,
+    ) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._inflight: Dict[Tuple[int, Hashable], asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "joins": 0, "failures": 0, "skipped": 0, "evictions": 0, "expired": 0}
+
+    def lookup(self, key: Hashable) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires < time.monotonic():
+                self._remove(key)
+                self._stats["expired"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def store(self, key: Hashable, value: Any = None, error: Optional[BaseException] = None) -> None:
+        ttl = self.failure_ttl if error is not None else self.ttl() if callable(self.ttl) else self.ttl
+        if error is not None and not ttl:
+            return
+        expires = time.monotonic() + ttl if ttl else float("inf")
+        size = approx_size(error if error is not None else value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(value, error, expires, size)
+            self._bytes += size
+            while self._entries and (
+                (self.maxsize is not None and len(self._entries) > self.maxsize) or
+                (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "bytes": self._bytes, "inflight": len(self._inflight)}
+
+_caches: Dict[str, AsyncCache] = {}
+_refreshing: ContextVar[bool] = ContextVar("mcat_cache_refresh", default=False)
+
+@contextmanager
+def refresh_caches():
+    '''
+        Inside the block (and tasks started from it) cached functions skip their cached results and call through,
+        what they return is still stored. For re-verifying data rather than re-reading it.
+    '''
+    token = _refreshing.set(True)
+    try:
+        yield
+    finally:
+        _refreshing.reset(token)
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+def _default_key(is_method: bool) -> Callable[..., Hashable]:
+    def make_key(*args, **kwargs) -> Hashable:
+        # Methods are keyed on their class rather than the instance so instances are never pinned in memory
+        if is_method and args:
+            owner = args[0] if isinstance(args[0], type) else type(args[0])
+            args = (owner, *args[1:])
+        return (args, tuple(sorted(kwargs.items()))) if kwargs else args
+    return make_key
+
+def async_cache(
+    maxsize: Optional[int] = 128,
+    ttl: Optional[Union[float, Callable[[], Optional[float]]]] = None,
+    failure_ttl: float = 0,
+    max_bytes: Optional[int] = None,
+    key: Optional[Callable[..., Hashable]] = None,
+    skip: Optional[Callable[[Any], bool]] = None,
+):
+    '''
+        Memoizes a coroutine function.
+        - `ttl` seconds per entry (None = until evicted), or a function returning it that is read on every store
+        - failures are not cached unless `failure_ttl` is set, cancellations never are
+        - results where `skip` is true (e.g. None from a failed request) are handed to the callers waiting on them but not stored
+        - bounded by `maxsize` entries and `max_bytes` (approximate)
+        - `key` builds the cache key from the call arguments, the default ignores the instance for methods
+        - inside `refresh_caches()` the cached entry is skipped and replaced
+        Stats are available on `function.cache.stats()` or for every cache through `cache_stats()`.
+    '''
+    def async_cache_decorator(async_function):
+        name = f"{async_function.__module__}.{async_function.__qualname__}"
+        is_method = "." in async_function.__qualname__.replace("<locals>.", "")
+        cache = _caches[name] = AsyncCache(name, maxsize=maxsize, ttl=ttl, failure_ttl=failure_ttl, max_bytes=max_bytes)
+        make_key = key or _default_key(is_method)
+
+        @functools.wraps(async_function)
+        async def cached_async_function(*args, **kwargs):
+            cache_key = make_key(*args, **kwargs)
+            loop = asyncio.get_running_loop()
+            flight_key = (id(loop), cache_key)
+            while not _refreshing.get():
+                entry = cache.lookup(cache_key)
+                if entry is not None:
+                    if entry.error is not None:
+                        raise entry.error
+                    return entry.value
+                future = cache._inflight.get(flight_key)
+                if future is None:
+                    break
+                cache._stats["joins"] += 1
+                try:
+                    return await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    # The caller that owned the flight was cancelled, not us, so start a new one
+                    if future.cancelled():
+                        continue
+                    raise
+
+            cache._stats["misses"] += 1
+            future = loop.create_future()
+            # A refresh running alongside a normal flight leaves that flight registered for its joiners
+            cache._inflight.setdefault(flight_key, future)
+            try:
+                value = await async_function(*args, **kwargs)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                cache._stats["failures"] += 1
+                cache.store(cache_key, error=e)
+                future.set_exception(e)
+                # Joiners get the exception, mark it retrieved so it is not reported as never retrieved
+                future.exception()
+                raise
+            else:
+                if skip is not None and skip(value):
+                    cache._stats["skipped"] += 1
+                else:
+                    cache.store(cache_key, value=value)
+                future.set_result(value)
+                return value
+            finally:
+                if cache._inflight.get(flight_key) is future:
+                    del cache._inflight[flight_key]
+
+        cached_async_function.cache = cache
+        return cached_async_function
+    return async_cache_decorator
+
+def persistent_cache(
+    kind: str,
+    key: Callable[..., str],
+    negative: Callable[[Any], bool] = lambda value: not value,
+    skip: Callable[[Any], bool] = lambda value: value is None,
+):
+    '''
+        Caches the JSON serialisable result of a coroutine in `settings.cache` for `settings.cache_ttl(kind)`.
+        `key` gets the same arguments as the wrapped function, results where `skip` is true (failed requests)
+        are never stored and results where `negative` is true only live for the short negative TTL.
+        Inside `refresh_caches()` the stored result is not read, the fresh one replaces it.
+    '''
+    def persistent_cache_decorator(async_function):
+        @functools.wraps(async_function)
+        async def cached_async_function(*args, **kwargs):
+            backend = settings.cache
+            if backend is None:
+                return await async_function(*args, **kwargs)
+            from mcat_providers.utils.cache import MISSING
+            cache_key = key(*args, **kwargs)
+            value = MISSING
+            if not _refreshing.get():
+                try:
+                    value = await asyncio.to_thread(backend.get, kind, cache_key)
+                except Exception as e:
+                    log.warning(f"Cache read failed for {kind}:{cache_key}: {e}")
+            if value is not MISSING:
+                return value
+            value = await async_function(*args, **kwargs)
+            if skip(value):
+                return value
+            try:
+                ttl = settings.cache_ttl(kind, negative=negative(value))
+                await asyncio.to_thread(backend.set, kind, cache_key, value, ttl)
+            except Exception as e:
+                log.warning(f"Cache write failed for {kind}:{cache_key}: {e}")
+            return value
         return cached_async_function
-    return async_lru_cache_decorator
\ No newline at end of file
+    return persistent_cache_decorator
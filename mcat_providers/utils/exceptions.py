@@ -8,4 +8,10 @@ class DisabledProviderError(DisabledError):
     '''Generic Error for disabled provider'''
 
 class DisabledSourceError(DisabledError):
-    '''Generic Error for disabled source'''
\ No newline at end of file
+    '''Generic Error for disabled source'''
+
+class DeadlineExceeded(TimeoutError):
+    '''Raised when a call runs out of its end-to-end time budget.'''
+
+class SearchError(RuntimeError):
+    '''Raised when a search could not be completed (a page failed to load), so finding nothing means nothing.'''
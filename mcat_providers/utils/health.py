@@ -0,0 +1,165 @@
+import time
+from collections import deque
+from typing import Optional, Dict, List, Deque, Tuple, Any, Iterable
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    '''
+        Rolling health of one server: the last `window` outcomes and their latencies.
+
+        The breaker opens once at least `min_calls` outcomes are in and `failure_rate` of them failed
+        (or after `max_consecutive` failures in a row) and then refuses calls for `reset_timeout` seconds,
+        doubling every time it reopens up to `max_reset_timeout`. After that it lets `half_open_calls` probe
+        through at a time, a success closes it again and a failure reopens it.
+    '''
+    def __init__(
+        self,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        max_consecutive: int = 5,
+        reset_timeout: float = 30.0,
+        max_reset_timeout: float = 600.0,
+        half_open_calls: int = 1,
+    ) -> None:
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.max_consecutive = max_consecutive
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.half_open_calls = half_open_calls
+
+        self.state = CLOSED
+        self.outcomes: Deque[Tuple[bool, float]] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.open_for = reset_timeout
+        self.probes = 0
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def _refresh(self, now: float) -> None:
+        if self.state == OPEN and now - self.opened_at >= self.open_for:
+            self.state = HALF_OPEN
+            self.probes = 0
+
+    def allow(self, now: Optional[float] = None) -> bool:
+        '''Whether a call may go out now, a half-open breaker counts the call as one of its probes.'''
+        self._refresh(now or time.monotonic())
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and self.probes < self.half_open_calls:
+            self.probes += 1
+            return True
+        self.stats["rejected"] += 1
+        return False
+
+    def release(self) -> None:
+        '''Hands back a probe that was allowed but never finished (e.g. cancelled), without an outcome.'''
+        if self.state == HALF_OPEN and self.probes:
+            self.probes -= 1
+
+    def record(self, ok: bool, latency: Optional[float] = None, now: Optional[float] = None) -> None:
+        now = now or time.monotonic()
+        self._refresh(now)
+        self.stats["calls"] += 1
+        self.outcomes.append((ok, latency or 0.0))
+        if ok:
+            self.consecutive_failures = 0
+            if self.state == HALF_OPEN:
+                # Recovered, start counting afresh
+                self.state = CLOSED
+                self.open_for = self.reset_timeout
+                self.outcomes.clear()
+                self.outcomes.append((ok, latency or 0.0))
+            return
+
+        self.stats["failures"] += 1
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            self._open(now, min(self.open_for * 2, self.max_reset_timeout))
+        elif self.state == CLOSED and (
+            self.consecutive_failures >= self.max_consecutive or
+            (len(self.outcomes) >= self.min_calls and 1 - self.success_rate >= self.failure_rate)
+        ):
+            self._open(now, self.open_for)
+
+    def _open(self, now: float, open_for: float) -> None:
+        self.state = OPEN
+        self.opened_at = now
+        self.open_for = open_for
+        self.stats["opened"] += 1
+
+    @property
+    def success_rate(self) -> float:
+        if not self.outcomes:
+            return 1.0
+        return sum(ok for ok, _ in self.outcomes) / len(self.outcomes)
+
+    @property
+    def latency(self) -> Optional[float]:
+        '''Mean latency of the successful outcomes in the window.'''
+        latencies = [latency for ok, latency in self.outcomes if ok]
+        return sum(latencies) / len(latencies) if latencies else None
+
+    @property
+    def score(self) -> float:
+        '''
+            Higher is healthier: the success rate (with a prior of one success and one failure so a single
+            outcome does not swing it) divided by `1 + latency` in seconds. An open breaker scores 0.
+        '''
+        if self.state == OPEN:
+            return 0.0
+        successes = sum(ok for ok, _ in self.outcomes)
+        rate = (successes + 1) / (len(self.outcomes) + 2)
+        return rate / (1 + (self.latency or 0.0))
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._refresh(time.monotonic())
+        latency = self.latency
+        return {
+            **self.stats,
+            "state": self.state,
+            "success_rate": round(self.success_rate, 3),
+            "latency": round(latency, 3) if latency is not None else None,
+            "score": round(self.score, 3),
+        }
+
+class HealthRegistry:
+    '''One `CircuitBreaker` per name (e.g. a source's server names), created on first use with `breaker_kwargs`.'''
+    def __init__(self, **breaker_kwargs) -> None:
+        self.breaker_kwargs = breaker_kwargs
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def __getitem__(self, name: str) -> CircuitBreaker:
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = self.breakers[name] = CircuitBreaker(**self.breaker_kwargs)
+        return breaker
+
+    def record(self, name: str, ok: bool, latency: Optional[float] = None) -> None:
+        self[name].record(ok, latency)
+
+    def order(self, names: Iterable[str]) -> List[str]:
+        '''Healthiest first, ties keep their order.'''
+        return sorted(names, key=lambda name: self[name].score, reverse=True)
+
+    def select(self, names: Iterable[str]) -> Tuple[List[str], List[str]]:
+        '''
+            Splits `names` into the ones that may be called now (healthiest first) and the ones whose breaker
+            is open. When every breaker is open the one that has waited longest is let through as a probe.
+        '''
+        allowed, rejected = [], []
+        for name in self.order(names):
+            (allowed if self[name].allow() else rejected).append(name)
+        if not allowed and rejected:
+            forced = min(rejected, key=lambda name: self[name].opened_at)
+            rejected.remove(forced)
+            allowed.append(forced)
+        return allowed, rejected
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {name: breaker.snapshot() for name, breaker in self.breakers.items()}
@@ -0,0 +1,370 @@
+'''
+    Single pass HLS playlist parsers.
+    Lines can be fed one at a time (e.g. straight from `response.aiter_lines()`), only tag lines
+    that matter allocate anything, attribute lists are split lazily and relative URIs are resolved
+    against the playlist url.
+'''
+import re
+from array import array
+from urllib.parse import urljoin
+from typing import Optional, Union, List, Dict, Iterable, AsyncIterator
+
+# Quoted values can hold commas (CODECS="avc1.64001f,mp4a.40.2") so they are matched first
+_ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=(?:"([^"]*)"|([^,]*))')
+
+def parse_attributes(attribute_list: str) -> Dict[str, str]:
+    '''`BANDWIDTH=1,CODECS="a,b"` -> {"BANDWIDTH": "1", "CODECS": "a,b"}, quotes are stripped.'''
+    return {key: quoted or value for key, quoted, value in _ATTRIBUTE_PATTERN.findall(attribute_list)}
+
+def _to_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+def _to_float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+class _Tagged:
+    # The raw attribute list is kept and only split into a dict the first time it is read
+    def __init__(self, url: Optional[str], attribute_list: str) -> None:
+        self.url = url
+        self.attribute_list = attribute_list
+        self._attributes: Optional[Dict[str, str]] = None
+
+    @property
+    def attributes(self) -> Dict[str, str]:
+        if self._attributes is None:
+            self._attributes = parse_attributes(self.attribute_list)
+        return self._attributes
+
+class Variant(_Tagged):
+    '''One `EXT-X-STREAM-INF` (or `EXT-X-I-FRAME-STREAM-INF`) entry, every attribute is kept in `attributes`.'''
+
+    @property
+    def bandwidth(self) -> Optional[int]:
+        return _to_int(self.attributes.get("BANDWIDTH"))
+
+    @property
+    def average_bandwidth(self) -> Optional[int]:
+        return _to_int(self.attributes.get("AVERAGE-BANDWIDTH"))
+
+    @property
+    def resolution(self) -> Optional[str]:
+        return self.attributes.get("RESOLUTION")
+
+    @property
+    def frame_rate(self) -> Optional[float]:
+        return _to_float(self.attributes.get("FRAME-RATE"))
+
+    @property
+    def codecs(self) -> Optional[str]:
+        return self.attributes.get("CODECS")
+
+    @property
+    def audio(self) -> Optional[str]:
+        return self.attributes.get("AUDIO")
+
+    @property
+    def subtitles(self) -> Optional[str]:
+        return self.attributes.get("SUBTITLES")
+
+    def __repr__(self) -> str:
+        return f"Variant(url='{self.url}', bandwidth={self.bandwidth}, resolution='{self.resolution}')"
+
+class Rendition(_Tagged):
+    '''One `EXT-X-MEDIA` entry (alternative audio, subtitles, ...), `url` is None for muxed renditions.'''
+
+    @property
+    def type(self) -> Optional[str]:
+        return self.attributes.get("TYPE")
+
+    @property
+    def group_id(self) -> Optional[str]:
+        return self.attributes.get("GROUP-ID")
+
+    @property
+    def name(self) -> Optional[str]:
+        return self.attributes.get("NAME")
+
+    @property
+    def language(self) -> Optional[str]:
+        return self.attributes.get("LANGUAGE")
+
+    @property
+    def default(self) -> bool:
+        return self.attributes.get("DEFAULT") == "YES"
+
+    @property
+    def channels(self) -> Optional[int]:
+        # e.g. CHANNELS="6" or "16/JOC"
+        return _to_int(self.attributes.get("CHANNELS", "").partition("/")[0])
+
+    def __repr__(self) -> str:
+        return f"Rendition(type='{self.type}', group_id='{self.group_id}', name='{self.name}', url='{self.url}')"
+
+class MasterPlaylist:
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.version: Optional[int] = None
+        self.independent_segments = False
+        self.variants: List[Variant] = []
+        self.iframe_variants: List[Variant] = []
+        self.renditions: List[Rendition] = []
+
+    def renditions_for(self, group_id: Optional[str], type: Optional[str] = None) -> List[Rendition]:
+        return [
+            rendition for rendition in self.renditions
+            if rendition.group_id == group_id and (type is None or rendition.type == type)
+        ]
+
+    @property
+    def is_master(self) -> bool:
+        return bool(self.variants or self.iframe_variants)
+
+    def __repr__(self) -> str:
+        return f"MasterPlaylist(url='{self.url}', variants={len(self.variants)}, renditions={len(self.renditions)})"
+
+class _Resolver:
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self._base = url.partition("?")[0].rpartition("/")[0] + "/"
+
+    def resolve(self, uri: str) -> str:
+        if uri.startswith(("https://", "http://")):
+            return uri
+        if ":" not in uri and not uri.startswith(("/", ".")):
+            # Plain relative path, the common case, no need for the full RFC 3986 merge
+            return self._base + uri
+        return urljoin(self.url, uri)
+
+    @staticmethod
+    def _uri(attribute_list: str) -> Optional[str]:
+        start = attribute_list.find('URI="')
+        if start == -1:
+            return None
+        start += 5
+        return attribute_list[start:attribute_list.index('"', start)]
+
+class MasterPlaylistParser(_Resolver):
+    '''
+        Incremental parser, `feed()` one line at a time then `close()`.
+        Only the tags below allocate, everything else (comments, unknown tags, segment lines) is skipped
+        after a single `startswith`.
+    '''
+    def __init__(self, url: str) -> None:
+        super().__init__(url)
+        self.playlist = MasterPlaylist(url)
+        self._pending: Optional[str] = None
+        self._header_seen = False
+
+    def feed(self, line: str) -> None:
+        line = line.strip()
+        if not line:
+            return
+        if line[0] != "#":
+            # URI line, only meaningful straight after an EXT-X-STREAM-INF
+            if self._pending is not None:
+                self.playlist.variants.append(Variant(self.resolve(line), self._pending))
+                self._pending = None
+            return
+        if not line.startswith("#EXT"):
+            return
+
+        tag, _, value = line.partition(":")
+        if tag == "#EXT-X-STREAM-INF":
+            self._pending = value
+        elif tag == "#EXT-X-MEDIA":
+            uri = self._uri(value)
+            self.playlist.renditions.append(Rendition(self.resolve(uri) if uri else None, value))
+        elif tag == "#EXT-X-I-FRAME-STREAM-INF":
+            uri = self._uri(value)
+            if uri:
+                self.playlist.iframe_variants.append(Variant(self.resolve(uri), value))
+        elif tag == "#EXTM3U":
+            self._header_seen = True
+        elif tag == "#EXT-X-VERSION":
+            self.playlist.version = _to_int(value)
+        elif tag == "#EXT-X-INDEPENDENT-SEGMENTS":
+            self.playlist.independent_segments = True
+
+    def close(self) -> MasterPlaylist:
+        if not self._header_seen:
+            raise ValueError("Not an m3u8 playlist, missing #EXTM3U!")
+        return self.playlist
+
+def parse_master(data: Union[str, Iterable[str]], url: str) -> MasterPlaylist:
+    parser = MasterPlaylistParser(url)
+    for line in data.splitlines() if isinstance(data, str) else data:
+        parser.feed(line)
+    return parser.close()
+
+async def parse_master_lines(lines: AsyncIterator[str], url: str) -> MasterPlaylist:
+    '''Parses as the body arrives, e.g. `await parse_master_lines(response.aiter_lines(), str(response.url))`.'''
+    parser = MasterPlaylistParser(url)
+    async for line in lines:
+        parser.feed(line)
+    return parser.close()
+
+class MediaPlaylistIndex:
+    '''
+        Compact index of one media playlist.
+        Per segment data lives in flat arrays (8 bytes per value) instead of one object per segment:
+        `durations`, `byte_offsets`/`byte_lengths` (-1 without EXT-X-BYTERANGE) and `key_ids`
+        (position in `keys`, -1 when the segment is not encrypted).
+    '''
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.version: Optional[int] = None
+        self.target_duration: Optional[float] = None
+        self.media_sequence = 0
+        self.playlist_type: Optional[str] = None
+        self.complete = False
+        self.durations = array("d")
+        self.byte_offsets = array("q")
+        self.byte_lengths = array("q")
+        self.key_ids = array("q")
+        self.discontinuities = array("q")
+        self.keys: List[Dict[str, str]] = []
+        # Kept so the start of the stream can be fetched without re-reading the playlist
+        self.first_segment: Optional[str] = None
+
+    @property
+    def segment_count(self) -> int:
+        return len(self.durations)
+
+    @property
+    def total_duration(self) -> float:
+        return sum(self.durations)
+
+    @property
+    def max_segment_duration(self) -> float:
+        return max(self.durations, default=0.0)
+
+    @property
+    def total_bytes(self) -> Optional[int]:
+        '''Only known when every segment has a byte range.'''
+        if not self.byte_lengths or min(self.byte_lengths) < 0:
+            return None
+        return sum(self.byte_lengths)
+
+    @property
+    def encrypted(self) -> bool:
+        return bool(self.keys)
+
+    def matches_runtime(self, minutes: Optional[float], tolerance: float = 0.1) -> Optional[bool]:
+        '''Whether the playlist is as long as `minutes` (e.g. the TMDB runtime), None if either is unknown.'''
+        if not minutes or not self.complete or not self.durations:
+            return None
+        expected = minutes * 60
+        return abs(self.total_duration - expected) <= expected * tolerance
+
+    @property
+    def as_dict(self) -> Dict:
+        return {
+            "url": self.url,
+            "segments": self.segment_count,
+            "duration": round(self.total_duration, 3),
+            "target_duration": self.target_duration,
+            "media_sequence": self.media_sequence,
+            "playlist_type": self.playlist_type,
+            "complete": self.complete,
+            "total_bytes": self.total_bytes,
+            "discontinuities": len(self.discontinuities),
+            "keys": self.keys,
+        }
+
+    def __repr__(self) -> str:
+        return f"MediaPlaylistIndex(url='{self.url}', segments={self.segment_count}, duration={self.total_duration:.1f}, complete={self.complete})"
+
+class MediaPlaylistParser(_Resolver):
+    '''Incremental parser for a media playlist, builds a `MediaPlaylistIndex` without keeping segment URIs (bar the first).'''
+    def __init__(self, url: str) -> None:
+        super().__init__(url)
+        self.index = MediaPlaylistIndex(url)
+        self._header_seen = False
+        self._duration: Optional[float] = None
+        self._byte_range: Optional[str] = None
+        self._key_id = -1
+        self._last_uri: Optional[str] = None
+        self._last_end = 0
+
+    def feed(self, line: str) -> None:
+        line = line.strip()
+        if not line:
+            return
+        index = self.index
+        if line[0] != "#":
+            if self._duration is None:
+                return
+            if index.first_segment is None:
+                index.first_segment = self.resolve(line)
+            index.durations.append(self._duration)
+            index.key_ids.append(self._key_id)
+            if self._byte_range is None:
+                index.byte_offsets.append(-1)
+                index.byte_lengths.append(-1)
+            else:
+                length, _, offset = self._byte_range.partition("@")
+                # Without an offset the range carries on from the previous one of the same resource
+                start = int(offset) if offset else (self._last_end if line == self._last_uri else 0)
+                index.byte_offsets.append(start)
+                index.byte_lengths.append(int(length))
+                self._last_end = start + int(length)
+            self._last_uri = line
+            self._duration = None
+            self._byte_range = None
+            return
+        if not line.startswith("#EXT"):
+            return
+
+        tag, _, value = line.partition(":")
+        if tag == "#EXTINF":
+            self._duration = _to_float(value.partition(",")[0]) or 0.0
+        elif tag == "#EXT-X-BYTERANGE":
+            self._byte_range = value
+        elif tag == "#EXT-X-KEY":
+            attributes = parse_attributes(value)
+            if attributes.get("METHOD", "NONE") == "NONE":
+                self._key_id = -1
+            else:
+                if attributes.get("URI"):
+                    attributes["URI"] = self.resolve(attributes["URI"])
+                index.keys.append(attributes)
+                self._key_id = len(index.keys) - 1
+        elif tag == "#EXT-X-DISCONTINUITY":
+            index.discontinuities.append(len(index.durations))
+        elif tag == "#EXT-X-TARGETDURATION":
+            index.target_duration = _to_float(value)
+        elif tag == "#EXT-X-MEDIA-SEQUENCE":
+            index.media_sequence = _to_int(value) or 0
+        elif tag == "#EXT-X-PLAYLIST-TYPE":
+            index.playlist_type = value
+            if value == "VOD":
+                index.complete = True
+        elif tag == "#EXT-X-ENDLIST":
+            index.complete = True
+        elif tag == "#EXT-X-VERSION":
+            index.version = _to_int(value)
+        elif tag == "#EXTM3U":
+            self._header_seen = True
+
+    def close(self) -> MediaPlaylistIndex:
+        if not self._header_seen:
+            raise ValueError("Not an m3u8 playlist, missing #EXTM3U!")
+        return self.index
+
+def parse_media(data: Union[str, Iterable[str]], url: str) -> MediaPlaylistIndex:
+    parser = MediaPlaylistParser(url)
+    for line in data.splitlines() if isinstance(data, str) else data:
+        parser.feed(line)
+    return parser.close()
+
+async def parse_media_lines(lines: AsyncIterator[str], url: str) -> MediaPlaylistIndex:
+    parser = MediaPlaylistParser(url)
+    async for line in lines:
+        parser.feed(line)
+    return parser.close()
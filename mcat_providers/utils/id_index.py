@@ -0,0 +1,281 @@
+'''
+    Offline gmid -> source id index (e.g. "M.278" -> flixhq "19679").
+
+    The file is an open addressing hash table that is memory mapped, so a lookup is a couple of
+    `struct.unpack_from` calls on the page cache: no network, no SQLite and nothing loaded up front.
+
+    Layout, little endian:
+        header  magic b"MCID", version u32, slot count u32, entry count u32
+        slots   key u64 (0 = empty), source id u32, verified at u32 (unix seconds)
+
+    `key` packs the gmid kind and the tmdb id, only title gmids ("M.<tmdb>", "S.<tmdb>") with numeric
+    ids are stored. The file is never edited in place: `set`/`discard` go to an in-memory overlay and
+    `save()` rewrites the whole table atomically and maps the new one. A save merges the overlay into what
+    is on disk right then, under a lock file, so processes sharing an index (a batch run and a server) keep
+    each other's entries. The overlay is saved in a thread once it holds `max_overlay` entries, so a long
+    running server does not grow it without bound or block its event loop.
+'''
+import os
+import time
+import mmap
+import struct
+import asyncio
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional, Dict, Iterator, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, saves are still atomic but concurrent writers are not merged
+    fcntl = None
+
+from mcat_providers.config import log
+from mcat_providers.utils.artifacts import _write_atomic
+
+_MAGIC = b"MCID"
+_VERSION = 1
+_HEADER = struct.Struct("<4sIII")
+_SLOT = struct.Struct("<QII")
+_KINDS = {"M": 1, "S": 2}
+_KIND_NAMES = {code: kind for kind, code in _KINDS.items()}
+# Fibonacci hashing, spreads sequential tmdb ids over the table
+_MULTIPLIER = 0x9E3779B97F4A7C15
+_MASK64 = (1 << 64) - 1
+
+def gmid_to_key(gmid: str) -> Optional[int]:
+    kind, _, tmdb = gmid.partition(".")
+    if kind not in _KINDS or not tmdb.isdigit() or int(tmdb) >= 1 << 32:
+        return None
+    return _KINDS[kind] << 32 | int(tmdb)
+
+def key_to_gmid(key: int) -> str:
+    return f"{_KIND_NAMES[key >> 32]}.{key & 0xFFFFFFFF}"
+
+def _slot_for(key: int, mask: int) -> int:
+    return ((key * _MULTIPLIER) & _MASK64) >> 32 & mask
+
+def _open_table(path: str) -> Optional[Tuple[mmap.mmap, int]]:
+    '''Maps the table at `path` and returns it with its slot count, None when there is no valid one.'''
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return None
+    if len(data) < _HEADER.size:
+        log.error(f"Ignoring truncated id index at {path}")
+        data.close()
+        return None
+    magic, version, slots, _ = _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC or version != _VERSION or len(data) != _HEADER.size + slots * _SLOT.size or slots & (slots - 1):
+        log.error(f"Ignoring invalid id index at {path}")
+        data.close()
+        return None
+    return data, slots
+
+def _read_table(path: str) -> Dict[int, Tuple[int, int]]:
+    table = _open_table(path)
+    if table is None:
+        return {}
+    data, slots = table
+    try:
+        entries = {}
+        for slot in range(slots):
+            key, source_id, verified_at = _SLOT.unpack_from(data, _HEADER.size + slot * _SLOT.size)
+            if key:
+                entries[key] = (source_id, verified_at)
+        return entries
+    finally:
+        data.close()
+
+@contextmanager
+def _locked(path: str) -> Iterator[None]:
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+class SourceIdIndex:
+    '''
+        Maps title gmids to source ids. `get` is O(1) against the mapped file plus the overlay,
+        entries older than `max_age` seconds are still returned but reported by `is_stale` so they can be refreshed.
+        Past `max_overlay` pending writes the index saves itself, if it cannot the oldest pending writes are dropped.
+    '''
+    def __init__(self, path: str, max_age: float = 30 * 24 * 3600, max_overlay: int = 4096) -> None:
+        self.path = path
+        self.max_age = max_age
+        self.max_overlay = max_overlay
+        self._overlay: "OrderedDict[int, Optional[Tuple[int, int]]]" = OrderedDict()
+        self._map: Optional[mmap.mmap] = None
+        self._slots = 0
+        self._loaded = False
+        self._flush: Optional[asyncio.Future] = None
+
+    def _load(self) -> None:
+        self._loaded = True
+        table = _open_table(self.path)
+        if table is not None:
+            self._map, self._slots = table
+
+    def _find(self, key: int) -> Optional[Tuple[int, int]]:
+        if key in self._overlay:
+            return self._overlay[key]
+        if not self._loaded:
+            self._load()
+        if not self._slots:
+            return None
+        mask = self._slots - 1
+        slot = _slot_for(key, mask)
+        for _ in range(self._slots):
+            found, source_id, verified_at = _SLOT.unpack_from(self._map, _HEADER.size + slot * _SLOT.size)
+            if found == key:
+                return source_id, verified_at
+            if not found:
+                return None
+            slot = (slot + 1) & mask
+        return None
+
+    def lookup(self, gmid: str) -> Optional[Tuple[str, float]]:
+        '''Returns the source id and when it was last verified.'''
+        key = gmid_to_key(gmid)
+        found = self._find(key) if key is not None else None
+        if found is None:
+            return None
+        return str(found[0]), float(found[1])
+
+    def get(self, gmid: str) -> Optional[str]:
+        found = self.lookup(gmid)
+        return found[0] if found else None
+
+    def is_stale(self, gmid: str, now: Optional[float] = None) -> bool:
+        '''True for missing entries and ones verified more than `max_age` seconds ago.'''
+        found = self.lookup(gmid)
+        return found is None or (now or time.time()) - found[1] > self.max_age
+
+    def set(self, gmid: str, source_id: str, verified_at: Optional[float] = None) -> bool:
+        key = gmid_to_key(gmid)
+        if key is None or not str(source_id).isdigit() or int(source_id) >= 1 << 32:
+            log.warning(f"Cannot index {gmid} -> {source_id}")
+            return False
+        self._write(key, (int(source_id), int(verified_at or time.time())))
+        return True
+
+    def discard(self, gmid: str) -> None:
+        key = gmid_to_key(gmid)
+        if key is not None:
+            self._write(key, None)
+
+    def _write(self, key: int, value: Optional[Tuple[int, int]]) -> None:
+        self._overlay[key] = value
+        self._overlay.move_to_end(key)
+        if len(self._overlay) < self.max_overlay or (self._flush is not None and not self._flush.done()):
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._save_or_trim()
+        else:
+            self._flush = asyncio.ensure_future(self.flush())
+
+    def _save_or_trim(self) -> None:
+        try:
+            self.save()
+        except OSError as e:
+            self._trim(e)
+
+    def _trim(self, error: BaseException) -> None:
+        log.error(f"Could not save the id index at {self.path}, dropping the oldest pending entries: {error}")
+        while len(self._overlay) > self.max_overlay // 2:
+            self._overlay.popitem(last=False)
+
+    async def flush(self) -> int:
+        '''`save()` with the file work in a thread, entries set while it runs stay pending for the next save.'''
+        overlay = dict(self._overlay)
+        try:
+            count = await asyncio.to_thread(self._merge_and_write, overlay)
+        except OSError as e:
+            self._trim(e)
+            return len(self)
+        self._swap(overlay)
+        return count
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._overlay)
+
+    def items(self) -> Iterator[Tuple[str, str, float]]:
+        '''Yields (gmid, source id, verified at) for every entry.'''
+        if not self._loaded:
+            self._load()
+        for slot in range(self._slots):
+            key, source_id, verified_at = _SLOT.unpack_from(self._map, _HEADER.size + slot * _SLOT.size)
+            if key and key not in self._overlay:
+                yield key_to_gmid(key), str(source_id), float(verified_at)
+        for key, value in self._overlay.items():
+            if value is not None:
+                yield key_to_gmid(key), str(value[0]), float(value[1])
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.items())
+
+    def __contains__(self, gmid: str) -> bool:
+        return self.lookup(gmid) is not None
+
+    def save(self) -> int:
+        '''Writes the table (at most half full) with the overlay merged in, returns the entry count.'''
+        overlay = dict(self._overlay)
+        count = self._merge_and_write(overlay)
+        self._swap(overlay)
+        return count
+
+    def _merge_and_write(self, overlay: Dict[int, Optional[Tuple[int, int]]]) -> int:
+        '''
+            Merges `overlay` into the table on disk (the newest verification wins) and replaces it.
+            Only reads the file and `overlay`, never the mapped table, so it is safe to run in a thread.
+        '''
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with _locked(self.path):
+            merged = _read_table(self.path)
+            for key, value in overlay.items():
+                if value is None:
+                    merged.pop(key, None)
+                elif key not in merged or value[1] >= merged[key][1]:
+                    merged[key] = value
+            _write_atomic(self.path, self._pack(merged))
+        return len(merged)
+
+    @staticmethod
+    def _pack(merged: Dict[int, Tuple[int, int]]) -> bytes:
+        entries = [(key, source_id, verified_at) for key, (source_id, verified_at) in merged.items()]
+        slots = 8
+        while slots < len(entries) * 2:
+            slots *= 2
+        mask = slots - 1
+        table = bytearray(_HEADER.size + slots * _SLOT.size)
+        _HEADER.pack_into(table, 0, _MAGIC, _VERSION, slots, len(entries))
+        for key, source_id, verified_at in entries:
+            slot = _slot_for(key, mask)
+            while _SLOT.unpack_from(table, _HEADER.size + slot * _SLOT.size)[0]:
+                slot = (slot + 1) & mask
+            _SLOT.pack_into(table, _HEADER.size + slot * _SLOT.size, key, source_id, verified_at)
+        return bytes(table)
+
+    def _swap(self, overlay: Dict[int, Optional[Tuple[int, int]]]) -> None:
+        # The new file is mapped on the next lookup, what was saved leaves the overlay unless it changed meanwhile
+        self.close()
+        for key, value in overlay.items():
+            if key in self._overlay and self._overlay[key] == value:
+                del self._overlay[key]
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        self._map, self._slots, self._loaded = None, 0, False
@@ -0,0 +1,171 @@
+import time
+import asyncio
+from email.utils import parsedate_to_datetime
+from collections import deque
+from typing import Optional, Dict, Deque, Any
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    '''Seconds to wait from a `Retry-After` header, which is either a number of seconds or an HTTP date.'''
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class AIMDLimiter:
+    '''
+        Rate and concurrency limit for one host.
+
+        Requests take a token from a bucket refilled at `rate` per second (up to `burst`) and a slot out of
+        `concurrency`. Both adapt AIMD style: every success adds `increase / concurrency` slots (roughly
+        `increase` per round of requests) and `rate_increase * max_rate / rate` to the rate (roughly that share
+        of the starting rate per second), a 429, 5xx, timeout or a response slower than `latency_factor` times
+        the usual latency multiplies them by `decrease`, at most once per `cooldown` seconds so one burst of
+        errors only counts once. A `Retry-After` pauses the host for that long (capped at `max_pause`).
+
+        Slots are handed out first come first served: a freed slot goes straight to the oldest waiter.
+        Not bound to an event loop, waiters are futures of whichever loop is running.
+    '''
+    def __init__(
+        self,
+        rate: float = 50.0,
+        burst: Optional[float] = None,
+        max_concurrency: int = 32,
+        min_concurrency: int = 1,
+        min_rate: float = 0.5,
+        increase: float = 1.0,
+        rate_increase: float = 0.02,
+        decrease: float = 0.5,
+        latency_factor: float = 3.0,
+        cooldown: float = 1.0,
+        max_pause: float = 60.0,
+    ) -> None:
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.min_rate = min_rate
+        self.concurrency = float(max_concurrency)
+        self.increase = increase
+        self.rate_increase = rate_increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.max_pause = max_pause
+
+        self.tokens = self.burst
+        self.inflight = 0
+        self.paused_until = 0.0
+        self.latency: Optional[float] = None
+        self._latency_samples = 0
+        self._refilled = time.monotonic()
+        self._last_decrease = float("-inf")
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0, "slow": 0, "decreases": 0, "paused": 0, "waited": 0.0}
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _wake(self) -> None:
+        '''Hands free slots straight to the oldest waiters, so a caller that never waited cannot take them first.'''
+        free = int(self.concurrency) - self.inflight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.inflight += 1
+                waiter.set_result(None)
+                free -= 1
+
+    async def acquire(self) -> None:
+        start = time.monotonic()
+        # New callers queue behind anyone already waiting
+        if self._waiters or self.inflight >= int(self.concurrency):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Handed a slot we will never use, pass it on
+                    self.inflight = max(0, self.inflight - 1)
+                    self._wake()
+                raise
+        else:
+            self.inflight += 1
+
+        # The slot is ours from here, only the pause and the token bucket are left
+        try:
+            while True:
+                now = time.monotonic()
+                if self.paused_until > now:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens < 1:
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+                    continue
+                self.tokens -= 1
+                break
+        except asyncio.CancelledError:
+            self.inflight = max(0, self.inflight - 1)
+            self._wake()
+            raise
+        self.stats["requests"] += 1
+        self.stats["waited"] += time.monotonic() - start
+
+    def release(
+        self,
+        status: Optional[int] = None,
+        latency: Optional[float] = None,
+        retry_after: Optional[float] = None,
+        failed: bool = False,
+    ) -> None:
+        '''
+            Gives the slot back and adapts. `failed` marks timeouts and connection errors,
+            a `status` of None with `failed` unset (e.g. a cancelled request) leaves the limits alone.
+        '''
+        self.inflight = max(0, self.inflight - 1)
+        now = time.monotonic()
+        if status == 429 or (status is not None and status >= 500) or failed:
+            self.stats["throttled" if status == 429 else "errors"] += 1
+            self._decrease(now, self.decrease)
+            if retry_after is not None:
+                self.stats["paused"] += 1
+                self.paused_until = max(self.paused_until, now + min(retry_after, self.max_pause))
+        elif status is not None and latency is not None:
+            if self.latency is not None and self._latency_samples >= 10 and latency > self.latency * self.latency_factor:
+                self.stats["slow"] += 1
+                self._decrease(now, (1 + self.decrease) / 2)
+            else:
+                self.latency = latency if self.latency is None else self.latency * 0.9 + latency * 0.1
+                self._latency_samples += 1
+                self.concurrency = min(self.max_concurrency, self.concurrency + self.increase / self.concurrency)
+                self.rate = min(self.max_rate, self.rate + self.rate_increase * self.max_rate / self.rate)
+        self._wake()
+
+    def _decrease(self, now: float, factor: float) -> None:
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.stats["decreases"] += 1
+        self.concurrency = max(self.min_concurrency, self.concurrency * factor)
+        self.rate = max(self.min_rate, self.rate * factor)
+        self._refill(now)
+        self.tokens = min(self.tokens, self.rate)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "waited": round(self.stats["waited"], 3),
+            "rate": round(self.rate, 2),
+            "concurrency": round(self.concurrency, 2),
+            "inflight": self.inflight,
+            "waiting": len(self._waiters),
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 3),
+        }
@@ -0,0 +1,390 @@
+'''
+    Fast paths for writing results out.
+
+    JSON     `to_json_bytes(result)` / `write_to(result, fp)` produce exactly what `json.dumps(result.as_dict)` does,
+             without building the dict tree. Streams, subtitles and header sets are immutable, so each one is
+             encoded once and the fragment is reused (a header set shared by every stream is encoded once in total).
+             Load with `loads_json(data)`.
+    MsgPack  `packb(result)` writes the same structure as MessagePack, `unpackb(data)` loads it back.
+             Plain values (dicts, lists, ...) can be packed too, `unpackb(data, raw=True)` returns them as is.
+    NDJSON   `NDJSONWriter(fp).write(result)` writes one JSON document per line, `read_ndjson(fp)` yields them back
+             (lines written from plain dicts come back as dicts). Results inside a dict take the fast path too.
+
+    Loaders rebuild `SourceResponse`/`ProviderResponse`/`Stream`/`Subtitle` objects. `Stream.index` and `Stream.probe`
+    are written as summaries, `probe` is restored but the per segment arrays of `index` are not, it loads as None.
+'''
+import json
+import math
+import struct
+from enum import Enum
+from typing import Any, Optional, Union, List, Dict, Iterator, IO, Tuple
+
+from mcat_providers.probe import ProbeResult
+from mcat_providers.utils.types import ProviderHeaders, Subtitle, Stream, ProviderResponse, SourceResponse
+
+Result = Union[SourceResponse, ProviderResponse, Stream, Subtitle]
+
+# JSON
+_encode_str = json.encoder.encode_basestring_ascii
+
+def _json_value(value: Any) -> str:
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, Enum):
+        value = value.value
+    if isinstance(value, str):
+        return _encode_str(value)
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if isinstance(value, float):
+        if math.isfinite(value):
+            return float.__repr__(value)
+        return "NaN" if value != value else ("Infinity" if value > 0 else "-Infinity")
+    return json.dumps(value)
+
+# provider names, extensions, codecs and qualities repeat across every stream
+_REPEATED: Dict[Any, str] = {}
+
+def _repeated(value: Any) -> str:
+    encoded = _REPEATED.get(value)
+    if encoded is None:
+        encoded = _json_value(value)
+        if len(_REPEATED) < 4096:
+            _REPEATED[value] = encoded
+    return encoded
+
+def _cached(obj: Any, slot: str, build) -> Any:
+    encoded = getattr(obj, slot, None)
+    if encoded is None:
+        encoded = build(obj)
+        object.__setattr__(obj, slot, encoded)
+    return encoded
+
+def _headers_json(headers: ProviderHeaders) -> str:
+    return "{" + ", ".join(f"{_encode_str(key)}: {_json_value(value)}" for key, value in headers.items) + "}"
+
+def _subtitle_json(subtitle: Subtitle) -> str:
+    return f'{{"language": {_json_value(subtitle.language)}, "url": {_json_value(subtitle.url)}, "ext": {_json_value(subtitle.ext)}}}'
+
+def _stream_json(stream: Stream) -> str:
+    return (
+        f'{{"provider": {_repeated(stream.provider)}, '
+        f'"headers": {_cached(stream.headers, "_json", _headers_json)}, '
+        f'"url": {_encode_str(stream.url)}, '
+        f'"ext": {_repeated(stream.ext)}, '
+        f'"quality": {_repeated(stream.quality)}, '
+        f'"codec": {_repeated(stream.codec)}, '
+        f'"bandwith": {_json_value(stream.bandwith)}, '
+        f'"audio_channels": {_json_value(stream.audio_channels)}, '
+        f'"frame_rate": {_repeated(stream.frame_rate)}, '
+        f'"index": {json.dumps(stream.index.as_dict) if stream.index else "null"}, '
+        f'"probe": {json.dumps(stream.probe.as_dict) if stream.probe else "null"}}}'
+    )
+
+def _provider_json(provider: ProviderResponse) -> str:
+    streams = ", ".join(_cached(stream, "_json", _stream_json) for stream in provider.streams)
+    subtitles = ", ".join(_cached(subtitle, "_json", _subtitle_json) for subtitle in provider.subtitles)
+    return f'{{"provider": {_json_value(provider.provider)}, "streams": [{streams}], "subtitles": [{subtitles}]}}'
+
+def _iter_json(result: Result) -> Iterator[str]:
+    if isinstance(result, SourceResponse):
+        yield f'{{"name": {_json_value(result.source)}, "providers": ['
+        first = True
+        for provider in result.providers:
+            if not provider:
+                continue
+            yield _provider_json(provider) if first else ", " + _provider_json(provider)
+            first = False
+        yield "]}"
+    elif isinstance(result, ProviderResponse):
+        yield _provider_json(result)
+    elif isinstance(result, Stream):
+        yield _cached(result, "_json", _stream_json)
+    elif isinstance(result, Subtitle):
+        yield _cached(result, "_json", _subtitle_json)
+    else:
+        raise TypeError(f"Cannot serialise '{result.__class__.__name__}'")
+
+_RESULT_TYPES = (SourceResponse, ProviderResponse, Stream, Subtitle)
+
+def _iter_record_json(record: Dict) -> Iterator[str]:
+    # Same separators as `json.dumps`, top level values that are results are encoded by `_iter_json`
+    yield "{"
+    for position, (key, value) in enumerate(record.items()):
+        yield f'{", " if position else ""}{_encode_str(str(key))}: '
+        if isinstance(value, _RESULT_TYPES):
+            yield from _iter_json(value)
+        else:
+            yield json.dumps(value)
+    yield "}"
+
+def to_json_bytes(result: Result) -> bytes:
+    '''Same bytes as `json.dumps(result.as_dict).encode()`.'''
+    return "".join(_iter_json(result)).encode()
+
+def write_to(result: Result, fp: IO[bytes]) -> int:
+    '''Writes the JSON of `result` to a binary file-like object one provider at a time, returns the bytes written.'''
+    written = 0
+    for chunk in _iter_json(result):
+        data = chunk.encode()
+        fp.write(data)
+        written += len(data)
+    return written
+
+# Loaders
+def _headers_from_dict(data: Dict) -> ProviderHeaders:
+    data = dict(data)
+    return ProviderHeaders(
+        origin=data.pop("Origin", None),
+        referrer=data.pop("Referrer", None),
+        user_agent=data.pop("User-Agent", None),
+        additional_headers=data,
+    )
+
+def stream_from_dict(data: Dict) -> Stream:
+    probe = data.get("probe")
+    return Stream(
+        provider=data["provider"],
+        headers=_headers_from_dict(data["headers"]),
+        url=data["url"],
+        ext=data["ext"],
+        quality=data["quality"],
+        codec=data.get("codec"),
+        bandwith=data.get("bandwith"),
+        audio_channels=data.get("audio_channels"),
+        frame_rate=data.get("frame_rate"),
+        probe=ProbeResult(data["url"], **probe) if probe else None,
+    )
+
+def subtitle_from_dict(data: Dict) -> Subtitle:
+    return Subtitle(language=data["language"], url=data["url"], ext=data["ext"])
+
+def provider_from_dict(data: Dict) -> ProviderResponse:
+    return ProviderResponse(
+        provider=data["provider"],
+        streams=[stream_from_dict(stream) for stream in data["streams"]],
+        subtitles=[subtitle_from_dict(subtitle) for subtitle in data["subtitles"]],
+    )
+
+def source_from_dict(data: Dict) -> SourceResponse:
+    return SourceResponse(source=data["name"], providers=[provider_from_dict(provider) for provider in data["providers"]])
+
+def is_result(data: Dict) -> bool:
+    '''Whether `data` is the `as_dict` of a result, rather than some other record.'''
+    return "providers" in data or "streams" in data or "headers" in data or data.keys() == {"language", "url", "ext"}
+
+def from_dict(data: Dict) -> Result:
+    '''Rebuilds whichever result type `data` is the `as_dict` of.'''
+    if "providers" in data:
+        return source_from_dict(data)
+    if "streams" in data:
+        return provider_from_dict(data)
+    if "headers" in data:
+        return stream_from_dict(data)
+    return subtitle_from_dict(data)
+
+def loads_json(data: Union[bytes, str]) -> Result:
+    return from_dict(json.loads(data))
+
+# NDJSON
+class NDJSONWriter:
+    '''One JSON document per line, `flush` after every line so a reader sees each result as it lands.'''
+    def __init__(self, fp: IO[bytes], flush: bool = True) -> None:
+        self.fp = fp
+        self.flush = flush
+        self.count = 0
+
+    def write(self, result: Union[Result, Dict]) -> None:
+        data = "".join(_iter_record_json(result)).encode() if isinstance(result, dict) else to_json_bytes(result)
+        self.fp.write(data + b"\n")
+        if self.flush:
+            self.fp.flush()
+        self.count += 1
+
+def read_ndjson(fp: IO) -> Iterator[Union[Result, Dict]]:
+    for line in fp:
+        if line.strip():
+            data = json.loads(line)
+            yield from_dict(data) if is_result(data) else data
+
+# MessagePack
+_pack_double = struct.Struct(">d").pack
+
+def _pack_len(size: int, fix: int, fix_max: int, codes: Tuple[int, ...]) -> bytes:
+    if size < fix_max:
+        return bytes((fix | size,))
+    for code, fmt, limit in zip(codes, (">BB", ">BH", ">BI"), (0x100, 0x10000, 0x100000000)):
+        if code and size < limit:
+            return struct.pack(fmt, code, size)
+    raise ValueError(f"Too large to pack: {size}")
+
+def _pack_int(value: int) -> bytes:
+    if 0 <= value < 0x80:
+        return bytes((value,))
+    if -32 <= value < 0:
+        return struct.pack(">b", value)
+    if value >= 0:
+        for code, fmt, limit in ((0xcc, ">BB", 0x100), (0xcd, ">BH", 0x10000), (0xce, ">BI", 0x100000000), (0xcf, ">BQ", 0x10000000000000000)):
+            if value < limit:
+                return struct.pack(fmt, code, value)
+    else:
+        for code, fmt, limit in ((0xd0, ">Bb", 0x80), (0xd1, ">Bh", 0x8000), (0xd2, ">Bi", 0x80000000), (0xd3, ">Bq", 0x8000000000000000)):
+            if value >= -limit:
+                return struct.pack(fmt, code, value)
+    raise ValueError(f"Integer out of range: {value}")
+
+def _pack_str(value: str) -> bytes:
+    data = value.encode()
+    if len(data) < 32:
+        return bytes((0xa0 | len(data),)) + data
+    return _pack_len(len(data), 0xa0, 32, (0xd9, 0xda, 0xdb)) + data
+
+def _pack_map(pairs: List[Tuple[str, Any]]) -> bytes:
+    return _pack_len(len(pairs), 0x80, 16, (0, 0xde, 0xdf)) + b"".join(_pack_str(key) + _pack(value) for key, value in pairs)
+
+class _Packed(bytes):
+    '''Already encoded bytes, written through untouched.'''
+
+def _pack_headers(headers: ProviderHeaders) -> _Packed:
+    return _Packed(_pack_map(list(headers.items)))
+
+def _pack_subtitle(subtitle: Subtitle) -> _Packed:
+    return _Packed(_pack_map([("language", subtitle.language), ("url", subtitle.url), ("ext", subtitle.ext)]))
+
+_STREAM_KEYS = tuple(_pack_str(key) for key in Stream._fields)
+_STREAM_HEADER = _pack_len(len(Stream._fields), 0x80, 16, (0, 0xde, 0xdf))
+_PACKED_REPEATED: Dict[Any, bytes] = {}
+
+def _pack_repeated(value: Any) -> bytes:
+    packed = _PACKED_REPEATED.get(value)
+    if packed is None:
+        packed = _pack(value)
+        if len(_PACKED_REPEATED) < 4096:
+            _PACKED_REPEATED[value] = packed
+    return packed
+
+def _pack_stream(stream: Stream) -> _Packed:
+    # Same keys and order as `Stream.as_dict`
+    k_provider, k_headers, k_url, k_ext, k_quality, k_codec, k_bandwith, k_channels, k_frame_rate, k_index, k_probe = _STREAM_KEYS
+    return _Packed(b"".join((
+        _STREAM_HEADER,
+        k_provider, _pack_repeated(stream.provider),
+        k_headers, _cached(stream.headers, "_packed", _pack_headers),
+        k_url, _pack_str(stream.url),
+        k_ext, _pack_repeated(stream.ext),
+        k_quality, _pack_repeated(stream.quality),
+        k_codec, _pack_repeated(stream.codec),
+        k_bandwith, _pack(stream.bandwith),
+        k_channels, _pack(stream.audio_channels),
+        k_frame_rate, _pack_repeated(stream.frame_rate),
+        k_index, _pack(stream.index.as_dict if stream.index else None),
+        k_probe, _pack(stream.probe.as_dict if stream.probe else None),
+    )))
+
+def _pack(value: Any) -> bytes:
+    if value is None:
+        return b"\xc0"
+    if value is True:
+        return b"\xc3"
+    if value is False:
+        return b"\xc2"
+    if isinstance(value, _Packed):
+        return value
+    if isinstance(value, Enum):
+        value = value.value
+    if isinstance(value, str):
+        return _pack_str(value)
+    if isinstance(value, int):
+        return _pack_int(value)
+    if isinstance(value, float):
+        return b"\xcb" + _pack_double(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return _pack_len(len(value), 0, 0, (0xc4, 0xc5, 0xc6)) + bytes(value)
+    if isinstance(value, (list, tuple)):
+        return _pack_len(len(value), 0x90, 16, (0, 0xdc, 0xdd)) + b"".join(_pack(item) for item in value)
+    if isinstance(value, dict):
+        return _pack_map(list(value.items()))
+    if isinstance(value, Stream):
+        return _cached(value, "_packed", _pack_stream)
+    if isinstance(value, Subtitle):
+        return _cached(value, "_packed", _pack_subtitle)
+    if isinstance(value, ProviderHeaders):
+        return _cached(value, "_packed", _pack_headers)
+    if isinstance(value, ProviderResponse):
+        return _pack_map([("provider", value.provider), ("streams", value.streams), ("subtitles", value.subtitles)])
+    if isinstance(value, SourceResponse):
+        return _pack_map([("name", value.source), ("providers", [provider for provider in value.providers if provider])])
+    raise TypeError(f"Cannot pack '{value.__class__.__name__}'")
+
+def packb(value: Any) -> bytes:
+    '''MessagePack encoding of a result (same structure as `as_dict`) or of plain values.'''
+    return _pack(value)
+
+_FIXED = {
+    0xc4: (">B", 1), 0xc5: (">H", 2), 0xc6: (">I", 4),
+    0xca: (">f", 4), 0xcb: (">d", 8),
+    0xcc: (">B", 1), 0xcd: (">H", 2), 0xce: (">I", 4), 0xcf: (">Q", 8),
+    0xd0: (">b", 1), 0xd1: (">h", 2), 0xd2: (">i", 4), 0xd3: (">q", 8),
+    0xd9: (">B", 1), 0xda: (">H", 2), 0xdb: (">I", 4),
+    0xdc: (">H", 2), 0xdd: (">I", 4), 0xde: (">H", 2), 0xdf: (">I", 4),
+}
+
+def _unpack(data: memoryview, offset: int) -> Tuple[Any, int]:
+    code = data[offset]
+    offset += 1
+    if code < 0x80:
+        return code, offset
+    if code >= 0xe0:
+        return code - 0x100, offset
+    if 0xa0 <= code <= 0xbf:
+        size = code & 0x1f
+        return str(data[offset:offset + size], "utf-8"), offset + size
+    if 0x90 <= code <= 0x9f:
+        return _unpack_array(data, offset, code & 0x0f)
+    if 0x80 <= code <= 0x8f:
+        return _unpack_map(data, offset, code & 0x0f)
+    if code == 0xc0:
+        return None, offset
+    if code == 0xc2:
+        return False, offset
+    if code == 0xc3:
+        return True, offset
+    if code not in _FIXED:
+        raise ValueError(f"Unsupported MessagePack type 0x{code:02x}")
+    fmt, width = _FIXED[code]
+    (value,) = struct.unpack_from(fmt, data, offset)
+    offset += width
+    if code in (0xc4, 0xc5, 0xc6):
+        return bytes(data[offset:offset + value]), offset + value
+    if code in (0xd9, 0xda, 0xdb):
+        return str(data[offset:offset + value], "utf-8"), offset + value
+    if code in (0xdc, 0xdd):
+        return _unpack_array(data, offset, value)
+    if code in (0xde, 0xdf):
+        return _unpack_map(data, offset, value)
+    return value, offset
+
+def _unpack_array(data: memoryview, offset: int, size: int) -> Tuple[List, int]:
+    items = []
+    for _ in range(size):
+        item, offset = _unpack(data, offset)
+        items.append(item)
+    return items, offset
+
+def _unpack_map(data: memoryview, offset: int, size: int) -> Tuple[Dict, int]:
+    items = {}
+    for _ in range(size):
+        key, offset = _unpack(data, offset)
+        items[key], offset = _unpack(data, offset)
+    return items, offset
+
+def unpackb(data: bytes, raw: bool = False) -> Any:
+    '''Loads `packb` output, rebuilding the result types unless `raw`.'''
+    value, offset = _unpack(memoryview(data), 0)
+    if offset != len(data):
+        raise ValueError(f"{len(data) - offset} trailing bytes after MessagePack value")
+    return value if raw or not isinstance(value, dict) else from_dict(value)
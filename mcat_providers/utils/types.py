@@ -1,11 +1,17 @@
 from __future__ import annotations
 
 import re
+import sys
 from enum import Enum
-from mcat_providers import default_ua
-from typing import Optional, Union, List, Dict
+from weakref import WeakValueDictionary
+from mcat_providers.config import default_ua
+from typing import Any, Optional, Union, List, Dict, Tuple, Iterable, IO, TYPE_CHECKING
 
-from mcat_providers import log as logger
+if TYPE_CHECKING:
+    from mcat_providers.probe import ProbeResult
+    from mcat_providers.utils.hls import MediaPlaylistIndex
+
+from mcat_providers.config import log as logger
 
 # Enums
 class QualityEnum(str, Enum):
@@ -29,27 +35,48 @@ class QualityEnum(str, Enum):
 
     @classmethod
     def map_enum(cls, quality: str) -> QualityEnum:
-        quality = cls.process_quality_str(quality)
-        if quality in ["7680x4320", "4320p", "8k"]:
-            return cls.P_4320
-        if quality in ["4096x2160", "2160p", "ultrahd", "uhd", "4k"]:
-            return cls.P_2160
-        if quality in ["2560x1440", "1440p", "quadhd", "wqhd", "qhd"]:
-            return cls.P_1440
-        if quality in ["1920x1080", "1080p", "fullhd", "fhd"]:
-            return cls.P_1080
-        if quality in ["1280x720", "720p", "hd"]:
-            return cls.P_720
-        if quality in ["854x480", "480p"]:
-            return cls.P_480
-        if quality in ["640x360", "360p"]:
-            return cls.P_360
-        if quality in ["426x240", "240p"]:
-            return cls.P_240
-        if quality in ["144p"]:
-            return cls.P_144
-        logger.warn(f"Unknown quality: {quality}")
-        return cls.UNKNOWN
+        # Exact spellings are a single dict lookup, anything else is normalised once and remembered
+        found = _QUALITY_TABLE.get(quality)
+        if found is None:
+            found = _QUALITY_TABLE.get(cls.process_quality_str(quality))
+            if found is None:
+                logger.warn(f"Unknown quality: {quality}")
+                found = cls.UNKNOWN
+            if len(_QUALITY_TABLE) < _QUALITY_TABLE_MAX:
+                _QUALITY_TABLE[quality] = found
+        return found
+
+    @property
+    def rank(self) -> int:
+        '''Position in the quality ladder, higher is better and UNKNOWN is below everything.'''
+        return _QUALITY_RANKS[self]
+
+    @classmethod
+    def coerce(cls, quality: Union[str, QualityEnum]) -> QualityEnum:
+        if isinstance(quality, QualityEnum):
+            return quality
+        return cls.map_enum(quality)
+
+_QUALITY_RANKS = {quality: rank for rank, quality in enumerate(QualityEnum)}
+_QUALITY_RANKS[QualityEnum.UNKNOWN] = -1
+
+_QUALITY_ALIASES = {
+    QualityEnum.P_4320: ("7680x4320", "4320p", "8k"),
+    QualityEnum.P_2160: ("3840x2160", "4096x2160", "2160p", "ultrahd", "uhd", "4k"),
+    QualityEnum.P_1440: ("2560x1440", "1440p", "quadhd", "wqhd", "qhd"),
+    QualityEnum.P_1080: ("1920x1080", "1080p", "fullhd", "fhd"),
+    QualityEnum.P_720: ("1280x720", "720p", "hd"),
+    QualityEnum.P_480: ("854x480", "480p"),
+    QualityEnum.P_360: ("640x360", "360p"),
+    QualityEnum.P_240: ("426x240", "240p"),
+    QualityEnum.P_144: ("144p",),
+    QualityEnum.UNKNOWN: ("UNKNOWN",),
+}
+_QUALITY_TABLE: Dict[str, QualityEnum] = {
+    alias: quality for quality, aliases in _QUALITY_ALIASES.items() for alias in aliases
+}
+# Raw spellings seen at runtime are added too, capped so junk input cannot grow it forever
+_QUALITY_TABLE_MAX = 4096
 
 class MediaEnum(str, Enum):
     MOVIE = "Movie"
@@ -103,33 +130,106 @@ class MediaType:
         self.episode = str(episode)
 
     @property
-    def gmid(self) -> str:
+    def base_gmid(self) -> str:
+        '''gmid of the title itself, shared by every episode of a series.'''
         assert self.tmdb, "Cannot get gmid without tmdb existing!"
-        gmid = f"{self.media_type.gmid_key}.{self.tmdb}"
+        return f"{self.media_type.gmid_key}.{self.tmdb}"
+
+    @property
+    def gmid(self) -> str:
+        gmid = self.base_gmid
         if self.media_type == MediaEnum.SERIES:
             gmid += f".{self.season}.{self.episode}"
         return gmid
 
-class ProviderHeaders:
-    def __init__(
-        self, 
-        origin: Optional[str] = None, 
-        referrer: Optional[str] = None, 
-        user_agent: Optional[str] = None, 
+class _Frozen:
+    '''
+        Base for the result types: slotted, immutable once built and pickled as their constructor arguments,
+        so they are cheap to hold in bulk and to send to another process. `replace()` builds a changed copy.
+    '''
+    __slots__ = ()
+    # Constructor arguments, in order
+    _fields: Tuple[str, ...] = ()
+    _compare: Tuple[str, ...] = ()
+
+    def _set(self, **values: Any) -> None:
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"'{self.__class__.__name__}' is immutable, use replace()")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"'{self.__class__.__name__}' is immutable")
+
+    def replace(self, **changes: Any):
+        return self.__class__(**{**{name: getattr(self, name) for name in self._fields}, **changes})
+
+    def __reduce__(self):
+        return (self.__class__, tuple(getattr(self, name) for name in self._fields))
+
+    def _key(self) -> Tuple:
+        return tuple(getattr(self, name) for name in self._compare or self._fields)
+
+    def __eq__(self, other) -> bool:
+        if other.__class__ is not self.__class__:
+            return False
+        return self is other or self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+class _Serializable(_Frozen):
+    '''Results that can skip `as_dict` on the way out, see `mcat_providers.utils.serialize`.'''
+    __slots__ = ()
+
+    def to_json_bytes(self) -> bytes:
+        from mcat_providers.utils.serialize import to_json_bytes
+        return to_json_bytes(self)
+
+    def write_to(self, fp: IO[bytes]) -> int:
+        from mcat_providers.utils.serialize import write_to
+        return write_to(self, fp)
+
+    def to_msgpack(self) -> bytes:
+        from mcat_providers.utils.serialize import packb
+        return packb(self)
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if isinstance(value, str) else value
+
+class ProviderHeaders(_Frozen):
+    '''
+        Immutable header set. Equal header sets are interned, so every stream from a provider
+        shares one instance instead of carrying its own copy.
+    '''
+    __slots__ = ("_origin", "_referrer", "_user_agent", "_headers", "_items", "_json", "_packed", "__weakref__")
+    _interned: "WeakValueDictionary[Tuple, ProviderHeaders]" = WeakValueDictionary()
+
+    def __new__(
+        cls,
+        origin: Optional[str] = None,
+        referrer: Optional[str] = None,
+        user_agent: Optional[str] = None,
         additional_headers: Optional[Dict] = None,
         **kwargs
-    ) -> None:
-        self._origin = origin
-        self._referrer = referrer
-        self._user_agent = user_agent or default_ua
-        self._headers = {
-            "Origin": self._origin,
-            "Referrer": self._referrer,
-            "User-Agent": self._user_agent,
+    ) -> ProviderHeaders:
+        user_agent = user_agent or default_ua
+        headers = {
+            "Origin": origin,
+            "Referrer": referrer,
+            "User-Agent": user_agent,
         }
         if additional_headers:
-            self._headers.update(additional_headers)
-        self._headers.update(kwargs)
+            headers.update(additional_headers)
+        headers.update(kwargs)
+        items = tuple(headers.items())
+        self = cls._interned.get(items)
+        if self is None:
+            self = object.__new__(cls)
+            self._set(_origin=origin, _referrer=referrer, _user_agent=user_agent, _headers=headers, _items=items)
+            cls._interned[items] = self
+        return self
 
     @property
     def origin(self) -> str:
@@ -137,32 +237,26 @@ class ProviderHeaders:
             raise ValueError("Origin must be set first!")
         return self._origin
 
-    @origin.setter
-    def origin(self, value: str) -> None:
-        self._origin = value
-        self._headers.update({"Origin": self._origin})
-
     @property
     def referrer(self) -> str:
         if not self._referrer:
             raise ValueError("Referrer must be set first!")
         return self._referrer
 
-    @referrer.setter
-    def referrer(self, value: str) -> None:
-        self._referrer = value
-        self._headers.update({"Referrer": self._referrer})
-
     @property
     def user_agent(self) -> str:
         if not self._user_agent:
             raise ValueError("User agent must be set first!")
         return self._user_agent
-    
-    @user_agent.setter
-    def user_agent(self, value: str) -> None:
-        self._user_agent = value
-        self._headers.update({"User-Agent": self._user_agent})
+
+    @property
+    def additional_headers(self) -> Dict:
+        return {key: value for key, value in self._items if key not in ("Origin", "Referrer", "User-Agent")}
+
+    @property
+    def items(self) -> Tuple[Tuple[str, Optional[str]], ...]:
+        '''The headers as an immutable tuple, no copy and no validation.'''
+        return self._items
 
     @property
     def headers(self) -> Dict:
@@ -174,21 +268,37 @@ class ProviderHeaders:
             raise ValueError("User agent must be set first!")
         return self._headers.copy()
 
-    def add_header(self, key: str, value: str) -> None:
-        self._headers[key] = value
+    def replace(self, **changes: Any) -> ProviderHeaders:
+        values = {
+            "origin": self._origin,
+            "referrer": self._referrer,
+            "user_agent": self._user_agent,
+            "additional_headers": self.additional_headers,
+        }
+        values.update(changes)
+        return ProviderHeaders(**values)
+
+    def with_header(self, key: str, value: str) -> ProviderHeaders:
+        return self.replace(additional_headers={**self.additional_headers, key: value})
 
-    def remove_header(self, key: str) -> None:
-        if key in self._headers:
-            del self._headers[key]
+    def without_header(self, key: str) -> ProviderHeaders:
+        return self.replace(additional_headers={k: v for k, v in self.additional_headers.items() if k != key})
+
+    def __reduce__(self):
+        return (self.__class__, (self._origin, self._referrer, self._user_agent, self.additional_headers))
+
+    def _key(self) -> Tuple:
+        return self._items
 
     def __repr__(self) -> str:
         return f"ProviderHeaders(origin='{self._origin}', referrer='{self._referrer}', user_agent='{self._user_agent}')"
 
-class Subtitle:
+class Subtitle(_Serializable):
+    _fields = ("language", "url", "ext")
+    __slots__ = _fields + ("_json", "_packed")
+
     def __init__(self, language: str, url: str, ext: str):
-        self.language = language
-        self.url = url
-        self.ext = ext
+        self._set(language=_intern(language), url=url, ext=_intern(ext))
 
     @property
     def as_dict(self) -> Dict:
@@ -201,15 +311,13 @@ class Subtitle:
     def __repr__(self) -> str:
         return f"Subtitle(language='{self.language}', url='{self.url}', ext='{self.ext}')"
 
-    def __eq__(self, other) -> bool:
-        if not isinstance(other, Subtitle):
-            return False
-        return self.language == other.language and self.url == other.url and self.ext == other.ext
-
-    def __hash__(self) -> int:
-        return hash((self.language, self.url, self.ext))
+class Stream(_Serializable):
+    _fields = ("provider", "headers", "url", "ext", "quality", "codec", "bandwith", "audio_channels", "frame_rate", "index", "probe")
+    # Encoded forms, filled in by `mcat_providers.utils.serialize` the first time they are needed
+    __slots__ = _fields + ("_json", "_packed")
+    # index/probe are measurements of the stream, not part of what it is
+    _compare = ("provider", "headers", "url", "ext", "quality", "codec", "bandwith", "audio_channels", "frame_rate")
 
-class Stream:
     def __init__(
         self, 
         provider: str,
@@ -220,16 +328,28 @@ class Stream:
         codec: Optional[str] = None, 
         bandwith: Optional[int] = None,
         audio_channels: Optional[int] = None,
+        frame_rate: Optional[float] = None,
+        index: Optional[MediaPlaylistIndex] = None,
+        probe: Optional[ProbeResult] = None,
         **kwargs
     ) -> None:
-        self.provider = provider
-        self.headers = headers
-        self.url = url
-        self.ext = ext
-        self.quality = quality if isinstance(quality, QualityEnum) else QualityEnum.map_enum(quality) 
-        self.codec = codec
-        self.bandwith = bandwith
-        self.audio_channels = audio_channels # TODO
+        self._set(
+            provider=_intern(provider),
+            headers=headers,
+            url=url,
+            ext=_intern(ext),
+            quality=quality if isinstance(quality, QualityEnum) else QualityEnum.map_enum(quality),
+            codec=_intern(codec),
+            bandwith=bandwith,
+            audio_channels=audio_channels, # TODO
+            frame_rate=frame_rate,
+            index=index, # Filled in when the media playlists are indexed
+            probe=probe, # Filled in by `StreamProber`
+        )
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.index.total_duration if self.index else None
 
     @property
     def as_dict(self) -> Dict:
@@ -241,34 +361,27 @@ class Stream:
             "quality": self.quality,
             "codec": self.codec,
             "bandwith": self.bandwith,
-            "audio_channels": self.audio_channels
+            "audio_channels": self.audio_channels,
+            "frame_rate": self.frame_rate,
+            "index": self.index.as_dict if self.index else None,
+            "probe": self.probe.as_dict if self.probe else None
         }
 
     def __repr__(self) -> str:
         return f"Stream(provider='{self.provider}', headers={self.headers}, url='{self.url}', ext='{self.ext}'," \
-               f"quality={self.quality}, codec='{self.codec}', bandwith={self.bandwith}, audio_channels={self.audio_channels})"
+               f"quality={self.quality}, codec='{self.codec}', bandwith={self.bandwith}, audio_channels={self.audio_channels}, frame_rate={self.frame_rate})"
 
-    def __eq__(self, other) -> bool:
-        if not isinstance(other, Stream):
-            return False
-        return self.url == other.url and self.quality == other.quality and \
-               self.provider == other.provider and self.headers == other.headers and\
-               self.ext == other.ext and self.codec == other.codec and self.bandwith == other.bandwith and\
-               self.audio_channels == other.audio_channels
+class ProviderResponse(_Serializable):
+    __slots__ = ("provider", "streams", "subtitles")
+    _fields = __slots__
 
-    def __hash__(self) -> int:
-        return hash((self.url, self.quality, self.provider, self.headers, self.ext, self.codec, self.bandwith, self.audio_channels))
-
-class ProviderResponse:
     def __init__(
             self,
             provider: str,
-            streams: List[Stream], 
-            subtitles: List[Subtitle],
+            streams: Iterable[Stream], 
+            subtitles: Iterable[Subtitle],
         ) -> None:
-        self.provider = provider
-        self.streams = streams
-        self.subtitles = subtitles
+        self._set(provider=_intern(provider), streams=tuple(streams), subtitles=tuple(subtitles))
 
     @property
     def as_dict(self) -> Dict:
@@ -279,16 +392,18 @@ class ProviderResponse:
         }
 
     def __repr__(self) -> str:
-        return f"ProviderResponse(provider='{self.provider}', streams={self.streams}, subtitles={self.subtitles})"
+        return f"ProviderResponse(provider='{self.provider}', streams={list(self.streams)}, subtitles={list(self.subtitles)})"
+
+class SourceResponse(_Serializable):
+    __slots__ = ("source", "providers")
+    _fields = __slots__
 
-class SourceResponse:
     def __init__(
             self,
             source: str,
-            providers: List[Optional[ProviderResponse]]
+            providers: Iterable[Optional[ProviderResponse]]
         ) -> None:
-        self.source = source
-        self.providers = providers
+        self._set(source=_intern(source), providers=tuple(providers))
 
     @property
     def as_dict(self) -> Dict:
@@ -298,11 +413,7 @@ class SourceResponse:
         }
 
     def __getitem__(self, item) -> Optional[ProviderResponse]:
-        result = list.__getitem__(self.providers, item)
-        try:
-            return result
-        except TypeError:
-            return result
+        return self.providers[item]
 
     def __repr__(self) -> str:
-        return f"SourceResponse(source='{self.source}', providers={self.providers})"
\ No newline at end of file
+        return f"SourceResponse(source='{self.source}', providers={list(self.providers)})"
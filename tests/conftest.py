@@ -0,0 +1,17 @@
+import os
+
+# Before anything reads the settings: no log file, no SQLite cache and no network for the TMDB token
+os.environ.setdefault("MCAT_LOG_FILE", "")
+os.environ.setdefault("MCAT_CACHE", "0")
+os.environ.setdefault("TMDB_API_KEY", "test")
+
+import pytest
+
+from mcat_providers.utils import decorators
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    '''In-process caches are keyed by class, not instance, so they would leak between tests.'''
+    for cache in decorators._caches.values():
+        cache.clear()
+    yield
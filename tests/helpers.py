@@ -0,0 +1,8 @@
+import httpx
+
+from mcat_providers.transport import HttpTransport, TransportConfig
+
+def mock_transport(handler, **config) -> HttpTransport:
+    '''An `HttpTransport` answered by `handler`, without retries or rate limiting unless asked for.'''
+    config = {"throttle_retries": 0, "rate_limit": False, **config}
+    return HttpTransport(TransportConfig(transport=httpx.MockTransport(handler), **config))
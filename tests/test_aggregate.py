@@ -0,0 +1,45 @@
+from mcat_providers.aggregate import Deduplicator, normalize_url, rank_providers
+from mcat_providers.utils.types import ProviderHeaders, ProviderResponse, Stream, Subtitle
+
+HEADERS = ProviderHeaders(origin="https://example.com", referrer="https://example.com")
+
+def stream(url: str, quality: str = "1080p") -> Stream:
+    return Stream(provider="Test", headers=HEADERS, url=url, ext=".m3u8", quality=quality)
+
+def subtitle(url: str, language: str = "English") -> Subtitle:
+    return Subtitle(language=language, url=url, ext=".vtt")
+
+def test_normalize_url():
+    assert normalize_url("HTTPS://CDN.Example.com:443//a//b.m3u8?b=2&a=1#x") == "cdn.example.com/a/b.m3u8?a=1&b=2"
+    assert normalize_url("http://cdn.example.com:8080/a") == "cdn.example.com:8080/a"
+
+def test_duplicate_streams_and_subtitles_are_dropped():
+    deduplicator = Deduplicator()
+    first = ProviderResponse("Upcloud", [stream("https://a.com/1.m3u8")], [subtitle("https://a.com/en.vtt")])
+    second = ProviderResponse(
+        "Vidcloud",
+        [stream("https://A.com/1.m3u8"), stream("https://a.com/2.m3u8")],
+        [subtitle("https://a.com/en.vtt")],
+    )
+    assert deduplicator.filter("flixhq", first).provider == "flixhq/Upcloud"
+    filtered = deduplicator.filter("flixhq", second)
+    assert [item.url for item in filtered.streams] == ["https://a.com/2.m3u8"]
+    assert filtered.subtitles == ()
+    assert deduplicator.stats == {"streams": 2, "duplicate_streams": 1, "subtitles": 1, "duplicate_subtitles": 1}
+
+def test_new_subtitles_are_kept_when_every_stream_is_a_duplicate():
+    deduplicator = Deduplicator()
+    deduplicator.filter("a", ProviderResponse("Upcloud", [stream("https://a.com/1.m3u8")], []))
+    filtered = deduplicator.filter("b", ProviderResponse("Upcloud", [stream("https://a.com/1.m3u8")], [subtitle("https://b.com/fr.vtt", "French")]))
+    assert filtered.streams == ()
+    assert [item.language for item in filtered.subtitles] == ["French"]
+    assert deduplicator.filter("b", ProviderResponse("Upcloud", [stream("https://a.com/1.m3u8")], [subtitle("https://b.com/fr.vtt")])) is None
+
+def test_subtitle_only_providers_rank_last():
+    ranked = rank_providers([
+        ProviderResponse("subs", [], [subtitle("https://a.com/en.vtt")]),
+        ProviderResponse("low", [stream("https://a.com/1.m3u8", "480p")], []),
+        ProviderResponse("high", [stream("https://a.com/2.m3u8", "480p"), stream("https://a.com/3.m3u8", "1080p")], []),
+    ])
+    assert [response.provider for response in ranked] == ["high", "low", "subs"]
+    assert [item.url for item in ranked[0].streams] == ["https://a.com/3.m3u8", "https://a.com/2.m3u8"]
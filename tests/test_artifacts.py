@@ -0,0 +1,97 @@
+import os
+import asyncio
+import httpx
+import pytest
+
+from mcat_providers.providers.rabbitstream import Rabbitstream
+from mcat_providers.utils.artifacts import ArtifactHandle, ArtifactStore
+from mcat_providers.utils.exceptions import IntegrityError
+
+from tests.helpers import mock_transport
+
+def reject_bad(content: bytes) -> None:
+    if content != b"good":
+        raise IntegrityError("bad content")
+
+def make_handle(tmp_path, seed: bytes, url: str = "https://example.com/asset.js?v=1") -> ArtifactHandle:
+    seed_path = tmp_path / "seed.js"
+    seed_path.write_bytes(seed)
+    handle = ArtifactHandle(name="asset", url=url, site="asset", validate=reject_bad, seed_path=str(seed_path))
+    handle._store = ArtifactStore(str(tmp_path / "store"))
+    return handle
+
+def test_valid_seed_is_promoted_without_a_download(tmp_path):
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise AssertionError("should not download")
+
+    handle = make_handle(tmp_path, b"good")
+    artifact = asyncio.run(handle.get(mock_transport(handler)))
+    assert artifact.content == b"good"
+    assert handle.store.load("asset").sha256 == artifact.sha256
+
+def test_seed_failing_validation_is_not_promoted(tmp_path):
+    downloads = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        downloads.append(str(request.url))
+        return httpx.Response(200, content=b"good")
+
+    handle = make_handle(tmp_path, b"tampered")
+    artifact = asyncio.run(handle.get(mock_transport(handler)))
+    assert artifact.content == b"good"
+    assert downloads == ["https://example.com/asset.js?v=1"]
+
+def test_invalid_download_without_a_fallback_raises(tmp_path):
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=b"tampered")
+
+    handle = make_handle(tmp_path, b"tampered")
+    with pytest.raises(IntegrityError):
+        asyncio.run(handle.get(mock_transport(handler)))
+
+def test_version_bump_fetches_the_new_version(tmp_path):
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=b"good")
+
+    handle = make_handle(tmp_path, b"good")
+    transport = mock_transport(handler)
+
+    async def main():
+        first = await handle.get(transport)
+        handle.set_url("https://example.com/asset.js?v=2")
+        return first, await handle.get(transport)
+
+    first, second = asyncio.run(main())
+    assert (first.version, second.version) == ("1", "2")
+
+def test_rabbitstream_reads_the_embed_page_before_picking_the_wasm():
+    order = []
+
+    class Recording(Rabbitstream):
+        async def get_meta(self, xrax):
+            order.append("meta")
+            return None
+
+        async def get_wasm(self):
+            order.append("wasm")
+            return b"wasm"
+
+    with pytest.raises(Exception):
+        asyncio.run(Recording().get_data("xrax"))
+    assert order[:2] == ["meta", "wasm"]
+
+def test_old_versions_are_removed_once_the_pointer_moves(tmp_path):
+    store = ArtifactStore(str(tmp_path / "store"))
+    first = store.save("asset", "https://example.com/asset.js?v=1", b"one")
+    # Another process's download that has not been renamed into place yet
+    in_progress = tmp_path / "store" / "asset" / ".tmp-abc123"
+    in_progress.write_bytes(b"partial")
+
+    second = store.save("asset", "https://example.com/asset.js?v=2", b"two")
+    assert sorted(path.name for path in (tmp_path / "store" / "asset").glob("*.bin")) == [os.path.basename(second.path)]
+    assert not os.path.exists(first.path) and in_progress.exists()
+    assert store.load("asset").sha256 == second.sha256
+
+    # Re-pointing at the same version keeps it
+    store.point(second)
+    assert store.load("asset").content == b"two"
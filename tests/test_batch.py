@@ -0,0 +1,53 @@
+import io
+import json
+import asyncio
+
+from mcat_providers.batch import BatchRunner, Checkpoint, read_rows, row_key
+from mcat_providers.utils.types import ProviderResponse, SourceResponse
+
+class FakeSource:
+    name = "fake"
+
+    def __init__(self) -> None:
+        self.scraped = []
+
+    async def scrape_all(self, tmdb, media_type, season, episode):
+        self.scraped.append(tmdb)
+        if tmdb == "boom":
+            raise RuntimeError("broken")
+        if tmdb == "0":
+            return None
+        return SourceResponse("Fake", [ProviderResponse("Test", [], [])])
+
+def test_rows_from_csv_and_jsonl(tmp_path):
+    csv_path = tmp_path / "rows.csv"
+    csv_path.write_text("tmdb,media_type,season,episode\n278,movie,,\n,movie,,\n1399,tv,1,2\n")
+    jsonl_path = tmp_path / "rows.jsonl"
+    jsonl_path.write_text('{"tmdb": 278}\n\n{"tmdb": "1399", "media_type": "tv", "season": 1, "episode": 2}\n')
+
+    expected = [
+        {"tmdb": "278", "media_type": "movie", "season": "0", "episode": "0"},
+        {"tmdb": "1399", "media_type": "tv", "season": "1", "episode": "2"},
+    ]
+    assert list(read_rows(str(csv_path))) == expected
+    assert list(read_rows(str(jsonl_path))) == expected
+
+def test_runner_writes_a_record_per_row_and_skips_duplicates(tmp_path):
+    rows = [{"tmdb": tmdb, "media_type": "movie", "season": "0", "episode": "0"} for tmdb in ("1", "0", "boom", "1")]
+    output = io.BytesIO()
+    source = FakeSource()
+    checkpoint = Checkpoint(str(tmp_path / "done.txt"))
+
+    stats = asyncio.run(BatchRunner(source, output, concurrency=2, checkpoint=checkpoint).run(iter(rows)))
+    assert stats == {"done": 1, "failed": 2, "skipped": 1}
+    records = {record["tmdb"]: record for record in map(json.loads, output.getvalue().splitlines())}
+    assert records["1"]["ok"] and records["1"]["result"]["name"] == "Fake"
+    assert records["0"]["error"] == "No sources found"
+    assert records["boom"]["error"] == "RuntimeError: broken"
+
+    # A re-run with the same checkpoint skips the row that succeeded and retries the ones that failed
+    source = FakeSource()
+    stats = asyncio.run(BatchRunner(source, io.BytesIO(), checkpoint=Checkpoint(checkpoint.path)).run(iter(rows)))
+    assert stats == {"done": 0, "failed": 2, "skipped": 2}
+    assert sorted(source.scraped) == ["0", "boom"]
+    assert Checkpoint(checkpoint.path).load() == {row_key(rows[0])}
@@ -0,0 +1,136 @@
+import asyncio
+import httpx
+
+from mcat_providers.sources.flixhq import FlixHq
+from mcat_providers.utils.decorators import async_cache, refresh_caches
+
+from tests.helpers import mock_transport
+
+def test_async_cache_shares_one_flight_and_caches():
+    calls = []
+
+    @async_cache(maxsize=8, ttl=60)
+    async def double(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    async def main():
+        first = await asyncio.gather(*(double(2) for _ in range(5)))
+        return first, await double(2)
+
+    first, again = asyncio.run(main())
+    assert first == [4] * 5 and again == 4
+    assert calls == [2]
+    stats = double.cache.stats()
+    assert stats["joins"] == 4 and stats["hits"] == 1
+
+def test_async_cache_does_not_store_exceptions_by_default():
+    calls = []
+
+    @async_cache(maxsize=8, ttl=60)
+    async def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ValueError("boom")
+        return "ok"
+
+    async def main():
+        try:
+            await flaky()
+        except ValueError:
+            pass
+        return await flaky()
+
+    assert asyncio.run(main()) == "ok"
+    assert len(calls) == 2
+
+def test_async_cache_skip_is_not_stored_but_joiners_get_it():
+    calls = []
+
+    @async_cache(maxsize=8, ttl=60, skip=lambda value: value is None)
+    async def lookup():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return None if len(calls) == 1 else "found"
+
+    async def main():
+        first = await asyncio.gather(lookup(), lookup())
+        return first, await lookup()
+
+    first, again = asyncio.run(main())
+    assert first == [None, None]
+    assert again == "found"
+    assert len(calls) == 2
+    assert lookup.cache.stats()["skipped"] == 1
+
+def test_async_cache_callable_ttl_is_read_on_store():
+    ttl = {"value": 0.0}
+
+    @async_cache(maxsize=8, ttl=lambda: ttl["value"] or None)
+    async def now(_):
+        return object()
+
+    async def main():
+        ttl["value"] = 0.001
+        first = await now(1)
+        await asyncio.sleep(0.01)
+        return first, await now(1)
+
+    first, second = asyncio.run(main())
+    assert first is not second
+
+def test_refresh_caches_skips_the_cached_result_and_replaces_it():
+    calls = []
+
+    @async_cache(maxsize=8, ttl=60)
+    async def lookup(value):
+        calls.append(value)
+        return len(calls)
+
+    async def main():
+        first = await lookup(1)
+        with refresh_caches():
+            refreshed = await lookup(1)
+        return first, refreshed, await lookup(1)
+
+    assert asyncio.run(main()) == (1, 2, 2)
+    assert calls == [1, 1]
+
+def test_failed_season_list_is_retried_on_the_next_call():
+    statuses = [503, 200]
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.url.path)
+        status = statuses.pop(0)
+        body = '<a data-id="111" class="ss-item">Season 1</a>' if status == 200 else "busy"
+        return httpx.Response(status, text=body)
+
+    source = FlixHq(transport=mock_transport(handler))
+
+    async def main():
+        return await source.get_seasons("4242"), await source.get_seasons("4242"), await source.get_seasons("4242")
+
+    failed, found, cached = asyncio.run(main())
+    assert failed is None
+    assert found == {"1": "111"} and cached == found
+    # The 503 was not cached, the success was
+    assert requests == ["/ajax/season/list/4242"] * 2
+
+def test_failed_episode_list_is_retried_on_the_next_call():
+    statuses = [503, 200]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        status = statuses.pop(0)
+        return httpx.Response(status, text='<a data-id="9001"></a><a data-id="9002"></a>' if status == 200 else "")
+
+    source = FlixHq(transport=mock_transport(handler))
+
+    async def main():
+        return await source.get_episodes("111"), await source.get_episodes("111")
+
+    failed, found = asyncio.run(main())
+    assert failed is None
+    assert found == {"1": "9001", "2": "9002"}
+    assert not statuses
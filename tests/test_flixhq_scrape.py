@@ -0,0 +1,49 @@
+import asyncio
+
+from mcat_providers.sources.flixhq import FlixHq
+from mcat_providers.utils.deadline import Deadline
+from mcat_providers.utils.types import SourceResponse
+
+class CountingFlixHq(FlixHq):
+    def __init__(self, results, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.results = list(results)
+        self.scrapes = 0
+
+    async def scrape_uncoalesced(self, **kwargs):
+        self.scrapes += 1
+        await asyncio.sleep(0.01)
+        return self.results.pop(0)
+
+def test_identical_scrapes_share_one_run():
+    found = SourceResponse(source="FlixHq", providers=[])
+    source = CountingFlixHq([found])
+
+    async def main():
+        return await asyncio.gather(*(source.scrape_all(media_type="movie", tmdb="278") for _ in range(5)))
+
+    assert asyncio.run(main()) == [found] * 5
+    assert source.scrapes == 1
+    assert source.stats["scrapes"]["joined"] == 4
+
+def test_failed_scrape_is_not_reused():
+    found = SourceResponse(source="FlixHq", providers=[])
+    source = CountingFlixHq([None, found])
+
+    async def main():
+        return await source.scrape_all(media_type="movie", tmdb="278"), await source.scrape_all(media_type="movie", tmdb="278")
+
+    assert asyncio.run(main()) == (None, found)
+    assert source.scrapes == 2
+
+def test_scrapes_with_a_deadline_are_not_coalesced():
+    found = SourceResponse(source="FlixHq", providers=[])
+    source = CountingFlixHq([found, found])
+
+    async def main():
+        deadline = Deadline(5)
+        await source.scrape_all(media_type="movie", tmdb="278", deadline=deadline)
+        await source.scrape_all(media_type="movie", tmdb="278", deadline=deadline)
+
+    asyncio.run(main())
+    assert source.scrapes == 2
@@ -0,0 +1,104 @@
+import asyncio
+import httpx
+import pytest
+
+from mcat_providers.config import settings
+from mcat_providers.sources.flixhq import FlixHq
+from mcat_providers.utils.cache import MISSING, MemoryCache
+from mcat_providers.utils.exceptions import SearchError
+
+from tests.helpers import mock_transport
+
+def entry(number: int, title: str = "Foo") -> str:
+    return (
+        f'<div class="film-detail"><h2><a href="/movie/watch-foo-{number}" title="{title}">x</a></h2>'
+        '<span class="fdi-item">2000</span><span class="fdi-item fdi-duration">120m</span>'
+        '<span class="float-right fdi-type">Movie</span></div><div class="clearfix"></div>'
+    )
+
+PAGER = '<ul class="pagination"><li><a href="/search/foo?page=2">2</a></li><li><a title="Last" href="/search/foo?page=5">L</a></li></ul>'
+PAGES = {1: entry(1, "Bar") + entry(2, "Baz") + PAGER, 2: entry(2, "Baz") + entry(3) + PAGER, 3: entry(4) + PAGER}
+
+def test_search_stops_at_the_first_page_with_a_match():
+    requested = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        page = int(request.url.params["page"])
+        requested.append(page)
+        return httpx.Response(200, text=PAGES[page])
+
+    source = FlixHq(transport=mock_transport(handler))
+    results = asyncio.run(source.query_flix("Foo", accept=lambda entry: entry["title"] == "Foo"))
+    assert requested == [1, 2]
+    # Entry 2 is on both pages and only returned once
+    assert [result["url"][-1] for result in results] == ["1", "2", "3"]
+
+def test_search_without_accept_reads_up_to_max_pages():
+    requested = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        page = int(request.url.params["page"])
+        requested.append(page)
+        return httpx.Response(200, text=PAGES[page])
+
+    source = FlixHq(transport=mock_transport(handler))
+    results = asyncio.run(source.query_flix("Foo"))
+    assert sorted(requested) == [1, 2, 3]
+    assert [result["url"][-1] for result in results] == ["1", "2", "3", "4"]
+
+def test_throttled_search_page_is_not_cached():
+    statuses = [429, 200]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(statuses.pop(0), text=entry(1))
+
+    source = FlixHq(transport=mock_transport(handler))
+
+    async def main():
+        with pytest.raises(SearchError):
+            await source.query_flix("Foo")
+        return await source.query_flix("Foo")
+
+    found = asyncio.run(main())
+    assert [result["url"][-1] for result in found] == ["1"]
+    assert not statuses
+
+MOVIE = dict(
+    title="Foo", media_type="Movie", duration=120, release="2000-05-01", genres=["Drama"], episode_count=0,
+    season_count=0, last_air_date="2000-05-01", last_season_episode_count=0, languages=["en"],
+)
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = MemoryCache()
+    monkeypatch.setattr(settings, "_cache", backend)
+    monkeypatch.setattr(settings, "cache_enabled", True)
+    return backend
+
+def test_failed_lookups_are_not_stored_as_no_match(backend):
+    responses = {
+        # The search itself fails
+        "search": [httpx.Response(503), httpx.Response(200, text=entry(1) + entry(2)), httpx.Response(200, text=entry(1, "Bar"))],
+        # Two candidates, and their pages fail
+        "detail": [httpx.Response(500), httpx.Response(500)],
+    }
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return responses["search" if "/search/" in request.url.path else "detail"].pop(0)
+
+    source = FlixHq(transport=mock_transport(handler))
+    key = "Movie:Foo:2000-05-01"
+
+    async def main():
+        for _ in range(2):
+            with pytest.raises(SearchError):
+                await source.resolve_source_id(**MOVIE)
+            assert backend.get("source_id", key) is MISSING
+            # Forget the search pages, so the next attempt searches again
+            source.get_search_page.cache.clear()
+            backend.clear("search")
+        # A search that worked and found nothing is a real negative
+        assert await source.resolve_source_id(**MOVIE) is None
+        assert backend.get("source_id", key) is None
+
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+import asyncio
+
+from mcat_providers.sources.flixhq import FlixHq
+
+RELEASE, GENRES, DURATION = "2000-05-01", ["Drama", "Crime"], 120
+
+def details(release=RELEASE, genres=("Drama", "Crime"), duration=DURATION):
+    return {"release": release, "genres": list(genres), "duration": duration}
+
+def test_scoring():
+    score = FlixHq.score_candidate
+    assert score(details(), RELEASE, GENRES, DURATION) == 7
+    assert score(details(genres=("Drama", "Comedy"), duration=90), RELEASE, GENRES, DURATION) == 5
+    assert score(details(genres=(), duration=None), RELEASE, [], DURATION) == 6
+    assert score(details(release=None), RELEASE, GENRES, DURATION) == 0
+    assert score(details(release="1999-05-01"), RELEASE, GENRES, DURATION) == 0
+
+def test_same_year_remake_is_never_accepted():
+    # Every genre and the runtime match, only the release date is off
+    remake = FlixHq.score_candidate(details(release="2000-11-20"), RELEASE, GENRES, DURATION)
+    assert remake < FlixHq.min_candidate_score
+
+class PagesFlixHq(FlixHq):
+    def __init__(self, pages, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.pages = pages
+        self.fetched = []
+
+    async def get_candidate_details(self, url):
+        self.fetched.append(url)
+        await asyncio.sleep(0.001)
+        return self.pages[url]
+
+def verify(source, urls):
+    return asyncio.run(source.verify_candidates([{"url": url} for url in urls], RELEASE, GENRES, DURATION))
+
+def test_best_candidate_wins_and_remakes_are_rejected():
+    source = PagesFlixHq({
+        "remake": details(release="2000-11-20"),
+        "partial": details(genres=("Drama", "Comedy")),
+        "other": details(genres=("Comedy",)),
+    })
+    assert verify(source, ["remake", "partial", "other"]) == {"url": "partial"}
+    assert verify(source, ["remake"]) is None
+
+def test_verification_stops_at_a_confirmed_candidate():
+    source = PagesFlixHq({f"page-{number}": details() for number in range(10)})
+    source.verify_concurrency = 1
+    assert verify(source, [f"page-{number}" for number in range(10)]) == {"url": "page-0"}
+    # The next page may already have started when the first one confirmed, nothing after it has
+    assert source.fetched[0] == "page-0" and len(source.fetched) <= 2
@@ -0,0 +1,140 @@
+import time
+import asyncio
+
+from mcat_providers.sources.flixhq import FlixHq
+from mcat_providers.utils.deadline import Deadline, _current_deadline
+from mcat_providers.utils.exceptions import DeadlineExceeded
+from mcat_providers.utils.health import CircuitBreaker, HealthRegistry, CLOSED, OPEN, HALF_OPEN
+from mcat_providers.utils.types import ProviderResponse
+
+def test_breaker_opens_on_failure_rate_and_recovers_through_a_probe():
+    breaker = CircuitBreaker(min_calls=4, failure_rate=0.5, reset_timeout=0.05)
+    for ok in (True, False, True, False):
+        breaker.record(ok, 0.1)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    # One probe at a time
+    assert not breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.state == CLOSED and breaker.allow()
+
+def test_failed_probe_reopens_for_longer():
+    breaker = CircuitBreaker(max_consecutive=2, reset_timeout=0.05)
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == OPEN
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN and breaker.open_for == 0.1
+
+def test_registry_orders_by_health_and_forces_one_through_when_all_are_open():
+    health = HealthRegistry(max_consecutive=1, reset_timeout=60)
+    health.record("slow", True, 2.0)
+    health.record("fast", True, 0.1)
+    assert health.order(["slow", "fast", "new"]) == ["fast", "new", "slow"]
+
+    health.record("a", False)
+    health.record("b", False)
+    allowed, rejected = health.select(["a", "b"])
+    assert allowed == ["a"] and rejected == ["b"]
+
+class Provider:
+    async def resolve(self, url):
+        return ProviderResponse(provider=url, streams=[], subtitles=[])
+
+class ServerFlixHq(FlixHq):
+    '''Two servers of the same provider, `outcomes` says whether each server's get_file works.'''
+    def __init__(self, outcomes, delays=None, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.outcomes = outcomes
+        self.delays = delays or {}
+        self.calls = []
+        provider = Provider()
+        self.providers = {name: provider for name in outcomes}
+
+    async def get_servers(self, media):
+        return [(name, name) for name in self.outcomes]
+
+    async def get_file(self, name, provider_id):
+        self.calls.append(name)
+        await asyncio.sleep(self.delays.get(name, 0.001))
+        return name, name if self.outcomes[name] else None
+
+    async def resolve_provider(self, provider, url, probe_budget=None, runtime=None):
+        return await provider.resolve(url)
+
+def scrape(source):
+    async def main():
+        return [response.provider async for response in source.scrape_iter(media_type="movie", tmdb="1")]
+    return asyncio.run(main())
+
+def test_servers_are_tried_in_health_order_and_only_fall_back_on_failure():
+    source = ServerFlixHq({"upcloud": True, "vidcloud": True})
+    source.health.record("vidcloud", True, 0.01)
+    source.health.record("upcloud", True, 1.0)
+    assert scrape(source) == ["vidcloud"]
+    # The healthier server resolved, the other one was never started
+    assert source.calls == ["vidcloud"]
+
+    source = ServerFlixHq({"upcloud": False, "vidcloud": True})
+    assert scrape(source) == ["vidcloud"]
+    assert source.calls == ["upcloud", "vidcloud"]
+    assert source.health["upcloud"].stats["failures"] == 1
+    assert source.health["vidcloud"].stats["calls"] == 1
+
+def test_a_slow_healthy_server_is_not_beaten_by_a_fast_flaky_one():
+    source = ServerFlixHq({"upcloud": True, "vidcloud": True}, delays={"upcloud": 0.05})
+    source.health.record("upcloud", True, 0.05)
+    source.health.record("vidcloud", False, 0.001)
+    assert scrape(source) == ["upcloud"]
+    assert source.calls == ["upcloud"]
+
+def test_server_that_times_out_falls_back_and_is_recorded():
+    source = ServerFlixHq({"upcloud": True, "vidcloud": True}, delays={"upcloud": 1.0})
+    source.server_timeout = 0.05
+    assert scrape(source) == ["vidcloud"]
+    assert source.health["upcloud"].stats["failures"] == 1
+
+def test_half_open_server_probes_alongside_the_healthy_one():
+    source = ServerFlixHq({"upcloud": True, "vidcloud": True})
+    source.health = HealthRegistry(max_consecutive=1, reset_timeout=0.01)
+    source.health.record("upcloud", False)
+    time.sleep(0.02)
+    assert scrape(source) in (["upcloud"], ["vidcloud"])
+    assert sorted(source.calls) == ["upcloud", "vidcloud"]
+    assert source.health["upcloud"].state == CLOSED
+
+class DeadlineFlixHq(ServerFlixHq):
+    '''get_file runs into the caller's deadline, raising like the transport does or swallowing it like a provider.'''
+    def __init__(self, swallow: bool = False, **kwargs) -> None:
+        super().__init__({"upcloud": True}, **kwargs)
+        self.swallow = swallow
+
+    async def get_file(self, name, provider_id):
+        self.calls.append(name)
+        await asyncio.sleep(0.02)
+        try:
+            Deadline.current().check("get_sources")
+        except DeadlineExceeded:
+            if self.swallow:
+                return name, None
+            raise
+        return name, name
+
+def test_an_expired_caller_deadline_does_not_count_against_the_server():
+    for swallow in (False, True):
+        source = DeadlineFlixHq(swallow=swallow)
+        source.health = HealthRegistry(max_consecutive=1)
+
+        async def main():
+            _current_deadline.set(Deadline(0.01))
+            return await source.resolve_server("upcloud", "upcloud", Provider())
+
+        assert asyncio.run(main()) is None
+        assert source.calls == ["upcloud"]
+        assert source.health["upcloud"].state == CLOSED
+        assert source.health["upcloud"].stats["calls"] == 0
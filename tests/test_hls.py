@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from mcat_providers.sources import BaseSource
+from mcat_providers.utils.hls import parse_attributes, parse_master, parse_media
+from mcat_providers.utils.types import ProviderHeaders, ProviderResponse, Stream
+
+MASTER = """#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-INDEPENDENT-SEGMENTS
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",NAME="English",LANGUAGE="en",DEFAULT=YES,CHANNELS="6",URI="audio/en.m3u8"
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",NAME="Muxed",DEFAULT=NO
+#EXT-X-STREAM-INF:BANDWIDTH=2000000,RESOLUTION=1280x720,CODECS="avc1.64001f,mp4a.40.2",FRAME-RATE=23.976,AUDIO="aud"
+720/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1920x1080
+https://cdn.example.com/1080/index.m3u8
+#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH=100000,URI="../iframes.m3u8"
+"""
+
+MEDIA = """#EXTM3U
+#EXT-X-VERSION:4
+#EXT-X-TARGETDURATION:10
+#EXT-X-MEDIA-SEQUENCE:5
+#EXT-X-PLAYLIST-TYPE:VOD
+#EXT-X-KEY:METHOD=AES-128,URI="key.bin"
+#EXTINF:10.0,
+#EXT-X-BYTERANGE:1000@0
+video.ts
+#EXTINF:10.0,
+#EXT-X-BYTERANGE:500
+video.ts
+#EXT-X-DISCONTINUITY
+#EXT-X-KEY:METHOD=NONE
+#EXTINF:4.5,
+#EXT-X-BYTERANGE:200@0
+other.ts
+#EXT-X-ENDLIST
+"""
+
+def test_attributes_keep_quoted_commas():
+    assert parse_attributes('BANDWIDTH=1,CODECS="a,b",NAME=x') == {"BANDWIDTH": "1", "CODECS": "a,b", "NAME": "x"}
+
+def test_master_playlist():
+    playlist = parse_master(MASTER, "https://cdn.example.com/movie/master.m3u8?token=1")
+    assert playlist.version == 3 and playlist.independent_segments and playlist.is_master
+
+    low, high = playlist.variants
+    assert low.url == "https://cdn.example.com/movie/720/index.m3u8"
+    assert (low.bandwidth, low.resolution, low.codecs, low.frame_rate) == (2000000, "1280x720", "avc1.64001f,mp4a.40.2", 23.976)
+    assert high.url == "https://cdn.example.com/1080/index.m3u8" and high.audio is None
+    assert playlist.iframe_variants[0].url == "https://cdn.example.com/iframes.m3u8"
+
+    english, muxed = playlist.renditions_for("aud", "AUDIO")
+    assert english.url == "https://cdn.example.com/movie/audio/en.m3u8"
+    assert english.default and english.channels == 6 and english.language == "en"
+    assert muxed.url is None and not muxed.default
+
+def test_not_a_playlist():
+    with pytest.raises(ValueError):
+        parse_master("<html></html>", "https://example.com/master.m3u8")
+    with pytest.raises(ValueError):
+        parse_media("", "https://example.com/index.m3u8")
+
+def test_media_playlist_index():
+    index = parse_media(MEDIA, "https://cdn.example.com/720/index.m3u8")
+    assert index.complete and index.playlist_type == "VOD"
+    assert (index.version, index.target_duration, index.media_sequence) == (4, 10.0, 5)
+    assert index.segment_count == 3 and index.total_duration == 24.5
+    assert index.max_segment_duration == 10.0
+    assert index.first_segment == "https://cdn.example.com/720/video.ts"
+    # A range without an offset carries on from the previous one of the same file
+    assert list(index.byte_offsets) == [0, 1000, 0]
+    assert index.total_bytes == 1700
+    assert list(index.key_ids) == [0, 0, -1]
+    assert index.keys[0]["URI"] == "https://cdn.example.com/720/key.bin"
+    assert list(index.discontinuities) == [2]
+
+def test_media_playlist_without_ranges_or_end():
+    index = parse_media("#EXTM3U\n#EXTINF:6,\na.ts\n#EXTINF:6,\nb.ts\n", "https://example.com/index.m3u8")
+    assert not index.complete and index.total_bytes is None and not index.encrypted
+
+def runtime_index(minutes: float):
+    segments = "".join("#EXTINF:10.0,\nseg.ts\n" for _ in range(int(minutes * 6)))
+    return parse_media(f"#EXTM3U\n{segments}#EXT-X-ENDLIST\n", "https://example.com/index.m3u8")
+
+def test_matches_runtime():
+    index = runtime_index(120)
+    assert index.matches_runtime(120) is True
+    assert index.matches_runtime(125) is True
+    assert index.matches_runtime(90) is False
+    assert index.matches_runtime(None) is None
+    assert parse_media("#EXTM3U\n#EXTINF:10,\na.ts\n", "https://example.com/i.m3u8").matches_runtime(120) is None
+
+def stream(height: str, minutes=None) -> Stream:
+    return Stream(
+        provider="Test",
+        headers=ProviderHeaders(origin="https://example.com", referrer="https://example.com"),
+        url=f"https://example.com/{height}.m3u8",
+        ext=".m3u8",
+        quality=f"{height}p",
+        index=runtime_index(minutes) if minutes else None,
+    )
+
+class RuntimeSource(BaseSource):
+    name = "test"
+    base = "https://example.com"
+
+class FakeProvider:
+    def __init__(self, response):
+        self.response = response
+
+    async def resolve(self, url):
+        return self.response
+
+def test_streams_of_the_wrong_length_are_dropped():
+    response = ProviderResponse(provider="Test", streams=[stream("1080", 30), stream("720", 120), stream("480")], subtitles=[])
+    resolved = asyncio.run(RuntimeSource().resolve_provider(FakeProvider(response), "https://example.com/e/1", runtime=120))
+    assert [item.url for item in resolved.streams] == ["https://example.com/720.m3u8", "https://example.com/480.m3u8"]
+
+def test_response_is_dropped_when_every_stream_is_the_wrong_length():
+    response = ProviderResponse(provider="Test", streams=[stream("1080", 2), stream("720", 2)], subtitles=[])
+    source = RuntimeSource()
+    assert asyncio.run(source.resolve_provider(FakeProvider(response), "https://example.com/e/1", runtime=120)) is None
+    # Without a runtime nothing is checked
+    assert asyncio.run(source.resolve_provider(FakeProvider(response), "https://example.com/e/1")) is response
@@ -0,0 +1,119 @@
+import os
+import asyncio
+
+import pytest
+
+from mcat_providers.batch import refresh_id_index
+from mcat_providers.sources import BaseSource
+from mcat_providers.utils.id_index import SourceIdIndex, gmid_to_key, key_to_gmid
+
+def test_keys_round_trip():
+    assert key_to_gmid(gmid_to_key("M.278")) == "M.278"
+    assert key_to_gmid(gmid_to_key("S.1399")) == "S.1399"
+    assert gmid_to_key("M.278.1.2") is None
+    assert gmid_to_key("X.278") is None
+
+def test_save_and_reload(tmp_path):
+    path = str(tmp_path / "flixhq.idx")
+    index = SourceIdIndex(path)
+    for tmdb in range(1, 200):
+        assert index.set(f"M.{tmdb}", str(tmdb * 7), verified_at=1000)
+    index.set("S.1399", "39539")
+    assert index.save() == 200
+
+    reloaded = SourceIdIndex(path)
+    assert reloaded.get("M.150") == "1050"
+    assert reloaded.get("S.1399") == "39539"
+    assert reloaded.get("M.999") is None
+    assert reloaded.is_stale("M.1") and not reloaded.is_stale("S.1399")
+    assert len(reloaded) == 200
+    reloaded.close()
+
+def test_overlay_shadows_the_file(tmp_path):
+    path = str(tmp_path / "flixhq.idx")
+    index = SourceIdIndex(path)
+    index.set("M.1", "10")
+    index.set("M.2", "20")
+    index.save()
+
+    index.set("M.1", "11")
+    index.discard("M.2")
+    assert index.get("M.1") == "11" and "M.2" not in index
+    assert index.save() == 1
+    assert SourceIdIndex(path).get("M.1") == "11"
+
+@pytest.mark.parametrize("content", [b"", b"MC", b"MCID\x01\x00", b"NOPE" + bytes(12), b"MCID" + bytes(12) + bytes(5)])
+def test_invalid_files_are_ignored(tmp_path, content):
+    path = tmp_path / "flixhq.idx"
+    path.write_bytes(content)
+    index = SourceIdIndex(str(path))
+    assert index.get("M.1") is None
+    assert len(index) == 0
+
+def test_overlay_is_saved_once_full(tmp_path):
+    path = str(tmp_path / "flixhq.idx")
+    index = SourceIdIndex(path, max_overlay=8)
+    for tmdb in range(1, 20):
+        index.set(f"M.{tmdb}", str(tmdb))
+        assert len(index._overlay) < 8
+    assert os.path.exists(path)
+    assert len(index) == 19 and index.get("M.3") == "3"
+
+def test_overlay_is_bounded_when_saving_fails(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    # The parent "directory" is a file, so every save fails
+    index = SourceIdIndex(str(blocker / "flixhq.idx"), max_overlay=8)
+    for tmdb in range(1, 40):
+        index.set(f"M.{tmdb}", str(tmdb))
+        assert len(index._overlay) < 8
+    # The newest writes are the ones kept
+    assert index.get("M.39") == "39" and index.get("M.1") is None
+
+def test_refresh_needs_a_searchable_source(tmp_path):
+    class Unsearchable(BaseSource):
+        name = "unsearchable"
+        base = "https://example.com"
+
+    with pytest.raises(ValueError):
+        asyncio.run(refresh_id_index(Unsearchable(), [], index=SourceIdIndex(str(tmp_path / "x.idx"))))
+
+def test_overlay_is_saved_off_the_event_loop(tmp_path):
+    path = str(tmp_path / "flixhq.idx")
+    index = SourceIdIndex(path, max_overlay=8)
+
+    async def main():
+        for tmdb in range(1, 9):
+            index.set(f"M.{tmdb}", str(tmdb))
+        # Scheduled, not written from inside set()
+        assert not os.path.exists(path)
+        await index._flush
+        assert not index.dirty and len(SourceIdIndex(path)) == 8
+
+        flush = asyncio.ensure_future(index.flush())
+        # The save has taken its snapshot and is writing in its thread
+        await asyncio.sleep(0)
+        index.set("M.100", "100")
+        await flush
+
+    asyncio.run(main())
+    # Set while the save ran, so still pending
+    assert list(index._overlay) == [gmid_to_key("M.100")]
+    assert len(SourceIdIndex(path)) == 8 and len(index) == 9
+
+def test_saves_from_two_processes_are_merged(tmp_path):
+    path = str(tmp_path / "flixhq.idx")
+    server, batch = SourceIdIndex(path), SourceIdIndex(path)
+    server.set("M.1", "10", verified_at=100)
+    server.set("M.2", "20", verified_at=100)
+    batch.set("M.2", "21", verified_at=200)
+    batch.set("M.3", "30", verified_at=200)
+    batch.save()
+    # The server saves last, from a snapshot that never saw M.3, and its M.2 is older
+    assert server.save() == 3
+
+    merged = SourceIdIndex(path)
+    assert (merged.get("M.1"), merged.get("M.2"), merged.get("M.3")) == ("10", "21", "30")
+    server.discard("M.1")
+    server.save()
+    assert "M.1" not in SourceIdIndex(path) and len(SourceIdIndex(path)) == 2
@@ -0,0 +1,134 @@
+import time
+import asyncio
+import httpx
+
+from mcat_providers.utils.limiter import AIMDLimiter, parse_retry_after
+
+from tests.helpers import mock_transport
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+def test_concurrency_shrinks_on_throttling_and_grows_back():
+    limiter = AIMDLimiter(rate=1000, max_concurrency=8, cooldown=0)
+
+    async def main():
+        await limiter.acquire()
+        limiter.release(status=429)
+        after_throttle = limiter.concurrency
+        await limiter.acquire()
+        limiter.release(status=503)
+        after_error = limiter.concurrency
+        for _ in range(200):
+            await limiter.acquire()
+            limiter.release(status=200, latency=0.01)
+        return after_throttle, after_error
+
+    after_throttle, after_error = asyncio.run(main())
+    assert after_throttle == 4 and after_error == 2
+    assert limiter.concurrency == 8
+    assert limiter.stats["throttled"] == 1 and limiter.stats["errors"] == 1
+
+def test_retry_after_pauses_the_host():
+    limiter = AIMDLimiter(rate=1000, max_concurrency=4)
+
+    async def main():
+        await limiter.acquire()
+        limiter.release(status=429, retry_after=0.2)
+        start = time.monotonic()
+        await limiter.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(main()) >= 0.19
+    assert limiter.stats["paused"] == 1
+
+def test_freed_slots_go_to_the_oldest_waiter():
+    limiter = AIMDLimiter(rate=10000, max_concurrency=1)
+    order = []
+
+    async def worker(name: str, hold: float) -> None:
+        await limiter.acquire()
+        order.append(name)
+        await asyncio.sleep(hold)
+        limiter.release(status=200, latency=hold)
+
+    async def main():
+        await limiter.acquire()
+        waiters = [asyncio.ensure_future(worker(f"waiter-{i}", 0.001)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        limiter.release(status=200, latency=0.01)
+        # Arrives after the slot was freed but before the woken waiter ran, it must not jump the queue
+        late = asyncio.ensure_future(worker("late", 0.001))
+        await asyncio.gather(*waiters, late)
+
+    asyncio.run(main())
+    assert order == ["waiter-0", "waiter-1", "waiter-2", "late"]
+
+def test_cancelled_waiter_passes_its_slot_on():
+    limiter = AIMDLimiter(rate=10000, max_concurrency=1)
+
+    async def main():
+        await limiter.acquire()
+        first = asyncio.ensure_future(limiter.acquire())
+        second = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.01)
+        limiter.release(status=200, latency=0.01)
+        first.cancel()
+        await asyncio.wait_for(second, 1)
+        return limiter.inflight
+
+    assert asyncio.run(main()) == 1
+
+def test_transport_honours_retry_after_and_recovers_from_5xx():
+    responses = [
+        httpx.Response(429, headers={"Retry-After": "1"}),
+        httpx.Response(503),
+        httpx.Response(200, text="ok"),
+    ]
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(time.monotonic())
+        return responses.pop(0) if responses else httpx.Response(200, text="ok")
+
+    transport = mock_transport(handler, rate_limit=True, throttle_retries=2, host_rates={"example.com": 100.0})
+
+    async def main():
+        response = await transport.get("https://example.com/", site="test")
+        limiter = transport.limiter_for("https://example.com/")
+        shrunk = limiter.concurrency
+        # Sub-millisecond mock latencies are all noise, keep the latency spike rule out of it
+        limiter.latency_factor = float("inf")
+        for _ in range(100):
+            await transport.get("https://example.com/", site="test")
+        return response, shrunk, limiter
+
+    response, shrunk, limiter = asyncio.run(main())
+    assert response.status_code == 200
+    # The retry after the 429 waited out its Retry-After
+    assert seen[1] - seen[0] >= 0.95
+    assert transport.stats["throttle_retries"] == 2
+    # Halved by the throttling, then grown back additively by the successes
+    assert shrunk <= limiter.max_concurrency / 2
+    assert shrunk < limiter.concurrency <= limiter.max_concurrency
+
+def test_single_use_calls_are_not_retried():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.url.path)
+        return httpx.Response(503)
+
+    transport = mock_transport(handler, rate_limit=True, throttle_retries=2)
+
+    async def main():
+        once = await transport.get("https://example.com/getSources", site="get_sources", retry=False)
+        retried = await transport.get("https://example.com/other", site="test")
+        return once, retried
+
+    once, retried = asyncio.run(main())
+    assert once.status_code == 503 and retried.status_code == 503
+    assert requests == ["/getSources", "/other", "/other", "/other"]
@@ -0,0 +1,75 @@
+import sys
+
+from mcat_providers import plugins
+from mcat_providers.plugins import PROVIDER_GROUP, SOURCE_GROUP, LazyProviders, PluginRegistry, PluginSpec
+
+class FakeEntryPoint:
+    def __init__(self, name: str, value) -> None:
+        self.name = name
+        self.value = value
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        if isinstance(self.value, Exception):
+            raise self.value
+        return self.value
+
+def test_discovery_only_accepts_plugin_specs(monkeypatch):
+    spec = PluginSpec(name="mysource", target="my_package.sources:MySource", media_types=("Movie",))
+    entry_points = {
+        SOURCE_GROUP: [
+            FakeEntryPoint("mysource", spec),
+            FakeEntryPoint("notaspec", object()),
+            FakeEntryPoint("broken", ImportError("no module named my_package")),
+        ],
+        PROVIDER_GROUP: [FakeEntryPoint("myprovider", "my_package.providers:MyProvider")],
+    }
+    monkeypatch.setattr(plugins, "_entry_points", lambda group: entry_points[group])
+
+    registry = PluginRegistry()
+    # Nothing is scanned until the first lookup
+    assert all(entry_point.loads == 0 for group in entry_points.values() for entry_point in group)
+    assert [found.name for found in registry.sources()] == ["mysource"]
+    assert registry.source("notaspec") is None and registry.source("broken") is None
+    assert registry.providers() == [] and registry.provider("myprovider") is None
+    # The spec is used as declared, the plugin it points at is never imported
+    assert not spec.loaded
+
+def test_supports_filters_on_host_and_media_type():
+    movies = PluginSpec(name="movies", target="x:Movies", media_types=("Movie",), hosts=("movies.to",))
+    anything = PluginSpec(name="anything", target="x:Anything")
+    registry = PluginRegistry(sources=(movies, anything), discover=False)
+
+    assert [spec.name for spec in registry.sources(media_type="movie")] == ["movies", "anything"]
+    assert [spec.name for spec in registry.sources(media_type="tv")] == ["anything"]
+    # Subdomains of a declared host match, other hosts do not
+    assert [spec.name for spec in registry.sources(host="www.Movies.to")] == ["movies", "anything"]
+    assert [spec.name for spec in registry.sources(host="notmovies.to")] == ["anything"]
+    assert [spec.name for spec in registry.sources(media_type="tv", host="movies.to")] == ["anything"]
+
+def test_providers_are_only_imported_on_get(tmp_path, monkeypatch):
+    module = "mcat_fake_provider_plugin"
+    (tmp_path / f"{module}.py").write_text(
+        "class FakeProvider:\n"
+        "    def __init__(self, **kwargs):\n"
+        "        self.kwargs = kwargs\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, module, raising=False)
+
+    spec = PluginSpec(name="fake", target=f"{module}:FakeProvider", servers=("FakeCloud",))
+    registry = PluginRegistry(providers=(spec,), discover=False)
+    providers = LazyProviders(registry, known=("megacloud",), headers={"a": "b"})
+
+    assert providers.handles("fakecloud") and not providers.handles("megacloud")
+    assert module not in sys.modules and not spec.loaded
+
+    provider = providers.get("FakeCloud")
+    assert module in sys.modules and spec.loaded
+    assert provider.kwargs == {"headers": {"a": "b"}}
+    # Built once per server
+    assert providers.get("fakecloud") is provider
+    # Seen but unhandled servers map to None, unknown ones to the default
+    assert providers.get("megacloud", default="missing") is None
+    assert providers.get("other", default="missing") == "missing"
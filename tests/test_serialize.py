@@ -0,0 +1,79 @@
+import io
+import json
+
+from mcat_providers.probe import ProbeResult
+from mcat_providers.utils.hls import parse_media
+from mcat_providers.utils.serialize import NDJSONWriter, loads_json, packb, read_ndjson, to_json_bytes, unpackb
+from mcat_providers.utils.types import ProviderHeaders, ProviderResponse, SourceResponse, Stream, Subtitle
+
+HEADERS = ProviderHeaders(origin="https://example.com", referrer="https://example.com/embed")
+
+def make_result() -> SourceResponse:
+    index = parse_media("#EXTM3U\n#EXTINF:10,\na.ts\n#EXTINF:10,\nb.ts\n#EXT-X-ENDLIST\n", "https://cdn.example.com/1080/index.m3u8")
+    streams = [
+        Stream(
+            provider="Rabbitstream",
+            headers=HEADERS,
+            url="https://cdn.example.com/1080/index.m3u8",
+            ext=".m3u8",
+            quality="1080p",
+            codec="avc1.64001f,mp4a.40.2",
+            bandwith=5000000,
+            audio_channels=6,
+            frame_rate=23.976,
+            index=index,
+            probe=ProbeResult("https://cdn.example.com/1080/index.m3u8", True, ttfb=0.12345, throughput=8.5e6, received=4096),
+        ),
+        Stream(provider="Rabbitstream", headers=HEADERS, url="https://cdn.example.com/720/index.m3u8", ext=".m3u8", quality="720p"),
+    ]
+    subtitles = [Subtitle("English", "https://cdn.example.com/en.vtt", ".vtt"), Subtitle("Français \"CC\"", "https://cdn.example.com/fr.vtt", ".vtt")]
+    return SourceResponse("FlixHq", [ProviderResponse("Rabbitstream", streams, subtitles), None])
+
+def test_json_matches_the_dict_encoding():
+    result = make_result()
+    expected = json.dumps(result.as_dict).encode()
+    assert to_json_bytes(result) == expected
+    # Fragments are cached on the objects, a second encode must not change anything
+    assert result.to_json_bytes() == expected
+
+def test_json_round_trip():
+    result = make_result()
+    loaded = loads_json(to_json_bytes(result))
+    assert loaded.as_dict["providers"][0]["subtitles"] == result.as_dict["providers"][0]["subtitles"]
+    stream, original = loaded.providers[0].streams[0], result.providers[0].streams[0]
+    assert stream == original
+    assert stream.probe.throughput == original.probe.throughput
+    # Only the summary of the index is written, the segment arrays are not rebuilt
+    assert stream.index is None
+
+def test_msgpack_round_trip():
+    result = make_result()
+    assert unpackb(packb(result), raw=True) == json.loads(to_json_bytes(result))
+    loaded = unpackb(packb(result))
+    assert loaded.providers[0].streams == result.providers[0].streams
+
+def test_msgpack_plain_values():
+    values = {"ints": [0, 1, -1, 127, 128, -33, 65536, 2 ** 40, -(2 ** 40)], "float": 1.5, "none": None, "bool": [True, False], "text": "é" * 40}
+    assert unpackb(packb(values), raw=True) == values
+
+def test_ndjson_round_trip():
+    result = make_result()
+    buffer = io.BytesIO()
+    writer = NDJSONWriter(buffer)
+    writer.write(result)
+    writer.write({"ok": False, "error": "No sources found"})
+    lines = buffer.getvalue().splitlines()
+    assert len(lines) == 2 and json.loads(lines[1]) == {"ok": False, "error": "No sources found"}
+
+    buffer.seek(0)
+    loaded = list(read_ndjson(buffer))
+    assert loaded[0].providers[0].streams == result.providers[0].streams
+    # Plain records (e.g. the per episode ones) come back as they were written
+    assert loaded[1] == {"ok": False, "error": "No sources found"}
+
+def test_ndjson_record_with_a_result_matches_the_dict_encoding():
+    result = make_result()
+    buffer = io.BytesIO()
+    NDJSONWriter(buffer).write({"key": "M.278", "ok": True, "result": result, "elapsed": 0.5})
+    expected = json.dumps({"key": "M.278", "ok": True, "result": result.as_dict, "elapsed": 0.5}).encode() + b"\n"
+    assert buffer.getvalue() == expected
@@ -0,0 +1,76 @@
+import asyncio
+
+from mcat_providers.config import settings
+from mcat_providers.plugins import registry
+from mcat_providers.server import ResolverServer
+
+class FakeSource:
+    name = "fake"
+
+    def __init__(self) -> None:
+        self.calls = []
+
+    async def warm_up(self) -> None:
+        pass
+
+    async def scrape_all(self, **kwargs):
+        self.calls.append(kwargs)
+        return None
+
+def test_malformed_parameters_are_a_bad_request():
+    source = FakeSource()
+
+    async def main():
+        server = ResolverServer({"fake": source})
+        server.ready.set()
+        results = [
+            await server.resolve({"tmdb": "278", "timeout": "soon"}),
+            await server.resolve({"tmdb": "278", "probe": "-1"}),
+            await server.resolve({"tmdb": "278", "timeout": "nan"}),
+            await server.resolve({"tmdb": "278", "timeout": "2.5", "probe": ""}),
+        ]
+        return results
+
+    results = asyncio.run(main())
+    assert [status for status, _ in results] == [400, 400, 400, 404]
+    assert "timeout" in results[0][1]["error"] and "probe" in results[1][1]["error"]
+    # Only the valid request reached the source
+    assert len(source.calls) == 1
+    assert source.calls[0]["timeout"] == 2.5 and source.calls[0]["probe_budget"] is None
+
+def test_post_body_must_be_a_json_object():
+    source = FakeSource()
+
+    async def main():
+        server = ResolverServer({"fake": source})
+        server.ready.set()
+        bodies = [b"[]", b'"x"', b"1", b"null", b"{nope", b'{"tmdb": "278"}']
+        return [await server.route("POST", "/resolve", body) for body in bodies]
+
+    results = asyncio.run(main())
+    assert [status for status, _ in results] == [400, 400, 400, 400, 400, 404]
+    assert results[0][1] == {"error": "Body must be a JSON object"}
+    assert len(source.calls) == 1
+
+def test_close_releases_what_was_kept_warm(monkeypatch):
+    shut_down, closed = [], []
+    spec = registry.provider("rabbitstream")
+    provider = spec.load()
+    monkeypatch.setattr(provider, "shutdown", classmethod(lambda cls: shut_down.append(cls.__name__)))
+
+    async def aclose():
+        closed.append(True)
+
+    monkeypatch.setattr(settings, "aclose", aclose)
+
+    async def main():
+        server = ResolverServer({"fake": FakeSource()})
+        task = asyncio.ensure_future(server.serve_forever(host="127.0.0.1", port=0))
+        await asyncio.wait_for(server.ready.wait(), 5)
+        server.stopping.set()
+        await asyncio.wait_for(task, 5)
+        return server
+
+    server = asyncio.run(main())
+    assert server._server is None
+    assert shut_down == ["Rabbitstream"] and closed == [True]
@@ -0,0 +1,92 @@
+import time
+import asyncio
+import httpx
+import pytest
+
+from mcat_providers.utils.deadline import Deadline, _current_deadline
+from mcat_providers.utils.exceptions import DeadlineExceeded
+
+from tests.helpers import mock_transport
+
+def hedging_transport(handler):
+    transport = mock_transport(handler, hedge=True, hedge_sites={"test"}, hedge_min_samples=100, hedge_min_delay=0.01)
+    # p95 of these is 0.096s
+    for sample in range(1, 101):
+        transport.latency.record("test", sample / 1000)
+    return transport
+
+def test_hedge_fires_at_p95_and_the_first_reply_wins():
+    arrived = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        arrived.append(time.monotonic())
+        if len(arrived) == 1:
+            # The primary is stuck, the hedge answers straight away
+            await asyncio.sleep(2)
+            return httpx.Response(200, text="primary")
+        return httpx.Response(200, text="hedge")
+
+    transport = hedging_transport(handler)
+    start = time.monotonic()
+    response = asyncio.run(transport.get("https://example.com/", site="test"))
+    assert response.text == "hedge" and time.monotonic() - start < 1
+    assert len(arrived) == 2 and 0.09 <= arrived[1] - arrived[0] < 0.5
+    assert transport.stats["hedged"] == 1 and transport.stats["hedge_wins"] == 1
+
+def test_no_hedge_under_p95():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, text="primary")
+
+    transport = hedging_transport(handler)
+    response = asyncio.run(transport.get("https://example.com/", site="test"))
+    assert response.text == "primary" and transport.stats["hedged"] == 0
+
+def test_deadline_caps_the_request_and_is_counted_when_it_runs_out():
+    timeouts = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        timeouts.append(request.extensions["timeout"])
+        await asyncio.sleep(2)
+        return httpx.Response(200)
+
+    transport = mock_transport(handler)
+
+    async def main():
+        # Set directly rather than through `Deadline.run`, so only the transport's own cut off is raced
+        _current_deadline.set(Deadline(0.1))
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await transport.get("https://example.com/", site="test")
+        elapsed = time.monotonic() - start
+        # Spent, the next request is not even sent
+        with pytest.raises(DeadlineExceeded):
+            await transport.get("https://example.com/", site="test")
+        return elapsed
+
+    elapsed = asyncio.run(main())
+    assert elapsed < 1
+    assert len(timeouts) == 1 and all(value <= 0.1 for value in timeouts[0].values())
+    assert transport.stats["deadline_exceeded"] == 2
+
+def test_hedge_reply_that_lands_with_the_winner_is_closed():
+    transport = mock_transport(lambda request: httpx.Response(200), hedge=True, hedge_min_samples=1, hedge_min_delay=0.01)
+    transport.latency.record("test", 0.01)
+    sent = []
+
+    async def main():
+        gate = asyncio.Event()
+        # Released only once both are waiting, so they finish in the same wakeup
+        asyncio.get_running_loop().call_later(0.1, gate.set)
+
+        async def send() -> httpx.Response:
+            response = httpx.Response(200, stream=httpx.ByteStream(b"ok"))
+            sent.append(response)
+            await gate.wait()
+            return response
+
+        return await transport._hedged(send, "test")
+
+    winner = asyncio.run(main())
+    assert len(sent) == 2 and transport.stats["hedged"] == 1
+    assert not winner.is_closed
+    assert [response.is_closed for response in sent if response is not winner] == [True]